@@ -1,3 +1,4 @@
+from django.apps import AppConfig
 from django.shortcuts import render
 
 def inicio(request):
@@ -5,3 +6,11 @@ def inicio(request):
 
 def painel_admin(request):
     return render(request, 'admin.html')
+
+
+class FormularioConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'Formulario'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (registra os receivers)
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import CustomUser, Professional
+
+# Claims de papel embutidos nos tokens (ver role_claims)
+ROLE_CLAIMS = ('is_owner', 'is_admin', 'is_client', 'is_superuser', 'is_staff')
+VERSION_CLAIM = 'rv'
+
+
+def role_version_key(user_id):
+    return f'auth:role_version:{user_id}'
+
+
+def role_version_timeout():
+    """
+    Validade da versão em cache (segundos), limitada à do access token. O cache padrão (LocMemCache) é por
+    processo: bump_role_version só apaga a chave do processo que fez a mudança, e os demais workers (ou um
+    comando de manage.py) passam a enxergá-la quando a chave expira.
+    """
+    return min(getattr(settings, 'ROLE_VERSION_CACHE_TIMEOUT', 60), api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def role_version(user_id):
+    """
+    Versão atual dos papéis do usuário. Fica no cache por role_version_timeout(); o banco só é consultado
+    quando a chave não existe.
+    """
+    key = role_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = CustomUser.objects.filter(pk=user_id).values_list('role_version', flat=True).first()
+        if version is None:
+            return None
+        cache.set(key, version, role_version_timeout())
+    return version
+
+
+def bump_role_version(user_ids):
+    """
+    Invalida os tokens emitidos com os papéis antigos (o cliente precisa renovar o access token).
+    """
+    user_ids = [user_id for user_id in set(user_ids) if user_id is not None]
+    if not user_ids:
+        return
+    CustomUser.objects.filter(pk__in=user_ids).update(role_version=F('role_version') + 1)
+    cache.delete_many([role_version_key(user_id) for user_id in user_ids])
+
+
+def role_claims(token, user):
+    """
+    Adiciona papéis, estabelecimento (admins/profissionais) e versão dos papéis ao token.
+    """
+    profile = Professional.objects.filter(user_account_id=user.pk).values_list('id', 'establishment_id').first()
+    for claim in ROLE_CLAIMS:
+        token[claim] = bool(getattr(user, claim))
+    token['professional'] = profile[0] if profile else None
+    token['establishment'] = profile[1] if profile else None
+    token[VERSION_CLAIM] = role_version(user.pk)
+    return token
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return role_claims(super().get_token(user), user)
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Ao renovar, os claims são recalculados a partir do banco, e não copiados do refresh token:
+    assim uma mudança de papel vale no máximo até o access token expirar ou a versão mudar.
+    """
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = CustomUser.objects.get(pk=access[api_settings.USER_ID_CLAIM])
+        data['access'] = str(role_claims(access, user))
+        return data
+
+
+class RoleTokenUser(TokenUser):
+    """
+    Usuário montado só com os claims do token (sem consulta ao banco).
+    """
+    is_token_user = True
+
+    @cached_property
+    def id(self):
+        # O claim guarda o ID como texto; as permissões comparam com os IDs inteiros dos objetos
+        return CustomUser._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @property
+    def is_owner(self):
+        return self.token.get('is_owner', False)
+
+    @property
+    def is_admin(self):
+        return self.token.get('is_admin', False)
+
+    @property
+    def is_client(self):
+        return self.token.get('is_client', False)
+
+    @property
+    def professional_id(self):
+        return self.token.get('professional')
+
+    @property
+    def establishment_id(self):
+        return self.token.get('establishment')
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Em leituras (GET/HEAD/OPTIONS), o usuário é montado a partir dos claims do token, sem buscar o
+    CustomUser; a versão dos papéis é conferida no cache e tokens desatualizados são recusados (401).
+    Escritas, tokens sem claims de papel e JWT_STATELESS_READS = False usam o usuário do banco.
+    """
+    def authenticate(self, request):
+        self.request = request
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if role_version(user_id) != validated_token[VERSION_CLAIM]:
+            raise InvalidToken("Os papéis do usuário mudaram; renove o token.")
+        if getattr(settings, 'JWT_STATELESS_READS', True) and self.request.method in SAFE_METHODS:
+            return RoleTokenUser(validated_token)
+        return super().get_user(validated_token)
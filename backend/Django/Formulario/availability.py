@@ -0,0 +1,54 @@
+from django.db import transaction
+
+from . import slot_cache
+from .booking import lock_professional
+from .models import Availability
+
+
+def merge_windows(windows):
+    """
+    Une janelas sobrepostas ou encostadas do mesmo dia da semana.
+    'windows' são tuplas (day_of_week, start_time, end_time); retorna a lista ordenada e sem sobreposições.
+    """
+    merged = []
+    for day_of_week, start_time, end_time in sorted(windows):
+        if merged and merged[-1][0] == day_of_week and start_time <= merged[-1][2]:
+            merged[-1] = (day_of_week, merged[-1][1], max(merged[-1][2], end_time))
+        else:
+            merged.append((day_of_week, start_time, end_time))
+    return merged
+
+
+def replace_weekly_schedule(professional_id, windows):
+    """
+    Troca a semana inteira do profissional de forma atômica: um DELETE das janelas que saíram e um
+    bulk_create das novas (as que não mudaram ficam). Roda sob o lock do profissional, então agendamentos
+    e consultas de horários nunca veem a semana pela metade. Retorna (criadas, removidas).
+    """
+    desired = set(merge_windows(windows))
+    with transaction.atomic():
+        lock_professional(professional_id)
+        existing = {
+            (day_of_week, start_time, end_time): pk
+            for pk, day_of_week, start_time, end_time in Availability.objects.filter(professional_id=professional_id)
+            .values_list('id', 'day_of_week', 'start_time', 'end_time')
+        }
+        removed = [key for key in existing if key not in desired]
+        added = sorted(desired - existing.keys())
+        if removed:
+            # DELETE direto, sem carregar as linhas nem disparar post_delete por janela: a invalidação abaixo cobre os dias
+            Availability.objects.filter(pk__in=[existing[key] for key in removed])._raw_delete(Availability.objects.db)
+        Availability.objects.bulk_create([
+            Availability(professional_id=professional_id, day_of_week=day_of_week, start_time=start_time, end_time=end_time)
+            for day_of_week, start_time, end_time in added
+        ])
+
+        # Sem sinais no lote: invalida uma vez cada dia da semana afetado, só depois do commit
+        days_of_week = {key[0] for key in removed + added}
+
+        def invalidate():
+            for day_of_week in days_of_week:
+                slot_cache.invalidate_weekday(professional_id, day_of_week)
+
+        transaction.on_commit(invalidate)
+    return len(added), len(removed)
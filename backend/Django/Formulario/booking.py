@@ -0,0 +1,211 @@
+import bisect
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from . import holds, membership, occupancy, slot_cache
+from .models import Appointment, Professional
+from .scheduling import ACTIVE_APPOINTMENT_STATUSES, django_day_of_week, load_busy, load_holidays, load_windows
+
+# Motivos de recusa de um agendamento (código estável para o frontend + mensagem)
+REJECTION_MESSAGES = {
+    'service_mismatch': "O serviço não pertence ao estabelecimento do profissional.",
+    'professional_inactive': "O profissional não está ativo.",
+    'outside_availability': "O horário está fora da disponibilidade do profissional.",
+    'holiday': "O estabelecimento não atende nesta data.",
+    'overlap': "O horário selecionado não está disponível.",
+    'not_found': "Profissional ou serviço não encontrado.",
+}
+
+# Nome da restrição de exclusão criada no PostgreSQL (migração 0003)
+OVERLAP_CONSTRAINT = 'appointment_no_overlap'
+
+
+class BookingRejected(serializers.ValidationError):
+    def __init__(self, reason):
+        self.reason = reason
+        super().__init__({"detail": REJECTION_MESSAGES[reason], "reason": reason})
+
+
+def rejection(reason):
+    return {"reason": reason, "detail": REJECTION_MESSAGES[reason]}
+
+
+def check_booking(professional, service, start_time, exclude_id=None):
+    """
+    Verifica um agendamento com o mesmo validador dos agendamentos em lote (check_bookings): janelas de
+    disponibilidade mescladas, feriados (inclusive recorrentes) e sobreposição.
+    Retorna o código do motivo da recusa ou None se o horário puder ser agendado.
+    """
+    return check_bookings(
+        [(professional.pk, service.pk, start_time)], {professional.pk: professional}, {service.pk: service},
+        exclude_ids=[exclude_id] if exclude_id is not None else (),
+    )[0]
+
+
+def validate_booking(professional, service, start_time, exclude_id=None):
+    """
+    Igual a check_booking, mas levanta BookingRejected (HTTP 400 com 'detail' e 'reason').
+    """
+    reason = check_booking(professional, service, start_time, exclude_id=exclude_id)
+    if reason:
+        raise BookingRejected(reason)
+    return start_time + timedelta(minutes=service.duration_minutes)
+
+
+def lock_professional(professional_id):
+    """
+    Serializa agendamentos por profissional com um lock de linha em Professional (SELECT ... FOR UPDATE).
+    Deve ser chamado dentro de transaction.atomic(). No SQLite o lock de linha não existe, mas as transações
+    são abertas em modo IMMEDIATE (ver settings), o que já serializa as escritas.
+    """
+    return Professional.objects.select_for_update().only('id').get(pk=professional_id)
+
+
+def book_atomically(professional, service, start_time, save, exclude_id=None):
+    """
+    Valida e grava um agendamento sob o lock do profissional.
+    'save' recebe o end_time calculado e grava o agendamento; uma violação da restrição de exclusão
+    do banco (PostgreSQL) vira a mesma recusa por sobreposição.
+    """
+    try:
+        with transaction.atomic():
+            lock_professional(professional.pk)
+            # Reservas de checkout expiradas deixam de bloquear o horário antes da validação
+            holds.release_expired(professional_id=professional.pk)
+            end_time = validate_booking(professional, service, start_time, exclude_id=exclude_id)
+            return save(end_time)
+    except IntegrityError as exc:
+        if OVERLAP_CONSTRAINT in str(exc):
+            raise BookingRejected('overlap')
+        raise
+
+
+def check_bookings(candidates, professionals, services, exclude_ids=()):
+    """
+    Valida vários agendamentos de uma vez: feriados, disponibilidades e bitmaps de ocupação são carregados
+    com uma consulta cada, e a sobreposição é um AND bit a bit. Como os bits arredondam os agendamentos para
+    fora (ticks de 5 minutos), uma colisão nos bits é confirmada nos intervalos exatos, carregados com uma
+    busca por intervalo só quando alguma acontece. Candidatos aceitos passam a ocupar a agenda dos seguintes
+    do mesmo lote.
+
+    'candidates' é uma lista de (professional_id, service_id, start_time); 'professionals' e 'services'
+    são dicionários por ID; 'exclude_ids' são agendamentos ignorados na sobreposição (remarcações).
+    Retorna uma lista, na mesma ordem, com o motivo da recusa ou None.
+    """
+    reasons = [None] * len(candidates)
+    resolved = []
+    for index, (professional_id, service_id, start_time) in enumerate(candidates):
+        professional = professionals.get(professional_id)
+        service = services.get(service_id)
+        if professional is None or service is None:
+            reasons[index] = 'not_found'
+        elif professional.establishment_id != service.establishment_id:
+            reasons[index] = 'service_mismatch'
+        elif not professional.active:
+            reasons[index] = 'professional_inactive'
+        else:
+            end_time = start_time + timedelta(minutes=service.duration_minutes)
+            resolved.append((index, professional, start_time.astimezone(dt_timezone.utc), end_time.astimezone(dt_timezone.utc)))
+    if not resolved:
+        return reasons
+
+    professional_ids = {professional.id for _, professional, _, _ in resolved}
+    first_day = min(start for _, _, start, _ in resolved).date()
+    last_day = max(end for _, _, _, end in resolved).date()
+    holidays = load_holidays({professional.establishment_id for _, professional, _, _ in resolved}, first_day, last_day)
+    windows = load_windows(professional_ids)
+    bitmaps = occupancy.load_bitmaps(professional_ids, {start.date() for _, _, start, _ in resolved})
+    busy = None
+    accepted = []
+
+    for index, professional, start_utc, end_utc in sorted(resolved, key=lambda item: item[2]):
+        day = start_utc.date()
+        if day in holidays[professional.establishment_id]:
+            reasons[index] = 'holiday'
+            continue
+        # Janelas contíguas (ex.: 09-12 e 12-13) já vêm mescladas: o horário pode atravessar a divisa
+        day_windows = windows.get(professional.id, {}).get(django_day_of_week(day), [])
+        if end_utc.date() != day or not any(
+            window_start <= start_utc.time() and end_utc.time() <= window_end
+            for window_start, window_end in day_windows
+        ):
+            reasons[index] = 'outside_availability'
+            continue
+        key = (professional.id, day)
+        mask = occupancy.day_masks(start_utc, end_utc)[day]
+        if bitmaps.get(key, 0) & mask:
+            if busy is None:
+                busy = load_busy(
+                    professional_ids,
+                    min(start for _, _, start, _ in resolved),
+                    max(end for _, _, _, end in resolved),
+                    statuses=ACTIVE_APPOINTMENT_STATUSES,
+                    exclude_ids=exclude_ids,
+                )
+                for accepted_professional_id, interval in accepted:
+                    bisect.insort(busy[accepted_professional_id], interval)
+            # load_busy mescla os intervalos e os aceitos não se sobrepõem: basta olhar o anterior ao fim do candidato
+            professional_busy = busy[professional.id]
+            position = bisect.bisect_left(professional_busy, (end_utc,))
+            if position and professional_busy[position - 1][1] > start_utc:
+                reasons[index] = 'overlap'
+                continue
+            professional_busy.insert(position, (start_utc, end_utc))
+        elif busy is not None:
+            bisect.insort(busy[professional.id], (start_utc, end_utc))
+        bitmaps[key] = bitmaps.get(key, 0) | mask
+        accepted.append((professional.id, (start_utc, end_utc)))
+    return reasons
+
+
+def book_many(client, entries, professionals, services):
+    """
+    Cria vários agendamentos em uma única transação: trava os profissionais envolvidos (em ordem de ID,
+    evitando deadlocks), valida tudo com check_bookings e grava os aceitos com um bulk_create.
+    Como bulk_create não dispara sinais, bitmaps de ocupação, cache de horários e vínculos são atualizados aqui.
+
+    'entries' é uma lista de dicts com professional, service (IDs), start_time e notes.
+    Retorna (agendamentos criados, lista de motivos de recusa na ordem de 'entries').
+    """
+    professional_ids = sorted({entry['professional'] for entry in entries if entry['professional'] in professionals})
+    try:
+        with transaction.atomic():
+            list(Professional.objects.select_for_update().filter(pk__in=professional_ids).order_by('pk').values_list('pk', flat=True))
+            for professional_id in professional_ids:
+                holds.release_expired(professional_id=professional_id)
+
+            reasons = check_bookings(
+                [(entry['professional'], entry['service'], entry['start_time']) for entry in entries],
+                professionals, services,
+            )
+            to_create = []
+            for entry, reason in zip(entries, reasons):
+                if reason:
+                    continue
+                professional = professionals[entry['professional']]
+                service = services[entry['service']]
+                to_create.append(Appointment(
+                    client=client,
+                    professional=professional,
+                    service=service,
+                    establishment=professional.establishment,
+                    start_time=entry['start_time'],
+                    end_time=entry['start_time'] + timedelta(minutes=service.duration_minutes),
+                    total_amount=service.price,
+                    notes=entry.get('notes'),
+                ))
+            created = Appointment.objects.bulk_create(to_create)
+            membership.add([(appointment.establishment_id, appointment.client_id, membership.CLIENT) for appointment in created])
+
+            occupancy.add_intervals([(appointment.professional_id, appointment.start_time, appointment.end_time) for appointment in created])
+            slot_cache.invalidate_days([
+                (appointment.professional_id, appointment.establishment_id, slot_cache.appointment_days(appointment.start_time, appointment.end_time))
+                for appointment in created
+            ])
+    except IntegrityError as exc:
+        if OVERLAP_CONSTRAINT in str(exc):
+            raise BookingRejected('overlap')
+        raise
+    return created, reasons
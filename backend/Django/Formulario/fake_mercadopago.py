@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAYMENTS_PATH = '/v1/payments/'
+
+
+class FakeMercadoPago:
+    """
+    Servidor HTTP local que imita GET /v1/payments/{id} do Mercado Pago, para testes e benchmarks sem rede:
+
+        with FakeMercadoPago(latency=0.2) as server, override_settings(MERCADO_PAGO_API_URL=server.url):
+            server.add(123, 'approved', external_reference=appointment.id)
+
+    failures faz as primeiras consultas responderem HTTP 500; lookups conta as consultas recebidas.
+    """
+    def __init__(self, latency=0, failures=0):
+        self.payments = {}
+        self.latency = latency
+        self.failures = failures
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add(self, payment_id, status, external_reference, amount=50, payment_type_id='credit_card'):
+        self.payments[str(payment_id)] = {
+            'id': int(payment_id), 'status': status, 'external_reference': str(external_reference),
+            'transaction_amount': amount, 'payment_type_id': payment_type_id,
+        }
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def respond(self, path):
+        with self._lock:
+            self.lookups += 1
+            failing = self.failures > 0
+            self.failures -= failing
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            return 500, {'message': 'internal_error', 'status': 500}
+        path = path.split('?')[0]
+        payment = self.payments.get(path[len(PAYMENTS_PATH):]) if path.startswith(PAYMENTS_PATH) else None
+        if payment is None:
+            return 404, {'message': 'Payment not found', 'status': 404}
+        return 200, payment
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, como a API real
+
+            def do_GET(self):
+                status, body = fake.respond(self.path)
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,208 @@
+import gzip
+import time
+
+from django.conf import settings
+from django.core.exceptions import FieldError
+from django.utils.cache import patch_vary_headers
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField, RelatedField, ManyRelatedField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .metrics import current_stats
+
+try:
+    import orjson
+except ImportError: # Sem o pacote, o JSON sai do próprio JSONRenderer (mesmos bytes, mais lento)
+    orjson = None
+
+try:
+    import brotli
+except ImportError: # Opcional: sem o pacote, apenas gzip é negociado
+    brotli = None
+
+# Tipos de coluna no plano de serialização
+VALUE = 'value'
+RAW = 'raw'
+FILE = 'file'
+NESTED = 'nested'
+
+
+class Unsupported(Exception):
+    pass
+
+
+def source_path(field):
+    return '__'.join(field.source_attrs)
+
+
+def build_plan(serializer, model, prefix=''):
+    """
+    Traduz os campos de leitura de um serializer em colunas de .values(): [(nome, tipo, caminho, extra)].
+    Levanta Unsupported para campos que não saem direto de uma coluna (métodos, source='*', many=True...).
+    """
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, (serializers.SerializerMethodField, serializers.HiddenField, ManyRelatedField)):
+            raise Unsupported(name)
+        path = prefix + source_path(field)
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer) or len(field.source_attrs) != 1:
+                raise Unsupported(name)
+            related = model._meta.get_field(field.source).related_model
+            plan.append((name, NESTED, path, build_plan(field, related, prefix=f'{path}__')))
+        elif isinstance(field, PrimaryKeyRelatedField):
+            plan.append((name, RAW, path, None)) # values() já devolve o ID
+        elif isinstance(field, RelatedField):
+            raise Unsupported(name)
+        elif isinstance(field, serializers.FileField):
+            model_field = model._meta.get_field(field.source) if len(field.source_attrs) == 1 else None
+            if model_field is None:
+                raise Unsupported(name)
+            plan.append((name, FILE, path, (field, model_field)))
+        else:
+            plan.append((name, VALUE, path, field.to_representation))
+    return plan
+
+
+def plan_paths(plan):
+    paths = []
+    for _, kind, path, extra in plan:
+        paths.append(path) # Para aninhados, a FK indica se a relação é nula
+        if kind == NESTED:
+            paths.extend(plan_paths(extra))
+    return paths
+
+
+def file_url(field, model_field, name, request):
+    """
+    Mesmo resultado de serializers.FileField.to_representation, a partir do nome salvo na coluna.
+    """
+    if not name:
+        return None
+    if not getattr(field, 'use_url', True):
+        return name
+    url = model_field.storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def render_row(plan, row, request):
+    data = {}
+    for name, kind, path, extra in plan:
+        value = row[path]
+        if value is None:
+            data[name] = None
+        elif kind == VALUE:
+            data[name] = extra(value)
+        elif kind == RAW:
+            data[name] = value
+        elif kind == FILE:
+            data[name] = file_url(extra[0], extra[1], value, request)
+        else:
+            data[name] = render_row(extra, row, request)
+    return data
+
+
+_plans = {}
+
+
+def plan_for(serializer_class, model):
+    if serializer_class not in _plans:
+        try:
+            _plans[serializer_class] = build_plan(serializer_class(), model)
+        except Unsupported:
+            _plans[serializer_class] = None
+    return _plans[serializer_class]
+
+
+def dumps(data):
+    """
+    JSON idêntico ao do JSONRenderer do DRF (compacto, UTF-8, com U+2028/U+2029 escapados).
+    """
+    if orjson is None:
+        return JSONRenderer().render(data)
+    return orjson.dumps(data).replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress(request, response):
+    """
+    Comprime corpos grandes com brotli (se instalado) ou gzip, conforme o Accept-Encoding.
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if len(response.content) < getattr(settings, 'FAST_LIST_COMPRESS_MIN_BYTES', 1024):
+        return response
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if brotli is not None and 'br' in accepted:
+        response.content = brotli.compress(response.content)
+        response['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.content = gzip.compress(response.content, compresslevel=6)
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renderiza com dumps (orjson); usado apenas para dados já convertidos pelo fast_list (str, int, bool, None).
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class FastListMixin:
+    """
+    Caminho rápido para o 'list': as linhas saem de .values() e são convertidas pelos próprios campos
+    do serializer (to_representation), sem instanciar modelos nem serializers por linha, e o JSON é gerado
+    com orjson. O resultado é byte a byte igual ao do caminho normal; quando o serializer tem campos
+    que não vêm de colunas, ou a resposta não é JSON, cai no 'list' padrão.
+    Desligado com FAST_LIST_RESPONSES = False.
+    """
+    def list(self, request, *args, **kwargs):
+        # JSON com parâmetros (ex.: 'indent') fica com o renderer do DRF
+        if (getattr(settings, 'FAST_LIST_RESPONSES', True) and isinstance(request.accepted_renderer, JSONRenderer)
+                and ';' not in request.accepted_media_type):
+            response = self.fast_list(request)
+            if response is not None:
+                return response
+        return super().list(request, *args, **kwargs)
+
+    def fast_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        plan = plan_for(self.get_serializer_class(), queryset.model)
+        if plan is None:
+            return None
+        keep = self.sparse_fields() if hasattr(self, 'sparse_fields') else None # ?fields= / ?exclude=
+        if keep is not None:
+            plan = [entry for entry in plan if entry[0] in keep]
+        try:
+            rows = queryset.values(*plan_paths(plan))
+        except FieldError:
+            return None
+
+        page = self.paginate_queryset(rows)
+        started = time.perf_counter()
+        data = [render_row(plan, row, request) for row in (rows if page is None else page)]
+        stats = current_stats.get()
+        if stats is not None:
+            stats.serializer_seconds += time.perf_counter() - started
+
+        response = Response(data) if page is None else self.get_paginated_response(data)
+        request.accepted_renderer = FastJSONRenderer()
+        response.add_post_render_callback(lambda rendered: compress(request, rendered))
+        return response
@@ -0,0 +1,149 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import occupancy, slot_cache
+from .models import Appointment
+
+
+def hold_ttl():
+    return timedelta(seconds=getattr(settings, 'SLOT_HOLD_TTL', 15 * 60))
+
+
+def hold_key(professional_id):
+    return f'holds:prof:{professional_id}'
+
+
+def place(appointment):
+    """
+    Reserva o horário do agendamento durante o checkout. As reservas ficam no cache, agrupadas por
+    profissional, para que o cálculo de horários não precise consultar a tabela de agendamentos.
+    Chamar sob o lock do profissional (booking.lock_professional), já que a gravação é ler-modificar-escrever.
+    """
+    now = timezone.now()
+    key = hold_key(appointment.professional_id)
+    holds = {
+        appointment_id: hold
+        for appointment_id, hold in (cache.get(key) or {}).items()
+        if hold[2] > now
+    }
+    holds[appointment.id] = (appointment.start_time, appointment.end_time, appointment.hold_expires_at)
+    cache.set(key, holds, cache_timeout_for(holds))
+
+
+def release(appointment):
+    key = hold_key(appointment.professional_id)
+    holds = cache.get(key)
+    if holds and appointment.id in holds:
+        holds.pop(appointment.id)
+        if holds:
+            cache.set(key, holds, cache_timeout_for(holds))
+        else:
+            cache.delete(key)
+
+
+def cache_timeout_for(holds):
+    remaining = max(hold[2] for hold in holds.values()) - timezone.now()
+    return max(int(remaining.total_seconds()) + 1, 1)
+
+
+def active_holds(professional_ids, now=None):
+    """
+    {professional_id: [(start, end), ...]} com as reservas ainda válidas, ordenadas por início.
+    """
+    now = now or timezone.now()
+    cached = cache.get_many([hold_key(professional_id) for professional_id in professional_ids])
+    result = {}
+    for professional_id in professional_ids:
+        holds = cached.get(hold_key(professional_id)) or {}
+        intervals = sorted((start, end) for start, end, expires_at in holds.values() if expires_at > now)
+        if intervals:
+            result[professional_id] = intervals
+    return result
+
+
+def subtract(intervals, holds):
+    """
+    Remove as reservas (ordenadas) de uma lista de intervalos livres (ordenada).
+    """
+    free = []
+    for start, end in intervals:
+        for hold_start, hold_end in holds:
+            if hold_end <= start or hold_start >= end:
+                continue
+            if hold_start > start:
+                free.append((start, hold_start))
+            start = max(start, hold_end)
+            if start >= end:
+                break
+        if start < end:
+            free.append((start, end))
+    return free
+
+
+def available_intervals(professionals, start_date, end_date):
+    """
+    Intervalos livres (com cache) descontando as reservas de checkout em andamento.
+    Mesma interface de scheduling.free_intervals.
+    """
+    professionals = list(professionals)
+    intervals = slot_cache.cached_free_intervals(professionals, start_date, end_date)
+    for professional_id, holds in active_holds([professional.id for professional in professionals]).items():
+        intervals[professional_id] = {
+            day: subtract(day_intervals, holds)
+            for day, day_intervals in intervals[professional_id].items()
+        }
+    return intervals
+
+
+def expired_holds(now=None, professional_id=None):
+    """
+    Agendamentos aguardando pagamento cuja reserva expirou (inclui os antigos, sem hold_expires_at).
+    """
+    now = now or timezone.now()
+    queryset = Appointment.objects.filter(status='PENDING_PAYMENT').filter(
+        Q(hold_expires_at__lte=now) | Q(hold_expires_at__isnull=True, updated_at__lte=now - hold_ttl())
+    )
+    if professional_id is not None:
+        queryset = queryset.filter(professional_id=professional_id)
+    return queryset
+
+
+def release_expired(now=None, batch_size=500, professional_id=None):
+    """
+    Cancela em lote os agendamentos com reserva expirada. Como o UPDATE em lote não dispara sinais,
+    o cache de horários e os bitmaps de ocupação dos dias afetados são atualizados aqui.
+    Retorna o número de agendamentos liberados.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                expired_holds(now, professional_id).order_by('id').values_list(
+                    'id', 'professional_id', 'establishment_id', 'start_time', 'end_time',
+                )[:batch_size]
+            )
+            if not rows:
+                return released
+            Appointment.objects.filter(id__in=[row[0] for row in rows], status='PENDING_PAYMENT').update(
+                status='CANCELED', payment_status='CANCELLED', hold_expires_at=None, updated_at=now,
+            )
+
+            days_by_professional = defaultdict(set)
+            cache_days = []
+            for _, row_professional_id, establishment_id, start_time, end_time in rows:
+                days = slot_cache.appointment_days(start_time, end_time)
+                days_by_professional[row_professional_id].update(days)
+                cache_days.append((row_professional_id, establishment_id, days))
+            for row_professional_id, days in days_by_professional.items():
+                occupancy.rebuild_days(row_professional_id, days)
+            slot_cache.invalidate_days(cache_days)
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Formulario import membership
+
+
+class Command(BaseCommand):
+    help = "Preenche a tabela de vínculos usuário ↔ estabelecimento a partir de donos, profissionais e agendamentos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--establishment', type=int, help="Limita a um estabelecimento (ID).")
+        parser.add_argument('--verify-only', action='store_true', help="Apenas compara os vínculos salvos com as tabelas de origem.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        establishment_id = options['establishment']
+        if not options['verify_only']:
+            created, removed = membership.sync(establishment_id, options['batch_size'])
+            self.stdout.write(f"{created} vínculos criados, {removed} removidos.")
+
+        missing, stale = membership.divergences(establishment_id)
+        for establishment, user, role in (missing + stale)[:20]:
+            self.stderr.write(f"Divergência: usuário {user} como {role} no estabelecimento {establishment}")
+        if missing or stale:
+            raise CommandError(f"{len(missing)} vínculos faltando e {len(stale)} sobrando.")
+        self.stdout.write(self.style.SUCCESS("Vínculos com estabelecimentos consistentes."))
@@ -0,0 +1,112 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from Formulario import fast_list
+from Formulario.models import Appointment, CustomUser, Establishment, Professional, Service
+from Formulario.serializers import AppointmentSerializer, ProfessionalSerializer, ServiceSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a serialização padrão do DRF com o caminho rápido (.values() + orjson) das listagens de "
+        "agendamentos, serviços e profissionais. Os dados são criados em uma transação desfeita ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=20000)
+        parser.add_argument('--professionals', type=int, default=200)
+        parser.add_argument('--services', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=200, help="Requisições de listagem por endpoint.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                owner = self.seed(options)
+                self.stdout.write(f"{'serialização completa':<28}{'DRF (linhas/s)':>16}{'rápido (linhas/s)':>20}{'ganho':>8}")
+                for label, serializer_class, queryset in self.datasets():
+                    self.compare_serialization(label, serializer_class, queryset)
+
+                self.stdout.write(f"\n{'GET de uma página':<28}{'DRF (req/s)':>16}{'rápido (req/s)':>20}{'ganho':>8}")
+                api = APIClient()
+                api.force_authenticate(owner)
+                for url in ('/api/appointments/', '/api/services/', '/api/professionals/'):
+                    self.compare_requests(api, url, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        owner = CustomUser.objects.create_user(email='benchmark-owner@thark.com', username='benchmark-owner', password=None, is_owner=True)
+        client = CustomUser.objects.create_user(email='benchmark-client@thark.com', username='benchmark-client', password=None, is_client=True)
+        establishment = Establishment.objects.create(owner=owner, name='Benchmark')
+        services = Service.objects.bulk_create(
+            Service(establishment=establishment, name=f'Serviço {index}', price='49.90', duration_minutes=30, description='Descrição')
+            for index in range(options['services'])
+        )
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f'benchmark-{index}@thark.com', username=f'benchmark-{index}', first_name='Profissional')
+            for index in range(options['professionals'])
+        )
+        professionals = Professional.objects.bulk_create(
+            Professional(establishment=establishment, name=f'Profissional {index}', specialty='Barbeiro', user_account=user)
+            for index, user in enumerate(users)
+        )
+        base = datetime(2030, 1, 1, 9, tzinfo=dt_timezone.utc)
+        Appointment.objects.bulk_create(
+            (
+                Appointment(
+                    client=client, professional=rng.choice(professionals), service=rng.choice(services),
+                    establishment=establishment, start_time=base + timedelta(minutes=30 * index),
+                    end_time=base + timedelta(minutes=30 * index + 30), total_amount='49.90',
+                )
+                for index in range(options['appointments'])
+            ),
+            batch_size=5000,
+        )
+        return owner
+
+    def datasets(self):
+        return [
+            ('agendamentos', AppointmentSerializer, Appointment.objects.select_related('client', 'professional', 'service', 'establishment')),
+            ('serviços', ServiceSerializer, Service.objects.all()),
+            ('profissionais', ProfessionalSerializer, Professional.objects.select_related('user_account')),
+        ]
+
+    def compare_serialization(self, label, serializer_class, queryset):
+        started = time.perf_counter()
+        regular = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        regular_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        plan = fast_list.plan_for(serializer_class, queryset.model)
+        fast = fast_list.dumps([fast_list.render_row(plan, row, None) for row in queryset.values(*fast_list.plan_paths(plan))])
+        fast_seconds = time.perf_counter() - started
+
+        if fast != regular:
+            self.stderr.write(f"{label}: saídas diferentes!")
+        rows = queryset.count()
+        self.stdout.write(f"{label:<28}{rows / regular_seconds:>16.0f}{rows / fast_seconds:>20.0f}{regular_seconds / fast_seconds:>7.1f}x")
+
+    def compare_requests(self, api, url, count):
+        results = []
+        for enabled in (False, True):
+            with override_settings(FAST_LIST_RESPONSES=enabled, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                started = time.perf_counter()
+                for _ in range(count):
+                    api.get(url)
+                results.append(count / (time.perf_counter() - started))
+        self.stdout.write(f"{url:<28}{results[0]:>16.0f}{results[1]:>20.0f}{results[1] / results[0]:>7.1f}x")
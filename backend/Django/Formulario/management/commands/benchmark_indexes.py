@@ -0,0 +1,200 @@
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from Formulario import holds
+from Formulario.models import Appointment, CustomUser, Establishment, Holiday, Notification, Professional, Service
+from Formulario.scheduling import ACTIVE_APPOINTMENT_STATUSES, BOOKED_STATUSES
+
+# Índices criados nas migrações 0005_scheduling_indexes e 0006_cursor_pagination_indexes
+BENCHMARK_INDEXES = {
+    Appointment: [
+        'appt_prof_time_status_idx', 'appt_client_start_id_idx', 'appt_active_prof_time_idx', 'appt_pending_hold_idx',
+        'appt_start_id_idx', 'appt_est_start_id_idx',
+    ],
+    Holiday: ['holiday_recurring_idx'],
+    Notification: ['notif_user_created_id_idx', 'notif_user_unread_idx'],
+}
+
+STATUSES = ['SCHEDULED'] * 5 + ['CONFIRMED'] * 2 + ['COMPLETED'] * 6 + ['CANCELED'] * 3 + ['NO_SHOW', 'PENDING_PAYMENT']
+INACTIVE_STATUSES = [status for status in STATUSES if status not in ACTIVE_APPOINTMENT_STATUSES]
+
+
+def is_scratch_database():
+    """
+    Banco descartável: o de testes do Django (test_*), um nome com 'scratch' ou SQLite em memória.
+    """
+    name = str(connection.settings_dict['NAME'])
+    basename = os.path.basename(name)
+    return basename.startswith('test') or 'scratch' in basename or name == ':memory:' or 'mode=memory' in name
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Popula uma massa de dados descartável e compara planos (EXPLAIN) e tempos das consultas de agenda "
+        "sem e com os índices das migrações 0005 e 0006. Tudo roda em uma transação desfeita ao final, mas os "
+        "índices ficam removidos durante a medição: só roda em um banco descartável (ex.: DATABASE_NAME=scratch.sqlite3)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=100000)
+        parser.add_argument('--professionals', type=int, default=50)
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--notifications', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5, help="Execuções por consulta (usa a mediana).")
+        parser.add_argument('--explain', action='store_true', help="Mostra os planos de execução.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.ensure_scratch_database()
+        self.stdout.write(f"Banco: {connection.vendor}")
+        try:
+            with transaction.atomic():
+                sample = self.seed(options)
+                queries = self.queries(sample)
+                self.analyze()
+
+                self.drop_indexes()
+                before = self.measure(queries, options, 'sem índices')
+                self.create_indexes()
+                self.analyze()
+                after = self.measure(queries, options, 'com índices')
+                self.report(before, after)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        owner = CustomUser.objects.create_user(email='benchmark-owner@thark.com', username='benchmark-owner', password=None, is_owner=True)
+        establishment = Establishment.objects.create(owner=owner, name='Benchmark')
+        service = Service.objects.create(establishment=establishment, name='Benchmark', price='10.00', duration_minutes=30)
+        professionals = Professional.objects.bulk_create(
+            Professional(establishment=establishment, name=f'Profissional {index}') for index in range(options['professionals'])
+        )
+        clients = CustomUser.objects.bulk_create(
+            CustomUser(email=f'benchmark-{index}@thark.com', username=f'benchmark-{index}', is_client=True)
+            for index in range(options['clients'])
+        )
+        Holiday.objects.bulk_create(
+            Holiday(establishment=establishment, date=datetime(2030, 1, 1).date() + timedelta(days=index), is_recurring=index % 10 == 0)
+            for index in range(0, 365, 7)
+        )
+
+        base = datetime(2030, 1, 1, 9, tzinfo=dt_timezone.utc)
+        now = datetime.now(dt_timezone.utc)
+        appointments = []
+        active_slots = set()
+        for index in range(options['appointments']):
+            professional = rng.choice(professionals)
+            start = base + timedelta(days=rng.randrange(365), minutes=30 * rng.randrange(18))
+            status = rng.choice(STATUSES)
+            if status in ACTIVE_APPOINTMENT_STATUSES:
+                # Horários em grade de 30 minutos: ativos do mesmo profissional e início se sobreporiam
+                # (appointment_no_overlap no PostgreSQL); o repetido entra com um status inativo
+                if (professional.id, start) in active_slots:
+                    status = rng.choice(INACTIVE_STATUSES)
+                else:
+                    active_slots.add((professional.id, start))
+            appointments.append(Appointment(
+                client=rng.choice(clients), professional=professional, service=service,
+                establishment=establishment, start_time=start, end_time=start + timedelta(minutes=30), status=status,
+                hold_expires_at=now + timedelta(minutes=rng.randrange(-30, 30)) if status == 'PENDING_PAYMENT' else None,
+            ))
+        Appointment.objects.bulk_create(appointments, batch_size=5000)
+        Notification.objects.bulk_create(
+            (
+                Notification(user=rng.choice(clients), message=f'Mensagem {index}', is_read=rng.random() < 0.8)
+                for index in range(options['notifications'])
+            ),
+            batch_size=5000,
+        )
+        return {
+            'establishment': establishment,
+            'professional': professionals[0],
+            'professionals': [professional.id for professional in professionals[:5]],
+            'client': clients[0],
+            'start': base + timedelta(days=180),
+        }
+
+    def queries(self, sample):
+        start = sample['start']
+        return {
+            'sobreposição (validador)': lambda: Appointment.objects.filter(
+                professional=sample['professional'], start_time__lt=start + timedelta(minutes=30),
+                end_time__gt=start, status__in=ACTIVE_APPOINTMENT_STATUSES,
+            ),
+            'ocupados por intervalo (slots)': lambda: Appointment.objects.filter(
+                professional_id__in=sample['professionals'], start_time__lt=start + timedelta(days=7),
+                end_time__gt=start, status__in=BOOKED_STATUSES,
+            ).values_list('professional_id', 'start_time', 'end_time'),
+            'agendamentos do cliente': lambda: Appointment.objects.filter(client=sample['client'])[:10],
+            'reservas expiradas': lambda: holds.expired_holds().values_list('id', flat=True),
+            'notificações do usuário': lambda: Notification.objects.filter(user=sample['client'])[:10],
+            'não lidas do usuário': lambda: Notification.objects.filter(user=sample['client'], is_read=False).values_list('id', flat=True),
+            'feriados recorrentes': lambda: Holiday.objects.filter(establishment=sample['establishment'], is_recurring=True),
+        }
+
+    def measure(self, queries, options, label):
+        results = {}
+        for name, build in queries.items():
+            if options['explain']:
+                self.stdout.write(f"\n[{label}] {name}\n{build().explain()}")
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(build())
+                timings.append(time.perf_counter() - started)
+            results[name] = statistics.median(timings)
+        return results
+
+    def report(self, before, after):
+        self.stdout.write(f"\n{'consulta':<34}{'sem (ms)':>12}{'com (ms)':>12}{'ganho':>10}")
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            self.stdout.write(f"{name:<34}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}{speedup:>9.1f}x")
+
+    def indexes(self):
+        for model, names in BENCHMARK_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    yield model, index
+
+    def ensure_scratch_database(self):
+        if not is_scratch_database():
+            raise CommandError(
+                f"O benchmark remove índices das tabelas de agenda: rode apenas em um banco descartável "
+                f"(nome começando com 'test' ou contendo 'scratch'), não em {connection.settings_dict['NAME']}."
+            )
+
+    def drop_indexes(self):
+        # DROP INDEX trava a tabela inteira até o rollback: nunca em um banco em uso
+        self.ensure_scratch_database()
+        # DROP INDEX sem tabela: sintaxe comum a SQLite e PostgreSQL
+        with connection.cursor() as cursor:
+            for _, index in self.indexes():
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def create_indexes(self):
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model, index in self.indexes():
+                cursor.execute(str(index.create_sql(model, schema_editor)))
+
+    def analyze(self):
+        # Atualiza as estatísticas usadas pelo planejador
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (Appointment, Holiday, Notification):
+                    cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
@@ -0,0 +1,152 @@
+import asyncio
+import gc
+import resource
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, transaction
+from django.test import override_settings
+
+from Formulario import push
+from Formulario.authentication import RoleTokenObtainPairSerializer
+from Formulario.models import CustomUser, Notification
+from Thark.asgi import application
+
+
+class Rollback(Exception):
+    pass
+
+
+class Connection:
+    """
+    Cliente ASGI em memória: mantém a requisição SSE aberta até disconnect() e guarda os eventos recebidos.
+    """
+    def __init__(self, token):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/api/notifications/stream/', 'raw_path': b'/api/notifications/stream/',
+            'query_string': f'token={token}'.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'accept', b'text/event-stream')],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        self.request_sent = False
+        self.closed = asyncio.Event()
+        self.opened = asyncio.Event()
+        self.status = None
+        self.received = asyncio.Event()
+        self.events = 0
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message['type'] == 'http.response.body':
+            self.opened.set()
+            if message.get('body', b'').startswith(b'id: '):
+                self.events += 1
+                self.received.set()
+
+    def disconnect(self):
+        self.closed.set()
+
+
+class Command(BaseCommand):
+    help = (
+        "Abre muitas conexões SSE ociosas no app ASGI deste processo e mede memória por conexão, tempo de abertura "
+        "e latência do fan-out de uma notificação para todas. Os dados criados são desfeitos ao final. "
+        "O tempo de abertura inclui o overhead do tracemalloc."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=100, help="Usuários distintos entre as conexões.")
+        parser.add_argument('--rounds', type=int, default=5, help="Rodadas de publicação para medir o fan-out.")
+
+    def handle(self, *args, **options):
+        hosts = [*settings.ALLOWED_HOSTS, 'localhost']
+        # Como no cliente de testes: fechar conexões ao fim de cada requisição derrubaria a transação descartável
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=hosts):
+                users = CustomUser.objects.bulk_create(
+                    CustomUser(email=f'push-{index}@thark.com', username=f'push-{index}', is_client=True)
+                    for index in range(options['users'])
+                )
+                tokens = [str(RoleTokenObtainPairSerializer.get_token(user).access_token) for user in users]
+                async_to_sync(self.run)(users, tokens, options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    async def run(self, users, tokens, options):
+        broker = push.get_broker()
+        count = options['connections']
+        connections = [Connection(tokens[index % len(tokens)]) for index in range(count)]
+
+        # Uma conexão de aquecimento: imports e caches da primeira requisição não entram na conta por conexão
+        warmup = Connection(tokens[0])
+        warmup_task = asyncio.create_task(application(warmup.scope, warmup.receive, warmup.send))
+        await warmup.opened.wait()
+        warmup.disconnect()
+        await warmup_task
+
+        gc.collect()
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(application(connection.scope, connection.receive, connection.send)) for connection in connections]
+        await asyncio.gather(*(connection.opened.wait() for connection in connections))
+        open_seconds = time.perf_counter() - started
+        await asyncio.sleep(0.1)
+        gc.collect()
+        memory_per_connection = (tracemalloc.get_traced_memory()[0] - memory_before) / count
+        tracemalloc.stop()
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before # KB no Linux
+
+        failed = sum(connection.status != 200 for connection in connections)
+        self.stdout.write(
+            f"{count} conexões abertas em {open_seconds:.2f}s ({count / open_seconds:.0f}/s), {broker.connections()} inscritas, {failed} falhas"
+        )
+        self.stdout.write(
+            f"Memória Python por conexão ociosa: {memory_per_connection / 1024:.1f} KiB (RSS máximo +{rss_growth / 1024:.1f} MiB); "
+            f"~{1024 ** 3 / max(memory_per_connection, 1):,.0f} conexões ociosas por GiB de heap"
+        )
+
+        latencies = []
+        for _ in range(options['rounds']):
+            for connection in connections:
+                connection.received.clear()
+            notifications = await sync_to_async(self.create_notifications)(users)
+            started = time.perf_counter()
+            await sync_to_async(push.publish_notifications)(notifications)
+            await asyncio.gather(*(connection.received.wait() for connection in connections))
+            latencies.append(time.perf_counter() - started)
+        self.stdout.write(
+            f"Fan-out de 1 notificação por usuário para {count} conexões: mediana {statistics.median(latencies) * 1000:.1f} ms, "
+            f"pior {max(latencies) * 1000:.1f} ms"
+        )
+
+        for connection in connections:
+            connection.disconnect()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stdout.write(f"Conexões inscritas após desconectar: {broker.connections()}")
+
+    @staticmethod
+    def create_notifications(users):
+        return Notification.objects.bulk_create(Notification(user=user, message='Benchmark', type='GENERAL') for user in users)
@@ -0,0 +1,68 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from Formulario import reminders
+from Formulario.models import Appointment, CustomUser, Establishment, NotificationOutbox, Professional, Service
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria agendamentos descartáveis nas próximas 24 horas e mede o envio dos lembretes (primeira execução, "
+        "repetição e a janela de 1 hora). Tudo roda em uma transação desfeita ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Banco: {connection.vendor}")
+        try:
+            with transaction.atomic():
+                now = self.seed(options)
+                self.measure("Primeira execução (janela de 24h)", now, options)
+                self.measure("Repetição (nada a enviar)", now, options)
+                self.measure("23h30 depois (janela de 1h)", now + timedelta(hours=23, minutes=30), options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        owner = CustomUser.objects.create(email='lembretes-dono@thark.com', username='lembretes-dono', is_owner=True)
+        establishment = Establishment.objects.create(owner=owner, name='Benchmark Lembretes')
+        service = Service.objects.create(establishment=establishment, name='Corte', price='50.00', duration_minutes=30)
+        professionals = Professional.objects.bulk_create(Professional(establishment=establishment, name=f'Profissional {index}') for index in range(50))
+        clients = CustomUser.objects.bulk_create(
+            CustomUser(email=f'lembretes-{index}@thark.com', username=f'lembretes-{index}', is_client=True) for index in range(1000)
+        )
+        appointments = []
+        for _ in range(options['appointments']):
+            start = now + timedelta(seconds=rng.randrange(60, 24 * 60 * 60))
+            appointments.append(Appointment(
+                client=rng.choice(clients), professional=rng.choice(professionals), service=service, establishment=establishment,
+                start_time=start, end_time=start + timedelta(minutes=30), status=rng.choice(['SCHEDULED', 'CONFIRMED']),
+            ))
+        Appointment.objects.bulk_create(appointments, batch_size=2000)
+        self.stdout.write(f"{len(appointments)} agendamentos nas próximas 24 horas")
+        return now
+
+    def measure(self, label, now, options):
+        queued = NotificationOutbox.objects.count()
+        started = time.perf_counter()
+        sent = reminders.send_due(now=now, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label}: {sent} lembretes em {elapsed:.2f}s; outbox +{NotificationOutbox.objects.count() - queued}"
+        )
@@ -0,0 +1,97 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from Formulario import payments
+from Formulario.fake_mercadopago import FakeMercadoPago
+from Formulario.models import Appointment, CustomUser, Establishment, PaymentWebhookEvent, Professional, Service
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Dispara uma rajada de notificações (com repetições) no webhook do Mercado Pago contra um servidor falso "
+        "com latência e mede o tempo de resposta do webhook e o processamento em lote. Os dados são desfeitos ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=500)
+        parser.add_argument('--duplicates', type=int, default=4, help="Notificações por pagamento (created + updated repetidos).")
+        parser.add_argument('--latency', type=float, default=0.2, help="Latência do Mercado Pago falso (segundos).")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with FakeMercadoPago(latency=options['latency']) as mercadopago, override_settings(
+            MERCADO_PAGO_API_URL=mercadopago.url, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            try:
+                with transaction.atomic():
+                    appointments = self.seed(options['payments'])
+                    for index, appointment in enumerate(appointments):
+                        mercadopago.add(900000 + index, 'approved', external_reference=appointment.id)
+                    self.burst(mercadopago, appointments, options)
+                    self.drain(mercadopago, appointments, options)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def seed(self, count):
+        owner = CustomUser.objects.create(email='webhook-dono@thark.com', username='webhook-dono', is_owner=True)
+        client = CustomUser.objects.create(email='webhook-cliente@thark.com', username='webhook-cliente', is_client=True)
+        establishment = Establishment.objects.create(owner=owner, name='Benchmark Webhook')
+        service = Service.objects.create(establishment=establishment, name='Corte', price='50.00', duration_minutes=30)
+        professional = Professional.objects.create(establishment=establishment, name='Profissional')
+        start = timezone.now() + timedelta(days=30)
+        return Appointment.objects.bulk_create(
+            Appointment(
+                client=client, professional=professional, service=service, establishment=establishment, status='PENDING_PAYMENT',
+                start_time=start + timedelta(minutes=30 * index), end_time=start + timedelta(minutes=30 * (index + 1)),
+            )
+            for index in range(count)
+        )
+
+    def burst(self, mercadopago, appointments, options):
+        client = Client()
+        actions = ['payment.created'] + ['payment.updated'] * (options['duplicates'] - 1)
+        latencies = []
+        started = time.perf_counter()
+        for action in actions:
+            for index in range(len(appointments)):
+                body = {'action': action, 'type': 'payment', 'data': {'id': str(900000 + index)}}
+                request_started = time.perf_counter()
+                response = client.post('/api/payments/webhook/', body, content_type='application/json')
+                latencies.append(time.perf_counter() - request_started)
+                assert response.status_code == 200, response.status_code
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        self.stdout.write(
+            f"Rajada: {len(latencies)} notificações em {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s); resposta do webhook "
+            f"mediana {statistics.median(latencies) * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms; "
+            f"{mercadopago.lookups} consultas ao Mercado Pago durante a rajada"
+        )
+        self.stdout.write(
+            f"Eventos gravados: {PaymentWebhookEvent.objects.count()} (antes, cada notificação prendia o worker "
+            f"na consulta síncrona: >= {options['latency'] * 1000:.0f} ms de latência do Mercado Pago)"
+        )
+
+    def drain(self, mercadopago, appointments, options):
+        lookups = mercadopago.lookups
+        started = time.perf_counter()
+        batches = 0
+        while payments.process(batch_size=options['batch_size'])['claimed']:
+            batches += 1
+        elapsed = time.perf_counter() - started
+        confirmed = Appointment.objects.filter(pk__in=[appointment.pk for appointment in appointments], status='CONFIRMED').count()
+        self.stdout.write(
+            f"Processamento: {batches} lotes em {elapsed:.2f}s, {mercadopago.lookups - lookups} consultas ao Mercado Pago, "
+            f"{confirmed}/{len(appointments)} agendamentos confirmados"
+        )
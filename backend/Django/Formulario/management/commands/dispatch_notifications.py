@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Formulario import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Despacha as notificações do outbox: cria as notificações in-app em lote e entrega aos adaptadores "
+        "de NOTIFICATION_DELIVERY_ADAPTERS, com novas tentativas e backoff exponencial."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Executa continuamente (worker).")
+        parser.add_argument('--interval', type=float, default=5, help="Segundos de espera com a fila vazia no modo --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            summary = outbox.dispatch(batch_size=options['batch_size'])
+            if summary['claimed'] or not options['loop']:
+                self.stdout.write(
+                    f"{summary['claimed']} eventos processados: {summary['sent']} enviados, "
+                    f"{summary['retrying']} para nova tentativa, {summary['failed']} com falha definitiva."
+                )
+            if not options['loop']:
+                return
+            if summary['claimed'] < options['batch_size']: # Lote cheio: ainda pode haver fila, segue sem esperar
+                time.sleep(options['interval'])
@@ -0,0 +1,60 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Formulario import onboarding
+from Formulario.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa estabelecimentos com serviços, profissionais, disponibilidades e feriados de um arquivo CSV ou JSON. "
+        "Tudo é validado antes e gravado em uma única transação; com qualquer erro nada é importado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo .csv ou .json.")
+        parser.add_argument('--owner', required=True, help="E-mail do proprietário dos estabelecimentos.")
+        parser.add_argument('--format', choices=['csv', 'json'], help="Padrão: pela extensão do arquivo.")
+        parser.add_argument('--dry-run', action='store_true', help="Apenas valida o arquivo.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        try:
+            owner = CustomUser.objects.get(email=options['owner'], is_owner=True)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"Proprietário não encontrado: {options['owner']}")
+        try:
+            content = path.read_bytes()
+        except OSError as exc:
+            raise CommandError(f"Não foi possível ler {path}: {exc}")
+
+        started = time.perf_counter()
+        try:
+            rows = onboarding.parse(content, options['format'] or ('csv' if path.suffix.lower() == '.csv' else 'json'))
+        except onboarding.OnboardingFormatError as exc:
+            raise CommandError(str(exc))
+        summary, errors = onboarding.import_setup(owner, rows, dry_run=options['dry_run'], batch_size=options['batch_size'])
+        if errors:
+            for error in errors:
+                self.stderr.write(f"Linha {error['row']}: {self.describe(error['errors'])}")
+            raise CommandError(f"{len(errors)} linhas com erro; nada foi importado.")
+
+        action = "validados" if options['dry_run'] else "importados"
+        self.stdout.write(
+            f"{len(summary['establishments'])} estabelecimentos, {summary['services']} serviços, {summary['professionals']} profissionais, "
+            f"{summary['availabilities']} disponibilidades e {summary['holidays']} feriados {action} "
+            f"em {time.perf_counter() - started:.2f}s ({len(rows)} linhas)."
+        )
+        for establishment in summary['establishments']:
+            self.stdout.write(f"  {establishment['name']}: /{establishment['slug']}")
+
+    @classmethod
+    def describe(cls, detail):
+        if isinstance(detail, dict):
+            return '; '.join(f"{field}: {cls.describe(value)}" for field, value in detail.items())
+        if isinstance(detail, list):
+            return ' '.join(cls.describe(value) for value in detail)
+        return str(detail)
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Formulario import payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Processa as notificações de pagamento gravadas pelo webhook: consulta o Mercado Pago em paralelo e "
+        "aplica as transições de agendamento e pagamento em lote, com novas tentativas e backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Executa continuamente (worker).")
+        parser.add_argument('--interval', type=float, default=2, help="Segundos de espera com a fila vazia no modo --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            summary = payments.process(batch_size=options['batch_size'])
+            if summary['claimed'] or not options['loop']:
+                self.stdout.write(
+                    f"{summary['claimed']} eventos processados: {summary['processed']} aplicados, {summary['ignored']} ignorados, "
+                    f"{summary['retrying']} para nova tentativa, {summary['failed']} com falha definitiva."
+                )
+            if not options['loop']:
+                return
+            if summary['claimed'] < options['batch_size']: # Lote cheio: ainda pode haver fila, segue sem esperar
+                time.sleep(options['interval'])
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Formulario import occupancy
+from Formulario.models import ProfessionalOccupancy
+
+
+class Command(BaseCommand):
+    help = "Reconstrói os bitmaps de ocupação a partir dos agendamentos e verifica se estão consistentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professional', type=int, help="Limita a um profissional (ID).")
+        parser.add_argument('--verify-only', action='store_true', help="Apenas compara os bitmaps salvos com os agendamentos.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        professional_id = options['professional']
+        stored = ProfessionalOccupancy.objects.all()
+        if professional_id is not None:
+            stored = stored.filter(professional_id=professional_id)
+
+        if not options['verify_only']:
+            expected = occupancy.expected_bitmaps(professional_id)
+            with transaction.atomic():
+                stored.delete()
+                ProfessionalOccupancy.objects.bulk_create(
+                    [
+                        ProfessionalOccupancy(professional_id=key[0], date=key[1], bitmap=occupancy.to_bytes(value))
+                        for key, value in expected.items() if value
+                    ],
+                    batch_size=options['batch_size'],
+                )
+            self.stdout.write(f"{len(expected)} bitmaps reconstruídos.")
+
+        mismatches = self.verify(stored, professional_id)
+        if mismatches:
+            for professional, day in mismatches[:20]:
+                self.stderr.write(f"Divergência: profissional {professional} em {day}")
+            raise CommandError(f"{len(mismatches)} bitmaps divergentes dos agendamentos.")
+        self.stdout.write(self.style.SUCCESS("Bitmaps de ocupação consistentes."))
+
+    def verify(self, stored, professional_id):
+        expected = {key: value for key, value in occupancy.expected_bitmaps(professional_id).items() if value}
+        actual = {
+            (professional, day): occupancy.to_int(bitmap)
+            for professional, day, bitmap in stored.values_list('professional_id', 'date', 'bitmap').iterator()
+        }
+        actual = {key: value for key, value in actual.items() if value}
+        return sorted(key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Formulario import holds
+
+
+class Command(BaseCommand):
+    help = "Libera as reservas de checkout expiradas, cancelando em lote os agendamentos presos em PENDING_PAYMENT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Executa continuamente (worker).")
+        parser.add_argument('--interval', type=float, default=60, help="Segundos entre execuções no modo --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            released = holds.release_expired(batch_size=options['batch_size'])
+            if released or not options['loop']:
+                self.stdout.write(f"{released} reservas expiradas liberadas.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Formulario import reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Enfileira no outbox os lembretes (APPOINTMENT_REMINDER) dos agendamentos que entraram nas janelas de "
+        "APPOINTMENT_REMINDER_WINDOWS. Pode rodar em paralelo ou ser repetido sem duplicar lembretes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', action='store_true', help="Executa continuamente (worker).")
+        parser.add_argument('--interval', type=float, default=60, help="Segundos entre execuções no modo --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = reminders.send_due(batch_size=options['batch_size'])
+            if sent or not options['loop']:
+                self.stdout.write(f"{sent} lembretes enfileirados.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,89 @@
+from django.db import transaction
+
+from .models import Appointment, Establishment, EstablishmentMembership, Professional
+
+OWNER = 'OWNER'
+PROFESSIONAL = 'PROFESSIONAL'
+CLIENT = 'CLIENT'
+
+
+def member_ids(establishment_id):
+    """
+    Subconsulta com os IDs dos usuários vinculados ao estabelecimento (índice único establishment/user/role).
+    """
+    return EstablishmentMembership.objects.filter(establishment_id=establishment_id).values('user_id')
+
+
+def add(rows):
+    """
+    Grava vínculos (establishment_id, user_id, role) em um único INSERT; os já existentes são ignorados.
+    """
+    rows = {row for row in rows if row[0] is not None and row[1] is not None}
+    if rows:
+        EstablishmentMembership.objects.bulk_create(
+            [EstablishmentMembership(establishment_id=establishment_id, user_id=user_id, role=role) for establishment_id, user_id, role in rows],
+            ignore_conflicts=True,
+        )
+
+
+def remove(establishment_id, user_id, role):
+    if establishment_id is not None and user_id is not None:
+        EstablishmentMembership.objects.filter(establishment_id=establishment_id, user_id=user_id, role=role).delete()
+
+
+def expected_memberships(establishment_id=None):
+    """
+    Vínculos calculados a partir das tabelas de origem: dono do estabelecimento, usuário do profissional
+    e clientes com agendamento (inclusive cancelados: o histórico continua visível ao admin).
+    """
+    establishments = Establishment.objects.all()
+    professionals = Professional.objects.filter(user_account__isnull=False)
+    appointments = Appointment.objects.filter(client__isnull=False)
+    if establishment_id is not None:
+        establishments = establishments.filter(pk=establishment_id)
+        professionals = professionals.filter(establishment_id=establishment_id)
+        appointments = appointments.filter(establishment_id=establishment_id)
+
+    expected = {(establishment, owner, OWNER) for establishment, owner in establishments.values_list('id', 'owner_id').iterator()}
+    expected.update(
+        (establishment, user, PROFESSIONAL)
+        for establishment, user in professionals.values_list('establishment_id', 'user_account_id').iterator()
+    )
+    expected.update(
+        (establishment, client, CLIENT)
+        for establishment, client in appointments.order_by().values_list('establishment_id', 'client_id').distinct().iterator()
+    )
+    return expected
+
+
+def sync(establishment_id=None, batch_size=1000):
+    """
+    Deixa a tabela igual aos vínculos esperados. Retorna (criados, removidos).
+    """
+    expected = expected_memberships(establishment_id)
+    stored = EstablishmentMembership.objects.all()
+    if establishment_id is not None:
+        stored = stored.filter(establishment_id=establishment_id)
+    actual = {
+        (establishment, user, role): pk
+        for pk, establishment, user, role in stored.values_list('id', 'establishment_id', 'user_id', 'role').iterator()
+    }
+    missing = expected - actual.keys()
+    stale = [pk for key, pk in actual.items() if key not in expected]
+    with transaction.atomic():
+        EstablishmentMembership.objects.bulk_create(
+            [EstablishmentMembership(establishment_id=establishment, user_id=user, role=role) for establishment, user, role in missing],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        for index in range(0, len(stale), batch_size):
+            EstablishmentMembership.objects.filter(pk__in=stale[index:index + batch_size]).delete()
+    return len(missing), len(stale)
+
+
+def divergences(establishment_id=None):
+    stored = EstablishmentMembership.objects.all()
+    if establishment_id is not None:
+        stored = stored.filter(establishment_id=establishment_id)
+    actual = set(stored.values_list('establishment_id', 'user_id', 'role').iterator())
+    expected = expected_memberships(establishment_id)
+    return sorted(expected - actual), sorted(actual - expected)
@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+METRICS = (
+    # (nome, campo do RequestStats, buckets, descrição)
+    ('thark_request_queries', 'queries', QUERY_BUCKETS, "Consultas SQL por requisição"),
+    ('thark_request_sql_seconds', 'sql_seconds', SECONDS_BUCKETS, "Tempo total de SQL por requisição"),
+    ('thark_request_serializer_seconds', 'serializer_seconds', SECONDS_BUCKETS, "Tempo em serializers por requisição"),
+    ('thark_request_duration_seconds', 'wall_seconds', SECONDS_BUCKETS, "Tempo total da requisição"),
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+        self.wall_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Usado como connection.execute_wrapper: conta e cronometra cada consulta
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+
+current_stats = ContextVar('current_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Histogramas agregados por (rota, método), em memória do processo.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, route, method, stats):
+        with self.lock:
+            for name, attribute, buckets, _ in METRICS:
+                key = (name, route, method)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(getattr(stats, attribute))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """
+        Exporta no formato texto do Prometheus (version 0.0.4).
+        """
+        lines = []
+        with self.lock:
+            for name, _, _, description in METRICS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, route, method), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    labels = f'route="{route}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class TimedSerializerMixin:
+    """
+    Acumula o tempo gasto em to_representation no RequestStats da requisição atual.
+    Apenas o serializer mais externo é cronometrado, para não contar aninhados duas vezes.
+    """
+    def to_representation(self, instance):
+        stats = current_stats.get()
+        if stats is None or stats.serializer_depth:
+            return super().to_representation(instance)
+        stats.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_seconds += time.perf_counter() - started
+            stats.serializer_depth -= 1
+
+
+def route_of(request):
+    """
+    Nome da rota para as views DRF do app (ex.: 'appointment-list'); None para as demais.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not hasattr(match.func, 'cls'):
+        return None
+    if not match.func.__module__.startswith('Formulario.'):
+        return None
+    return match.view_name or match.route
+
+
+class QueryMetricsMiddleware:
+    """
+    Registra, por rota, consultas SQL, tempo de SQL, tempo de serializers e tempo total das views DRF
+    do app, e compara o número de consultas com QUERY_BUDGETS (aviso no log ou erro em modo estrito).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        stats.wall_seconds = time.perf_counter() - started
+
+        route = route_of(request)
+        if route is not None:
+            registry.observe(route, request.method, stats)
+            self.check_budget(route, request, stats)
+        return response
+
+    def check_budget(self, route, request, stats):
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        budget = budgets.get(f'{request.method} {route}', budgets.get(route))
+        if budget is None or stats.queries <= budget:
+            return
+        message = f"Orçamento de consultas excedido em {route} ({request.method} {request.path}): {stats.queries} > {budget}"
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def metrics_view(request):
+    """
+    Endpoint de métricas para o Prometheus. Exige 'Authorization: Bearer <METRICS_TOKEN>' quando o token
+    está configurado; caso contrário, apenas usuários staff logados na sessão.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
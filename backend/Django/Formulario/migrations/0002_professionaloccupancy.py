@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfessionalOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('bitmap', models.BinaryField(help_text='288 bits (5 minutos cada), little-endian', max_length=36)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('professional', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy_days', to='Formulario.professional')),
+            ],
+            options={
+                'verbose_name': 'Ocupação Diária',
+                'verbose_name_plural': 'Ocupações Diárias',
+                'unique_together': {('professional', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+OVERLAP_CONSTRAINT = 'appointment_no_overlap' # Mesmo nome usado em Formulario/booking.py
+
+
+def create_overlap_constraint(apps, schema_editor):
+    # Restrição de exclusão só existe no PostgreSQL; no SQLite a proteção vem das transações IMMEDIATE
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('Formulario', 'Appointment')._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {OVERLAP_CONSTRAINT} "
+        f"EXCLUDE USING gist (professional_id WITH =, tstzrange(start_time, end_time, '[)') WITH &&) "
+        f"WHERE (status IN ('SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT'))"
+    )
+
+
+def drop_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('Formulario', 'Appointment')._meta.db_table)
+    schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {OVERLAP_CONSTRAINT}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0002_professionaloccupancy'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_overlap_constraint, drop_overlap_constraint),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0003_appointment_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Fim da reserva do horário enquanto aguarda o pagamento', null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0004_appointment_hold_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['professional', 'start_time', 'end_time', 'status'], name='appt_prof_time_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'start_time'], name='appt_client_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status__in', ['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT'])), fields=['professional', 'start_time', 'end_time'], name='appt_active_prof_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 'PENDING_PAYMENT')), fields=['hold_expires_at'], name='appt_pending_hold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='holiday',
+            index=models.Index(condition=models.Q(('is_recurring', True)), fields=['establishment', 'date'], name='holiday_recurring_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user'], name='notif_user_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0006_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='role_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
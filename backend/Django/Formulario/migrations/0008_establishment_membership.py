@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_memberships(apps, schema_editor):
+    # Preenchimento inicial; depois os sinais mantêm a tabela (e 'backfill_memberships' corrige divergências)
+    Establishment = apps.get_model('Formulario', 'Establishment')
+    Professional = apps.get_model('Formulario', 'Professional')
+    Appointment = apps.get_model('Formulario', 'Appointment')
+    EstablishmentMembership = apps.get_model('Formulario', 'EstablishmentMembership')
+    rows = {(establishment, owner, 'OWNER') for establishment, owner in Establishment.objects.values_list('id', 'owner_id')}
+    rows.update(
+        (establishment, user, 'PROFESSIONAL')
+        for establishment, user in Professional.objects.filter(user_account__isnull=False).values_list('establishment_id', 'user_account_id')
+    )
+    rows.update(
+        (establishment, client, 'CLIENT')
+        for establishment, client in Appointment.objects.filter(client__isnull=False).order_by().values_list('establishment_id', 'client_id').distinct()
+    )
+    EstablishmentMembership.objects.bulk_create(
+        [EstablishmentMembership(establishment_id=establishment, user_id=user, role=role) for establishment, user, role in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0007_customuser_role_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstablishmentMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('OWNER', 'Proprietário'), ('PROFESSIONAL', 'Profissional'), ('CLIENT', 'Cliente')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('establishment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='Formulario.establishment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Vínculo com Estabelecimento',
+                'verbose_name_plural': 'Vínculos com Estabelecimentos',
+                'unique_together': {('establishment', 'user', 'role')},
+            },
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0009_notification_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('APPOINTMENT_CONFIRMATION', 'Confirmação de Agendamento'), ('APPOINTMENT_REMINDER', 'Lembrete de Agendamento'), ('APPOINTMENT_CANCELLATION', 'Cancelamento de Agendamento'), ('PAYMENT_SUCCESS', 'Pagamento Confirmado'), ('PAYMENT_FAILURE', 'Pagamento Recusado'), ('GENERAL', 'Geral')], default='GENERAL', max_length=50)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pendente'), ('SENT', 'Enviada'), ('FAILED', 'Falhou')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Próxima tentativa; avançado ao reivindicar o evento')),
+                ('delivered', models.JSONField(blank=True, default=list, help_text='Adaptadores que já entregaram o evento')),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('notification', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outbox_event', to='Formulario.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_outbox', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Evento de Notificação',
+                'verbose_name_plural': 'Eventos de Notificação',
+                'indexes': [models.Index(condition=models.Q(('status', 'PENDING')), fields=['available_at', 'id'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0010_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_window',
+            field=models.PositiveIntegerField(blank=True, help_text='Menor janela de lembrete já enviada (minutos antes do início)', null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0011_appointment_reminder_window'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=255)),
+                ('action', models.CharField(help_text='Ex.: payment.created, payment.updated', max_length=100)),
+                ('raw', models.JSONField(default=dict, help_text='Corpo e query string recebidos')),
+                ('status', models.CharField(choices=[('PENDING', 'Pendente'), ('PROCESSED', 'Processado'), ('IGNORED', 'Ignorado'), ('FAILED', 'Falhou')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Próxima tentativa; avançado ao reivindicar o evento')),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Última entrega do Mercado Pago com esta chave')),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Evento de Webhook (MP)',
+                'verbose_name_plural': 'Eventos de Webhook (MP)',
+                'indexes': [models.Index(condition=models.Q(('status', 'PENDING')), fields=['available_at', 'id'], name='webhook_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('payment_id', 'action'), name='webhook_payment_action_uniq')],
+            },
+        ),
+    ]
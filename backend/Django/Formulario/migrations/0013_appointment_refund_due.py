@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Formulario', '0012_payment_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='payment_status',
+            field=models.CharField(choices=[('PENDING', 'Pendente'), ('PAID', 'Pago'), ('REFUNDED', 'Estornado'), ('CANCELLED', 'Cancelado'), ('REJECTED', 'Rejeitado'), ('REFUND_DUE', 'Estorno Pendente')], default='PENDING', max_length=50),
+        ),
+    ]
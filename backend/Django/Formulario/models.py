@@ -34,6 +34,7 @@ class CustomUser(AbstractUser):
     is_admin = models.BooleanField(default=False) # Para admins de um estabelecimento
     is_owner = models.BooleanField(default=False) # Para proprietários de estabelecimentos
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    role_version = models.PositiveIntegerField(default=0, editable=False) # Incrementado quando papéis/estabelecimento mudam (invalida os JWTs)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username'] # Mantenha ou remova, dependendo do que for essencial
@@ -62,14 +63,34 @@ class Establishment(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
-            original_slug = self.slug
-            counter = 1
-            while Establishment.objects.filter(slug=self.slug).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
+            self.slug = Establishment.unique_slugs([slugify(self.name)])[0]
         super().save(*args, **kwargs)
 
+    @classmethod
+    def unique_slugs(cls, bases, reserved=(), chunk_size=200):
+        """
+        Slugs livres para uma lista de bases ('nome', 'nome-1', 'nome-2'...), inclusive repetidas no lote.
+        Os slugs já usados são buscados de uma vez (uma consulta a cada chunk_size bases), sem testar sufixo por sufixo;
+        'reserved' são slugs do mesmo lote que também não podem ser usados.
+        """
+        bases = [base or 'estabelecimento' for base in bases]
+        distinct = sorted(set(bases))
+        taken = set(reserved)
+        for index in range(0, len(distinct), chunk_size):
+            query = models.Q()
+            for base in distinct[index:index + chunk_size]:
+                query |= models.Q(slug=base) | models.Q(slug__startswith=f"{base}-")
+            taken.update(cls.objects.filter(query).values_list('slug', flat=True))
+        slugs = []
+        for base in bases:
+            slug, counter = base, 1
+            while slug in taken:
+                slug = f"{base}-{counter}"
+                counter += 1
+            taken.add(slug)
+            slugs.append(slug)
+        return slugs
+
     def __str__(self):
         return self.name
 
@@ -136,7 +157,11 @@ class Holiday(models.Model):
     class Meta:
         verbose_name = "Feriado/Exceção"
         verbose_name_plural = "Feriados/Exceções"
-        unique_together = ('establishment', 'date')
+        unique_together = ('establishment', 'date') # Também serve de índice para a busca por (estabelecimento, data)
+        indexes = [
+            # Feriados recorrentes são buscados por estabelecimento, sem data fixa
+            models.Index(fields=['establishment', 'date'], condition=models.Q(is_recurring=True), name='holiday_recurring_idx'),
+        ]
 
 class Appointment(models.Model):
     client = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='appointments_as_client')
@@ -166,10 +191,13 @@ class Appointment(models.Model):
         ('REFUNDED', 'Estornado'),
         ('CANCELLED', 'Cancelado'), # Pode ser diferente do status do agendamento
         ('REJECTED', 'Rejeitado'),
+        ('REFUND_DUE', 'Estorno Pendente'), # Pago depois que o horário foi liberado e ocupado (ver payments.apply_payment)
     ]
     payment_status = models.CharField(max_length=50, choices=payment_status_choices, default='PENDING')
     mercadopago_preference_id = models.CharField(max_length=255, blank=True, null=True, help_text="ID da preferência de pagamento no Mercado Pago")
     mercadopago_payment_id = models.CharField(max_length=255, blank=True, null=True, help_text="ID da transação no Mercado Pago")
+    hold_expires_at = models.DateTimeField(blank=True, null=True, help_text="Fim da reserva do horário enquanto aguarda o pagamento")
+    reminder_window = models.PositiveIntegerField(blank=True, null=True, help_text="Menor janela de lembrete já enviada (minutos antes do início)")
 
     def __str__(self):
         return f"Agendamento de {self.client.email} para {self.service.name} com {self.professional.name} em {self.start_time.strftime('%d/%m/%Y %H:%M')}"
@@ -178,6 +206,21 @@ class Appointment(models.Model):
         verbose_name = "Agendamento"
         verbose_name_plural = "Agendamentos"
         ordering = ['start_time']
+        indexes = [
+            models.Index(fields=['professional', 'start_time', 'end_time', 'status'], name='appt_prof_time_status_idx'),
+            # Paginação por cursor em (start_time, id) para cada visão da listagem (dono, admin, cliente)
+            models.Index(fields=['start_time', 'id'], name='appt_start_id_idx'),
+            models.Index(fields=['establishment', 'start_time', 'id'], name='appt_est_start_id_idx'),
+            models.Index(fields=['client', 'start_time', 'id'], name='appt_client_start_id_idx'),
+            # Índices parciais (PostgreSQL e SQLite): apenas agendamentos que ocupam a agenda,
+            # mesmos status de scheduling.ACTIVE_APPOINTMENT_STATUSES
+            models.Index(
+                fields=['professional', 'start_time', 'end_time'],
+                condition=models.Q(status__in=['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT']),
+                name='appt_active_prof_time_idx',
+            ),
+            models.Index(fields=['hold_expires_at'], condition=models.Q(status='PENDING_PAYMENT'), name='appt_pending_hold_idx'),
+        ]
 
 class Payment(models.Model): # Para logar detalhes de pagamentos, pode ser opcional se Appointment já for suficiente
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name='payment_detail')
@@ -196,6 +239,37 @@ class Payment(models.Model): # Para logar detalhes de pagamentos, pode ser opcio
         verbose_name_plural = "Pagamentos (Detalhes MP)"
 
 
+class PaymentWebhookEvent(models.Model): # Notificação do Mercado Pago gravada crua, processada em lote (ver payments.py)
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('PROCESSED', 'Processado'),
+        ('IGNORED', 'Ignorado'), # Pagamento sem agendamento correspondente
+        ('FAILED', 'Falhou'),
+    ]
+    payment_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=100, help_text="Ex.: payment.created, payment.updated")
+    raw = models.JSONField(default=dict, help_text="Corpo e query string recebidos")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Próxima tentativa; avançado ao reivindicar o evento")
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(default=timezone.now, help_text="Última entrega do Mercado Pago com esta chave")
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.action} #{self.payment_id} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Evento de Webhook (MP)"
+        verbose_name_plural = "Eventos de Webhook (MP)"
+        constraints = [
+            models.UniqueConstraint(fields=['payment_id', 'action'], name='webhook_payment_action_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(status='PENDING'), name='webhook_pending_idx'),
+        ]
+
+
 class Notification(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='notifications')
     message = models.TextField()
@@ -217,4 +291,84 @@ class Notification(models.Model):
     class Meta:
         verbose_name = "Notificação"
         verbose_name_plural = "Notificações"
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_id_idx'), # Paginação por cursor
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notif_user_unread_idx'),
+        ]
+
+
+class NotificationCounter(models.Model): # Não lidas por usuário, desnormalizado (ver unread.py)
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.unread} não lidas para {self.user_id}"
+
+    class Meta:
+        verbose_name = "Contador de Notificações"
+        verbose_name_plural = "Contadores de Notificações"
+
+
+class NotificationOutbox(models.Model): # Notificações a despachar, gravadas na transação da requisição (ver outbox.py)
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('SENT', 'Enviada'),
+        ('FAILED', 'Falhou'),
+    ]
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='notification_outbox')
+    type = models.CharField(max_length=50, choices=Notification.type_choices, default='GENERAL')
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Próxima tentativa; avançado ao reivindicar o evento")
+    notification = models.OneToOneField(Notification, on_delete=models.SET_NULL, null=True, blank=True, related_name='outbox_event')
+    delivered = models.JSONField(default=list, blank=True, help_text="Adaptadores que já entregaram o evento")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_type_display()} para {self.user_id} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Evento de Notificação"
+        verbose_name_plural = "Eventos de Notificação"
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(status='PENDING'), name='outbox_pending_idx'),
+        ]
+
+
+class ProfessionalOccupancy(models.Model): # Ocupação desnormalizada: 1 bit por intervalo de 5 minutos do dia (UTC)
+    professional = models.ForeignKey(Professional, on_delete=models.CASCADE, related_name='occupancy_days')
+    date = models.DateField()
+    bitmap = models.BinaryField(max_length=36, help_text="288 bits (5 minutos cada), little-endian")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ocupação de {self.professional_id} em {self.date}"
+
+    class Meta:
+        verbose_name = "Ocupação Diária"
+        verbose_name_plural = "Ocupações Diárias"
+        unique_together = ('professional', 'date')
+
+
+class EstablishmentMembership(models.Model): # Vínculos desnormalizados usuário ↔ estabelecimento (ver membership.py)
+    ROLE_CHOICES = [
+        ('OWNER', 'Proprietário'),
+        ('PROFESSIONAL', 'Profissional'),
+        ('CLIENT', 'Cliente'),
+    ]
+    establishment = models.ForeignKey(Establishment, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='memberships')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} como {self.role} em {self.establishment_id}"
+
+    class Meta:
+        verbose_name = "Vínculo com Estabelecimento"
+        verbose_name_plural = "Vínculos com Estabelecimentos"
+        unique_together = ('establishment', 'user', 'role') # Também serve à listagem de usuários por estabelecimento
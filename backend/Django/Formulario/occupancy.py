@@ -0,0 +1,153 @@
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Appointment, ProfessionalOccupancy
+from .scheduling import ACTIVE_APPOINTMENT_STATUSES, date_range, day_bounds
+
+TICK_MINUTES = 5
+TICKS_PER_DAY = 24 * 60 // TICK_MINUTES
+BITMAP_BYTES = TICKS_PER_DAY // 8
+
+
+def to_int(bitmap):
+    return int.from_bytes(bytes(bitmap or b''), 'little')
+
+
+def to_bytes(value):
+    return value.to_bytes(BITMAP_BYTES, 'little')
+
+
+def tick_mask(first_tick, last_tick):
+    """
+    Máscara com os bits [first_tick, last_tick) ligados.
+    """
+    if last_tick <= first_tick:
+        return 0
+    return ((1 << (last_tick - first_tick)) - 1) << first_tick
+
+
+def day_masks(start_time, end_time):
+    """
+    Divide um intervalo em máscaras por dia (UTC): {date: máscara}.
+    Ticks parcialmente ocupados contam como ocupados (arredonda o início para baixo e o fim para cima).
+    """
+    start_time = start_time.astimezone(dt_timezone.utc)
+    end_time = end_time.astimezone(dt_timezone.utc)
+    masks = {}
+    if end_time <= start_time:
+        return masks
+    tick = timedelta(minutes=TICK_MINUTES)
+    for day in date_range(start_time.date(), (end_time - timedelta(microseconds=1)).date()):
+        day_start, day_end = day_bounds(day)
+        first = (max(start_time, day_start) - day_start) // tick
+        last = -((day_start - min(end_time, day_end)) // tick) # Divisão com arredondamento para cima
+        masks[day] = tick_mask(first, last)
+    return masks
+
+
+def build_bitmaps(rows):
+    """
+    Monta {(professional_id, date): máscara} a partir de (professional_id, start_time, end_time).
+    """
+    bitmaps = defaultdict(int)
+    for professional_id, start_time, end_time in rows:
+        for day, mask in day_masks(start_time, end_time).items():
+            bitmaps[(professional_id, day)] |= mask
+    return bitmaps
+
+
+def add_interval(professional_id, start_time, end_time):
+    """
+    Marca um novo intervalo ocupado com OR sobre os bitmaps existentes (sem varrer agendamentos).
+    """
+    add_intervals([(professional_id, start_time, end_time)])
+
+
+def add_intervals(rows):
+    """
+    Versão em lote de add_interval para (professional_id, start_time, end_time): uma leitura com lock,
+    um bulk_update e um bulk_create, independentemente da quantidade de intervalos.
+    """
+    masks = build_bitmaps(rows)
+    if not masks:
+        return
+    professional_ids = {professional_id for professional_id, _ in masks}
+    days = {day for _, day in masks}
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            (row.professional_id, row.date): row
+            for row in ProfessionalOccupancy.objects.select_for_update().filter(professional_id__in=professional_ids, date__in=days)
+        }
+        to_create = []
+        to_update = []
+        for (professional_id, day), mask in masks.items():
+            row = existing.get((professional_id, day))
+            if row is None:
+                to_create.append(ProfessionalOccupancy(professional_id=professional_id, date=day, bitmap=to_bytes(mask)))
+            else:
+                row.bitmap = to_bytes(to_int(row.bitmap) | mask)
+                row.updated_at = now
+                to_update.append(row)
+        ProfessionalOccupancy.objects.bulk_create(to_create)
+        ProfessionalOccupancy.objects.bulk_update(to_update, ['bitmap', 'updated_at'])
+
+
+def rebuild_days(professional_id, days):
+    """
+    Recalcula os bitmaps dos dias informados a partir dos agendamentos ativos (usado ao liberar horários,
+    já que desligar bits diretamente apagaria ocupações sobrepostas).
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    with transaction.atomic():
+        range_start = day_bounds(days[0])[0]
+        range_end = day_bounds(days[-1])[1]
+        rows = Appointment.objects.filter(
+            professional_id=professional_id,
+            start_time__lt=range_end,
+            end_time__gt=range_start,
+            status__in=ACTIVE_APPOINTMENT_STATUSES,
+        ).values_list('professional_id', 'start_time', 'end_time')
+        bitmaps = build_bitmaps(rows)
+        existing = {
+            row.date: row
+            for row in ProfessionalOccupancy.objects.select_for_update().filter(professional_id=professional_id, date__in=days)
+        }
+        for day in days:
+            value = bitmaps.get((professional_id, day), 0)
+            row = existing.get(day)
+            if row is None:
+                if value:
+                    ProfessionalOccupancy.objects.create(professional_id=professional_id, date=day, bitmap=to_bytes(value))
+            elif not value:
+                row.delete()
+            else:
+                row.bitmap = to_bytes(value)
+                row.save(update_fields=['bitmap', 'updated_at'])
+
+
+def load_bitmaps(professional_ids, days):
+    """
+    {(professional_id, date): máscara} de vários profissionais em uma consulta (dias sem linha estão livres).
+    """
+    return {
+        (professional_id, day): to_int(bitmap)
+        for professional_id, day, bitmap in ProfessionalOccupancy.objects.filter(
+            professional_id__in=list(professional_ids), date__in=list(days),
+        ).values_list('professional_id', 'date', 'bitmap')
+    }
+
+
+def expected_bitmaps(professional_id=None):
+    """
+    Bitmaps esperados, recalculados do zero a partir de todos os agendamentos ativos.
+    """
+    rows = Appointment.objects.filter(status__in=ACTIVE_APPOINTMENT_STATUSES)
+    if professional_id is not None:
+        rows = rows.filter(professional_id=professional_id)
+    return build_bitmaps(rows.values_list('professional_id', 'start_time', 'end_time').iterator())
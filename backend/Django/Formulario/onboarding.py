@@ -0,0 +1,259 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from . import membership
+from .authentication import bump_role_version
+from .models import Availability, CustomUser, Establishment, Holiday, Professional, Service
+from .serializers import (
+    OnboardingAvailabilityRowSerializer, OnboardingEstablishmentRowSerializer, OnboardingHolidayRowSerializer,
+    OnboardingProfessionalRowSerializer, OnboardingServiceRowSerializer,
+)
+
+ROW_SERIALIZERS = {
+    'establishment': OnboardingEstablishmentRowSerializer,
+    'service': OnboardingServiceRowSerializer,
+    'professional': OnboardingProfessionalRowSerializer,
+    'availability': OnboardingAvailabilityRowSerializer,
+    'holiday': OnboardingHolidayRowSerializer,
+}
+NESTED_ROWS = {'services': 'service', 'professionals': 'professional', 'holidays': 'holiday'}
+
+
+class OnboardingFormatError(ValueError):
+    pass
+
+
+def parse(content, file_format):
+    """
+    Converte o arquivo em linhas (rótulo, tipo, dados). O rótulo identifica a linha nos erros:
+    número da linha no CSV ou caminho no JSON (ex.: 'establishments[0].services[2]').
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise OnboardingFormatError("O arquivo deve estar em UTF-8.")
+    if file_format == 'csv':
+        return parse_csv(content)
+    try:
+        payload = json.loads(content) if isinstance(content, str) else content
+    except ValueError as exc:
+        raise OnboardingFormatError(f"JSON inválido: {exc}")
+    return parse_json(payload)
+
+
+def parse_json(payload):
+    """
+    Aceita {'establishments': [...]}, uma lista ou um único estabelecimento, com services, professionals
+    (cada um com availabilities) e holidays aninhados.
+    """
+    if isinstance(payload, dict) and 'establishments' in payload:
+        payload = payload['establishments']
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        raise OnboardingFormatError("Envie um estabelecimento ou uma lista de estabelecimentos.")
+
+    rows = []
+    for index, item in enumerate(payload):
+        label = f'establishments[{index}]'
+        if not isinstance(item, dict):
+            rows.append((label, 'establishment', item))
+            continue
+        name = item.get('name')
+        rows.append((label, 'establishment', {key: value for key, value in item.items() if key not in NESTED_ROWS}))
+        for key, kind in NESTED_ROWS.items():
+            for child_index, child in enumerate(item.get(key) or []):
+                child_label = f'{label}.{key}[{child_index}]'
+                if not isinstance(child, dict):
+                    rows.append((child_label, kind, child))
+                    continue
+                data = {'establishment': name, **{field: value for field, value in child.items() if field != 'availabilities'}}
+                rows.append((child_label, kind, data))
+                availabilities = (child.get('availabilities') or []) if kind == 'professional' else []
+                for slot_index, slot in enumerate(availabilities):
+                    slot_data = {'establishment': name, 'professional': child.get('name'), **slot} if isinstance(slot, dict) else slot
+                    rows.append((f'{child_label}.availabilities[{slot_index}]', 'availability', slot_data))
+    return rows
+
+
+def parse_csv(content):
+    """
+    Uma linha por registro, com a coluna 'type' (establishment, service, professional, availability, holiday).
+    Filhos referenciam o estabelecimento (e o profissional) pelo nome; células vazias usam o padrão.
+    """
+    reader = csv.DictReader(io.StringIO(content))
+    if not reader.fieldnames or 'type' not in reader.fieldnames:
+        raise OnboardingFormatError("O CSV precisa de um cabeçalho com a coluna 'type'.")
+    rows = []
+    for row in reader:
+        data = {key: value.strip() for key, value in row.items() if key and isinstance(value, str) and value.strip()}
+        rows.append((reader.line_num, data.pop('type', '').lower(), data))
+    return rows
+
+
+def import_setup(owner, rows, dry_run=False, batch_size=500):
+    """
+    Valida todas as linhas em memória (mais algumas consultas em lote: e-mails e slugs) e, sem erros,
+    grava tudo com bulk_create em uma única transação. Retorna (resumo, erros); com erros nada é gravado.
+    """
+    valid, errors = validate_rows(rows)
+    if not errors:
+        check_references(valid, errors)
+    if errors:
+        errors.sort(key=lambda error: error.pop('_index'))
+        return None, errors
+
+    establishments = [Establishment(owner=owner, **attrs) for _, _, attrs in valid['establishment']]
+    if not dry_run:
+        save(owner, establishments, valid, batch_size)
+    summary = {
+        'establishments': [{'id': establishment.id, 'name': establishment.name, 'slug': establishment.slug} for establishment in establishments],
+        'services': len(valid['service']),
+        'professionals': len(valid['professional']),
+        'availabilities': len(valid['availability']),
+        'holidays': len(valid['holiday']),
+    }
+    return summary, []
+
+
+def row_error(errors, index, label, detail):
+    errors.append({'_index': index, 'row': label, 'errors': detail})
+
+
+def validate_rows(rows):
+    # Uma instância por tipo: run_validation reaproveita os campos em vez de copiá-los a cada linha
+    validators = {kind: serializer_class() for kind, serializer_class in ROW_SERIALIZERS.items()}
+    valid = {kind: [] for kind in ROW_SERIALIZERS}
+    errors = []
+    for index, (label, kind, data) in enumerate(rows):
+        if kind not in validators:
+            row_error(errors, index, label, {'type': [f"Tipo desconhecido: '{kind}'. Use {', '.join(ROW_SERIALIZERS)}."]})
+            continue
+        try:
+            valid[kind].append((index, label, validators[kind].run_validation(data)))
+        except serializers.ValidationError as exc:
+            row_error(errors, index, label, exc.detail)
+    return valid, errors
+
+
+def check_references(valid, errors):
+    """
+    Nomes repetidos, referências a estabelecimentos/profissionais fora do arquivo, e-mails e slugs.
+    Preenche o slug dos estabelecimentos e o user_account_id dos profissionais.
+    """
+    establishments = {}
+    for index, label, attrs in valid['establishment']:
+        if attrs['name'] in establishments:
+            row_error(errors, index, label, {'name': ["Estabelecimento repetido no arquivo."]})
+        establishments[attrs['name']] = attrs
+
+    def unique(kind, key_of, duplicate_field, duplicate_message):
+        seen = set()
+        for index, label, attrs in valid[kind]:
+            if attrs['establishment'] not in establishments:
+                row_error(errors, index, label, {'establishment': ["Estabelecimento não encontrado no arquivo."]})
+                continue
+            key = key_of(attrs)
+            if key in seen:
+                row_error(errors, index, label, {duplicate_field: [duplicate_message]})
+            seen.add(key)
+        return seen
+
+    unique('service', lambda attrs: (attrs['establishment'], attrs['name']), 'name', "Serviço repetido no estabelecimento.")
+    professionals = unique('professional', lambda attrs: (attrs['establishment'], attrs['name']), 'name', "Profissional repetido no estabelecimento.")
+    unique('holiday', lambda attrs: (attrs['establishment'], attrs['date']), 'date', "Feriado repetido no estabelecimento.")
+    seen = set()
+    for index, label, attrs in valid['availability']:
+        if (attrs['establishment'], attrs['professional']) not in professionals:
+            row_error(errors, index, label, {'professional': ["Profissional não encontrado no arquivo."]})
+            continue
+        key = (attrs['establishment'], attrs['professional'], attrs['day_of_week'], attrs['start_time'], attrs['end_time'])
+        if key in seen:
+            row_error(errors, index, label, {'start_time': ["Disponibilidade repetida."]})
+        seen.add(key)
+
+    link_users(valid, errors)
+    assign_slugs(valid, errors)
+
+
+def link_users(valid, errors):
+    linked = [(index, label, attrs) for index, label, attrs in valid['professional'] if attrs.get('user_email')]
+    if not linked:
+        return
+    emails = {attrs['user_email'] for _, _, attrs in linked}
+    users = dict(CustomUser.objects.filter(email__in=emails).values_list('email', 'id'))
+    taken = set(Professional.objects.filter(user_account_id__in=users.values()).values_list('user_account_id', flat=True))
+    seen = set()
+    for index, label, attrs in linked:
+        user_id = users.get(attrs['user_email'])
+        if user_id is None:
+            row_error(errors, index, label, {'user_email': ["Usuário não encontrado."]})
+        elif user_id in taken or user_id in seen:
+            row_error(errors, index, label, {'user_email': ["Usuário já vinculado a outro profissional."]})
+        attrs['user_account_id'] = user_id
+        seen.add(user_id)
+
+
+def assign_slugs(valid, errors):
+    explicit = [(index, label, attrs) for index, label, attrs in valid['establishment'] if attrs.get('slug')]
+    taken = set(Establishment.objects.filter(slug__in={attrs['slug'] for _, _, attrs in explicit}).values_list('slug', flat=True))
+    reserved = set()
+    for index, label, attrs in explicit:
+        if attrs['slug'] in taken or attrs['slug'] in reserved:
+            row_error(errors, index, label, {'slug': ["Slug já está em uso."]})
+        reserved.add(attrs['slug'])
+
+    generated = [attrs for _, _, attrs in valid['establishment'] if not attrs.get('slug')]
+    for attrs, slug in zip(generated, Establishment.unique_slugs([slugify(attrs['name']) for attrs in generated], reserved)):
+        attrs['slug'] = slug
+
+
+def save(owner, establishments, valid, batch_size):
+    """
+    Grava o lote. bulk_create não dispara sinais: vínculos e versão de papéis são atualizados aqui.
+    """
+    def fields(attrs, *excluded):
+        return {key: value for key, value in attrs.items() if key not in excluded}
+
+    with transaction.atomic():
+        Establishment.objects.bulk_create(establishments, batch_size=batch_size)
+        by_name = {establishment.name: establishment.id for establishment in establishments}
+        Service.objects.bulk_create(
+            [Service(establishment_id=by_name[attrs['establishment']], **fields(attrs, 'establishment')) for _, _, attrs in valid['service']],
+            batch_size=batch_size,
+        )
+        professionals = Professional.objects.bulk_create(
+            [
+                Professional(establishment_id=by_name[attrs['establishment']], **fields(attrs, 'establishment', 'user_email'))
+                for _, _, attrs in valid['professional']
+            ],
+            batch_size=batch_size,
+        )
+        professional_ids = {(professional.establishment_id, professional.name): professional.id for professional in professionals}
+        Availability.objects.bulk_create(
+            [
+                Availability(
+                    professional_id=professional_ids[(by_name[attrs['establishment']], attrs['professional'])],
+                    **fields(attrs, 'establishment', 'professional'),
+                )
+                for _, _, attrs in valid['availability']
+            ],
+            batch_size=batch_size,
+        )
+        Holiday.objects.bulk_create(
+            [Holiday(establishment_id=by_name[attrs['establishment']], **fields(attrs, 'establishment')) for _, _, attrs in valid['holiday']],
+            batch_size=batch_size,
+        )
+
+        membership.add([(establishment.id, owner.id, membership.OWNER) for establishment in establishments])
+        membership.add([
+            (professional.establishment_id, professional.user_account_id, membership.PROFESSIONAL)
+            for professional in professionals if professional.user_account_id
+        ])
+        bump_role_version([professional.user_account_id for professional in professionals])
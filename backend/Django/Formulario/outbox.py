@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import push, unread
+from .models import Notification, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class FakeAdapter:
+    """
+    Adaptador local (testes e desenvolvimento): guarda os IDs dos eventos entregues em memória.
+    failures simula quedas do provedor: as primeiras chamadas levantam DeliveryError.
+    """
+    name = 'fake'
+
+    def __init__(self, name=None, latency=0, failures=0):
+        self.name = name or self.name
+        self.latency = latency
+        self.failures = failures
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, event):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise DeliveryError("Falha simulada.")
+            self.sent.append(event.id)
+
+
+@lru_cache(maxsize=None)
+def get_adapters():
+    """
+    Adaptadores de NOTIFICATION_DELIVERY_ADAPTERS (caminhos de classes com 'name' e send(event)).
+    send recebe o evento com o usuário já carregado e roda em uma thread do pool: não deve consultar o banco.
+    """
+    return tuple(import_string(path)() for path in getattr(settings, 'NOTIFICATION_DELIVERY_ADAPTERS', ()))
+
+
+def enqueue(user_id, type, message):
+    """
+    Registra a notificação para o worker (manage.py dispatch_notifications). Chamar na mesma transação
+    da mudança que a origina: se ela for desfeita, o evento também é.
+    """
+    return NotificationOutbox.objects.create(user_id=user_id, type=type, message=message)
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, 'NOTIFICATION_OUTBOX_LEASE', 5 * 60))
+
+
+def backoff(attempts):
+    base = getattr(settings, 'NOTIFICATION_OUTBOX_BACKOFF', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), getattr(settings, 'NOTIFICATION_OUTBOX_MAX_BACKOFF', 60 * 60)))
+
+
+def dispatch(batch_size=100, adapters=None, now=None):
+    """
+    Processa um lote: reivindica os eventos, cria as notificações in-app e entrega aos adaptadores.
+    Retorna {'claimed', 'sent', 'retrying', 'failed'}.
+    """
+    adapters = get_adapters() if adapters is None else adapters
+    events = claim(batch_size, now)
+    summary = {'claimed': len(events), 'sent': 0, 'retrying': 0, 'failed': 0}
+    if events:
+        summary.update(finish(events, deliver(events, adapters), now))
+    return summary
+
+
+def claim(batch_size, now=None):
+    """
+    Reivindica até batch_size eventos pendentes e vencidos. skip_locked dá lotes disjuntos a workers
+    concorrentes; o lease em available_at devolve o evento à fila se o worker morrer antes de concluir.
+    Na mesma transação grava em lote as notificações in-app que ainda não existem (uma por evento).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        events = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True, of=('self',)).select_related('user')
+            .filter(status='PENDING', available_at__lte=now).order_by('available_at', 'id')[:batch_size]
+        )
+        if not events:
+            return []
+        for event in events:
+            event.attempts += 1
+            event.available_at = now + lease()
+        fresh = [event for event in events if event.notification_id is None]
+        notifications = Notification.objects.bulk_create(
+            Notification(user_id=event.user_id, type=event.type, message=event.message) for event in fresh
+        )
+        for event, notification in zip(fresh, notifications):
+            event.notification = notification
+        NotificationOutbox.objects.bulk_update(events, ['attempts', 'available_at', 'notification'])
+        # bulk_create não dispara sinais: contador de não lidas e push são atualizados aqui. O broker compartilhado
+        # (NOTIFICATION_PUSH_BACKEND) entrega às conexões abertas nos workers ASGI
+        unread.adjust(Counter(event.user_id for event in fresh))
+        push.publish_on_commit(notifications)
+    return events
+
+
+def deliver(events, adapters):
+    """
+    Entrega cada evento aos adaptadores que ainda não o entregaram, em paralelo e fora de transação.
+    Retorna {event_id: {adapter_name: mensagem de erro ou None}}.
+    """
+    jobs = [(event, adapter) for event in events for adapter in adapters if adapter.name not in event.delivered]
+    results = defaultdict(dict)
+    if not jobs:
+        return results
+
+    def send(job):
+        event, adapter = job
+        try:
+            adapter.send(event)
+        except Exception as exc:
+            logger.warning(f"Outbox: falha ao entregar o evento {event.id} via {adapter.name}: {exc}")
+            return f"{adapter.name}: {exc}"
+        return None
+
+    workers = min(len(jobs), getattr(settings, 'NOTIFICATION_DELIVERY_CONCURRENCY', 8))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (event, adapter), error in zip(jobs, executor.map(send, jobs)):
+            results[event.id][adapter.name] = error
+    return results
+
+
+def finish(events, results, now=None):
+    """
+    Grava o resultado do lote com um bulk_update: entregue por todos os adaptadores vira SENT; com falha,
+    volta para a fila com backoff exponencial até NOTIFICATION_OUTBOX_MAX_ATTEMPTS e então vira FAILED.
+    """
+    now = now or timezone.now()
+    max_attempts = getattr(settings, 'NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5)
+    summary = Counter()
+    for event in events:
+        errors = []
+        for name, error in results.get(event.id, {}).items():
+            if error is None:
+                event.delivered = [*event.delivered, name]
+            else:
+                errors.append(error)
+        event.last_error = '\n'.join(errors)
+        if not errors:
+            event.status, event.sent_at = 'SENT', now
+            summary['sent'] += 1
+        elif event.attempts >= max_attempts:
+            event.status = 'FAILED'
+            summary['failed'] += 1
+        else:
+            event.available_at = now + backoff(event.attempts)
+            summary['retrying'] += 1
+    NotificationOutbox.objects.bulk_update(events, ['status', 'delivered', 'available_at', 'last_error', 'sent_at'])
+    return summary
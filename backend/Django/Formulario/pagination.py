@@ -0,0 +1,145 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginação por cursor (keyset) sobre um par (campo ordenável, id): cada página é buscada com
+    WHERE (campo, id) > (último valor, último id) ... LIMIT, sem COUNT(*) nem OFFSET, então o custo
+    não cresce com a profundidade da página.
+
+    Quem ainda depende da paginação por número de página pode continuar usando '?page=N'.
+    """
+    ordering = ('start_time', 'id')
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    invalid_cursor_message = "Cursor inválido."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_number = None
+        if self.page_query_param in request.query_params:
+            self.page_number = PageNumberPagination()
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.reversed_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return rows
+
+    def reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    def after(self, ordering, position):
+        """
+        Linhas posteriores a 'position' na ordenação. O primeiro termo (>=) deixa o banco usar o índice
+        como intervalo; o segundo desempata pelo id.
+        """
+        (field, key), (value, key_value) = ordering, position
+        name, key_name = field.lstrip('-'), key.lstrip('-')
+        if field.startswith('-'):
+            return Q(**{f'{name}__lte': value}) & (Q(**{f'{name}__lt': value}) | Q(**{f'{key_name}__lt': key_value}))
+        return Q(**{f'{name}__gte': value}) & (Q(**{f'{name}__gt': value}) | Q(**{f'{key_name}__gt': key_value}))
+
+    def position_of(self, row):
+        field, key = (name.lstrip('-') for name in self.ordering)
+        if isinstance(row, dict): # Linhas de .values() (fast_list)
+            value, key_value = row[field], row[key]
+        else:
+            value, key_value = getattr(row, field), getattr(row, key)
+        return [value.isoformat() if isinstance(value, datetime) else value, key_value]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            value, key_value = data['p']
+            if isinstance(value, str): # Campos de data/hora são serializados em ISO 8601
+                value = datetime.fromisoformat(value)
+            return (value, int(key_value)), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse=False):
+        data = {'p': self.position_of(row)}
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.page_number is not None:
+            return self.page_number.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param, 'required': False, 'in': 'query',
+                'description': "Cursor da página (links 'next'/'previous').", 'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_query_param, 'required': False, 'in': 'query',
+                'description': "Paginação por número de página (modo legado, com 'count').", 'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ('start_time', 'id')
+
+
+class NotificationPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,308 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+import mercadopago
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from mercadopago.config import RequestOptions
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+
+from . import holds
+from .booking import check_booking, lock_professional
+from .models import Appointment, NotificationOutbox, Payment, PaymentWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+SDK_API_URL = 'https://api.mercadopago.com'
+
+# Status do pagamento no Mercado Pago -> (payment_status, status do agendamento, aviso ao cliente)
+PAYMENT_TRANSITIONS = {
+    'approved': ('PAID', 'CONFIRMED', 'PAYMENT_SUCCESS'),
+    'pending': ('PENDING', 'PENDING_PAYMENT', None),
+    'refunded': ('REFUNDED', 'CANCELED', None),
+    'cancelled': ('CANCELLED', 'CANCELED', None),
+    'rejected': ('REJECTED', 'PENDING_PAYMENT', 'PAYMENT_FAILURE'),
+}
+# Aviso -> (tipo da notificação, mensagem)
+NOTICES = {
+    'PAYMENT_SUCCESS': ('PAYMENT_SUCCESS', "Seu pagamento para o agendamento de {service} foi aprovado! Seu agendamento está confirmado."),
+    'PAYMENT_FAILURE': ('PAYMENT_FAILURE', "Seu pagamento para o agendamento de {service} foi rejeitado. Por favor, tente novamente."),
+    'PAYMENT_REFUND_DUE': ('GENERAL', "O horário do seu agendamento de {service} não está mais disponível. Seu pagamento será estornado."),
+}
+
+
+class PooledHttpClient(HttpClient):
+    """
+    Transporte do SDK com uma sessão compartilhada (keep-alive entre as consultas do lote) e URL base
+    configurável em MERCADO_PAGO_API_URL, que permite usar o servidor falso (fake_mercadopago.py).
+    As novas tentativas ficam com o processador de eventos, e não com o urllib3.
+    """
+    def __init__(self, pool_size=10):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, maxretries=None, retry_on=None, backoff_factor=None, **kwargs):
+        if url.startswith(SDK_API_URL):
+            url = getattr(settings, 'MERCADO_PAGO_API_URL', SDK_API_URL).rstrip('/') + url[len(SDK_API_URL):]
+        response = self.session.request(method, url, **kwargs)
+        try:
+            body = response.json() if response.content else None
+        except ValueError:
+            body = None
+        return {"status": response.status_code, "response": body}
+
+
+def lookup_concurrency():
+    return getattr(settings, 'MERCADO_PAGO_LOOKUP_CONCURRENCY', 8)
+
+
+@lru_cache(maxsize=None)
+def sdk():
+    options = RequestOptions(connection_timeout=float(getattr(settings, 'MERCADO_PAGO_LOOKUP_TIMEOUT', 10)))
+    return mercadopago.SDK(settings.MERCADO_PAGO_ACCESS_TOKEN, http_client=PooledHttpClient(lookup_concurrency()), request_options=options)
+
+
+def parse_notification(query_params, data):
+    """
+    (payment_id, action) de uma notificação de pagamento nos dois formatos do Mercado Pago: webhook
+    (JSON com type, action e data.id) e IPN (?topic=payment&id=...). None para outros tópicos.
+    """
+    topic = query_params.get('topic') or query_params.get('type') or data.get('type')
+    if topic != 'payment':
+        return None
+    nested = data.get('data')
+    payment_id = (
+        (nested.get('id') if isinstance(nested, dict) else None)
+        or data.get('id') or query_params.get('data.id') or query_params.get('id')
+    )
+    return str(payment_id or ''), data.get('action') or topic
+
+
+def notification_id(raw):
+    """
+    ID da notificação no corpo do webhook; as reentregas de uma mesma notificação repetem o ID. O formato IPN não tem.
+    """
+    body = raw.get('body')
+    return body.get('id') if isinstance(body, dict) else None
+
+
+def record(payment_id, action, raw, now=None):
+    """
+    Grava a notificação. Repetições da chave (payment_id, action) não criam linhas: rearmam o evento
+    ainda não processado, e o Mercado Pago é consultado uma vez com o estado atual. Um evento já concluído
+    só é rearmado por outra notificação (ex.: um novo payment.updated após o estorno); a reentrega da
+    mesma não repete a consulta.
+    """
+    now = now or timezone.now()
+    events = PaymentWebhookEvent.objects.filter(payment_id=payment_id, action=action)
+    delivery = notification_id(raw)
+    if delivery is not None:
+        done = Q(status__in=('PROCESSED', 'IGNORED'), raw__body__id=delivery)
+        events = events.filter(~done | Q(raw__body__id__isnull=True)) # NOT de NULL (entrega anterior sem ID) seria falso
+    rearmed = events.update(raw=raw, status='PENDING', attempts=0, available_at=now, received_at=now, last_error='')
+    if not rearmed:
+        # Chave nova, ou reentrega já concluída: o conflito é ignorado
+        PaymentWebhookEvent.objects.bulk_create(
+            [PaymentWebhookEvent(payment_id=payment_id, action=action, raw=raw, available_at=now, received_at=now)],
+            ignore_conflicts=True,
+        )
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, 'MERCADO_PAGO_WEBHOOK_LEASE', 5 * 60))
+
+
+def backoff(attempts):
+    base = getattr(settings, 'MERCADO_PAGO_WEBHOOK_BACKOFF', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60))
+
+
+def process(batch_size=100, now=None):
+    """
+    Processa um lote: reivindica os eventos, consulta cada pagamento uma vez (em paralelo) e aplica as
+    transições (um savepoint por agendamento). Retorna {'claimed', 'processed', 'ignored', 'retrying', 'failed'}.
+    """
+    claimed_at = now or timezone.now()
+    events = claim(batch_size, claimed_at)
+    summary = {'claimed': len(events), 'processed': 0, 'ignored': 0, 'retrying': 0, 'failed': 0}
+    if not events:
+        return summary
+
+    payment_ids = list(dict.fromkeys(event.payment_id for event in events))
+    outcomes = {}
+    found = {}
+    for payment_id, (payment, error) in lookup(payment_ids).items():
+        if error:
+            outcomes[payment_id] = error
+        else:
+            found[payment_id] = payment
+    if found:
+        outcomes.update(apply(found))
+    summary.update(finish(events, outcomes, claimed_at, now))
+    return summary
+
+
+def claim(batch_size, now):
+    """
+    Mesmo esquema do outbox de notificações: skip_locked dá lotes disjuntos a workers concorrentes e o
+    lease em available_at devolve à fila os eventos de um worker que morreu. Leva junto as outras ações
+    pendentes dos mesmos pagamentos (ex.: payment.created e payment.updated), resolvidas pela mesma consulta.
+    """
+    with transaction.atomic():
+        pending = PaymentWebhookEvent.objects.select_for_update(skip_locked=True).filter(status='PENDING', available_at__lte=now)
+        events = list(pending.order_by('available_at', 'id')[:batch_size])
+        if events:
+            events += pending.filter(payment_id__in={event.payment_id for event in events}).exclude(id__in=[event.id for event in events])
+        for event in events:
+            event.attempts += 1
+            event.available_at = now + lease()
+        PaymentWebhookEvent.objects.bulk_update(events, ['attempts', 'available_at'])
+    return events
+
+
+def lookup(payment_ids):
+    """
+    {payment_id: (pagamento, None) ou (None, erro)}, com as consultas ao Mercado Pago em paralelo e fora de transação.
+    """
+    client = sdk()
+
+    def fetch(payment_id):
+        try:
+            result = client.payment().get(payment_id)
+        except Exception as exc:
+            return None, f"{type(exc).__name__}: {exc}"
+        if result['status'] != 200 or not result['response']:
+            return None, f"Mercado Pago respondeu HTTP {result['status']}"
+        return result['response'], None
+
+    with ThreadPoolExecutor(max_workers=min(len(payment_ids), lookup_concurrency())) as executor:
+        return dict(zip(payment_ids, executor.map(fetch, payment_ids)))
+
+
+def apply(payments):
+    """
+    Aplica os pagamentos consultados: agendamentos buscados de uma vez e, para cada agendamento, um savepoint
+    com o save() e o upsert do Payment. Os sinais do save() atualizam o cache de horários e os bitmaps de
+    ocupação e liberam a reserva de checkout; apply_payment recoloca a reserva quando o pagamento fica pendente. Um erro desfaz só
+    aquele agendamento, e não o lote. Reprocessar o mesmo estado não altera nada nem repete avisos.
+    Retorna {payment_id: 'processed', 'ignored' (sem agendamento) ou a mensagem de erro}.
+    """
+    references = {payment_id: str(payment.get('external_reference') or '') for payment_id, payment in payments.items()}
+    outcomes = {}
+    grouped = {}
+    with transaction.atomic():
+        appointments = Appointment.objects.select_related('service', 'professional').select_for_update(of=('self',)).in_bulk(
+            [int(reference) for reference in references.values() if reference.isdigit()]
+        )
+        for payment_id, payment in payments.items():
+            appointment = appointments.get(int(references[payment_id])) if references[payment_id].isdigit() else None
+            if appointment is None:
+                logger.warning(f"Webhook: Agendamento com external_reference {references[payment_id]} não encontrado.")
+                outcomes[payment_id] = 'ignored'
+            else:
+                grouped.setdefault(appointment.id, []).append(payment_id)
+
+        notices = []
+        for appointment_id, payment_ids in grouped.items():
+            appointment = appointments[appointment_id]
+            try:
+                with transaction.atomic():
+                    appointment_notices = [
+                        notice for payment_id in payment_ids
+                        if (notice := apply_payment(appointment, payment_id, payments[payment_id]))
+                    ]
+                    # Um Payment por agendamento (OneToOne): o pagamento mais recente do lote substitui o anterior
+                    payment_id = payment_ids[-1]
+                    payment = payments[payment_id]
+                    Payment.objects.bulk_create(
+                        [Payment(
+                            appointment=appointment, mercadopago_id=payment_id, status=payment.get('status'),
+                            amount=Decimal(str(payment.get('transaction_amount') or 0)), payment_method=payment.get('payment_type_id'),
+                            response_data=payment,
+                        )],
+                        update_conflicts=True, unique_fields=['appointment'],
+                        update_fields=['mercadopago_id', 'status', 'amount', 'payment_method', 'response_data'],
+                    )
+            except Exception as exc:
+                logger.exception(f"Webhook MP: erro ao aplicar o agendamento {appointment_id}: {exc}")
+                outcomes.update((payment_id, f"{type(exc).__name__}: {exc}") for payment_id in payment_ids)
+                continue
+            notices.extend(appointment_notices)
+            outcomes.update((payment_id, 'processed') for payment_id in payment_ids)
+        NotificationOutbox.objects.bulk_create([notice for notice in notices if notice.user_id])
+    return outcomes
+
+
+def apply_payment(appointment, payment_id, payment):
+    """
+    Aplica a transição de um pagamento ao agendamento (travado) e retorna o aviso ao cliente ou None.
+    Um pagamento aprovado ou pendente para um agendamento cancelado (ex.: reserva de checkout expirada)
+    só o reativa se o horário ainda estiver livre, validado sob o lock do profissional; senão o agendamento
+    continua cancelado e fica marcado para estorno (REFUND_DUE).
+    """
+    status_mp = payment.get('status')
+    payment_status, status, notice = PAYMENT_TRANSITIONS.get(status_mp, (appointment.payment_status, appointment.status, None))
+    if appointment.status == 'CANCELED' and status != 'CANCELED':
+        lock_professional(appointment.professional_id)
+        holds.release_expired(professional_id=appointment.professional_id)
+        reason = check_booking(appointment.professional, appointment.service, appointment.start_time, exclude_id=appointment.id)
+        if reason:
+            logger.warning(f"Webhook: pagamento {payment_id} para o agendamento cancelado {appointment.id} ({reason}): marcado para estorno.")
+            payment_status, status, notice = 'REFUND_DUE', 'CANCELED', ('PAYMENT_REFUND_DUE' if status_mp == 'approved' else None)
+        elif status == 'PENDING_PAYMENT':
+            appointment.hold_expires_at = timezone.now() + holds.hold_ttl()
+
+    if (appointment.payment_status, appointment.status, appointment.mercadopago_payment_id) == (payment_status, status, payment_id):
+        return None
+    appointment.payment_status, appointment.status, appointment.mercadopago_payment_id = payment_status, status, payment_id
+    appointment.save()
+    if status == 'PENDING_PAYMENT' and appointment.hold_expires_at:
+        holds.place(appointment)
+    if not notice:
+        return None
+    notification_type, message = NOTICES[notice]
+    return NotificationOutbox(user_id=appointment.client_id, type=notification_type, message=message.format(service=appointment.service.name))
+
+
+def finish(events, outcomes, claimed_at, now=None):
+    """
+    Conclui o lote com um UPDATE por resultado. Eventos rearmados por uma nova notificação depois da
+    reivindicação (received_at posterior) continuam pendentes. Falhas voltam com backoff até
+    MERCADO_PAGO_WEBHOOK_MAX_ATTEMPTS e então viram FAILED.
+    """
+    now = now or timezone.now()
+    max_attempts = getattr(settings, 'MERCADO_PAGO_WEBHOOK_MAX_ATTEMPTS', 8)
+    summary = Counter()
+    done = {'processed': [], 'ignored': []}
+    failed = []
+    for event in events:
+        outcome = outcomes[event.payment_id]
+        if outcome in done:
+            done[outcome].append(event.id)
+            summary[outcome] += 1
+            continue
+        event.last_error = outcome
+        if event.attempts >= max_attempts:
+            event.status = 'FAILED'
+            summary['failed'] += 1
+        else:
+            event.available_at = now + backoff(event.attempts)
+            summary['retrying'] += 1
+        failed.append(event)
+    for outcome, status in (('processed', 'PROCESSED'), ('ignored', 'IGNORED')):
+        if done[outcome]:
+            PaymentWebhookEvent.objects.filter(id__in=done[outcome], received_at__lte=claimed_at).update(
+                status=status, processed_at=now, last_error='',
+            )
+    PaymentWebhookEvent.objects.bulk_update(failed, ['status', 'available_at', 'last_error'])
+    return summary
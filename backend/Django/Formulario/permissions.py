@@ -1,18 +1,25 @@
 from rest_framework import permissions
 
+from .models import CustomUser, Professional
+from .tenant import tenant_for
+
+# As verificações usam o contexto do tenant (ver tenant.py) e comparam IDs, sem carregar
+# request.user.professional_profile.establishment ou relacionamentos dos objetos.
+
 class IsOwner(permissions.BasePermission):
     """
     Permissão para permitir acesso apenas a proprietários (is_owner=True).
     """
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.is_owner
+        return tenant_for(request).is_owner
 
     def has_object_permission(self, request, view, obj):
+        tenant = tenant_for(request)
         # Para objetos de Establishment, o proprietário deve ser o owner do objeto
-        if isinstance(obj, type(request.user)): # Se for um CustomUser
-            return obj == request.user or request.user.is_owner
-        elif hasattr(obj, 'owner'): # Se o objeto tem um campo 'owner' (ex: Establishment)
-            return obj.owner == request.user
+        if isinstance(obj, CustomUser):
+            return tenant.is_user(obj) or tenant.is_owner
+        elif hasattr(obj, 'owner_id'): # Se o objeto tem um campo 'owner' (ex: Establishment)
+            return obj.owner_id == tenant.user_id
         return False
 
 class IsEstablishmentAdmin(permissions.BasePermission):
@@ -20,31 +27,31 @@ class IsEstablishmentAdmin(permissions.BasePermission):
     Permissão para permitir acesso apenas a administradores de um estabelecimento.
     """
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.is_admin
+        return tenant_for(request).is_admin
 
     def has_object_permission(self, request, view, obj):
         # Verifica se o admin pertence ao estabelecimento do objeto
-        if hasattr(request.user, 'professional_profile') and request.user.professional_profile.establishment:
-            admin_establishment = request.user.professional_profile.establishment
-            if hasattr(obj, 'establishment'):
-                return obj.establishment == admin_establishment
-            elif isinstance(obj, type(request.user)): # Se for um CustomUser, ele é o próprio admin
-                return obj == request.user or (hasattr(obj, 'professional_profile') and obj.professional_profile.establishment == admin_establishment)
-        return False
+        tenant = tenant_for(request)
+        if not tenant.is_establishment_admin:
+            return False
+        if isinstance(obj, CustomUser): # O próprio admin ou um profissional do mesmo estabelecimento
+            return tenant.is_user(obj) or Professional.objects.filter(user_account_id=obj.pk, establishment_id=tenant.establishment_id).exists()
+        return tenant.manages(obj)
 
 class IsClient(permissions.BasePermission):
     """
     Permissão para permitir acesso apenas a clientes (is_client=True).
     """
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.is_client
+        return tenant_for(request).is_client
 
     def has_object_permission(self, request, view, obj):
+        tenant = tenant_for(request)
         # Permite que o cliente acesse seus próprios agendamentos
-        if isinstance(obj, type(request.user)): # Se for um CustomUser
-            return obj == request.user
-        elif hasattr(obj, 'client'): # Se o objeto tem um campo 'client' (ex: Appointment)
-            return obj.client == request.user
+        if isinstance(obj, CustomUser):
+            return tenant.is_user(obj)
+        elif hasattr(obj, 'client_id'): # Se o objeto tem um campo 'client' (ex: Appointment)
+            return obj.client_id == tenant.user_id
         return False
 
 class IsOwnerOrAdmin(permissions.BasePermission):
@@ -52,20 +59,18 @@ class IsOwnerOrAdmin(permissions.BasePermission):
     Permissão para permitir acesso a proprietários ou administradores de estabelecimento.
     """
     def has_permission(self, request, view):
-        return request.user.is_authenticated and (request.user.is_owner or request.user.is_admin)
+        tenant = tenant_for(request)
+        return tenant.is_owner or tenant.is_admin
 
     def has_object_permission(self, request, view, obj):
+        tenant = tenant_for(request)
         # Proprietário sempre tem acesso
-        if request.user.is_owner:
+        if tenant.is_owner:
             return True
         # Administrador tem acesso se o objeto pertence ao seu estabelecimento
-        if request.user.is_admin and hasattr(request.user, 'professional_profile') and request.user.professional_profile.establishment:
-            admin_establishment = request.user.professional_profile.establishment
-            if hasattr(obj, 'establishment'):
-                return obj.establishment == admin_establishment
-            elif isinstance(obj, type(request.user)): # Se for o próprio user admin
-                return obj == request.user
-        return False
+        if isinstance(obj, CustomUser): # Se for o próprio user admin
+            return tenant.is_establishment_admin and tenant.is_user(obj)
+        return tenant.manages(obj)
 
 
 class IsOwnerOrAdminReadOnly(permissions.BasePermission):
@@ -74,19 +79,16 @@ class IsOwnerOrAdminReadOnly(permissions.BasePermission):
     e outros usuários autenticados (clientes) apenas leiam.
     """
     def has_permission(self, request, view):
+        tenant = tenant_for(request)
         if request.method in permissions.SAFE_METHODS: # GET, HEAD, OPTIONS
-            return request.user.is_authenticated # Todos autenticados podem ler
-        return request.user.is_authenticated and (request.user.is_owner or request.user.is_admin)
+            return tenant.is_authenticated # Todos autenticados podem ler
+        return tenant.is_owner or tenant.is_admin
 
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True # Todos autenticados podem ler o objeto
-        
-        if request.user.is_owner:
+
+        tenant = tenant_for(request)
+        if tenant.is_owner:
             return True
-        if request.user.is_admin and hasattr(request.user, 'professional_profile') and request.user.professional_profile.establishment:
-            admin_establishment = request.user.professional_profile.establishment
-            if hasattr(obj, 'establishment'):
-                return obj.establishment == admin_establishment
-            return False
-        return False
\ No newline at end of file
+        return tenant.manages(obj)
@@ -0,0 +1,307 @@
+import asyncio
+import atexit
+import hashlib
+import os
+import socket
+import struct
+import tempfile
+import threading
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import VERSION_CLAIM, role_version
+from .fast_list import dumps
+from .models import CustomUser, Notification
+from .serializers import NotificationSerializer
+
+REPLAY_LIMIT = 100
+
+
+class Subscription:
+    """
+    Fila de uma conexão. Vive no event loop do servidor; publicações de outras threads entram por
+    call_soon_threadsafe. Fila cheia descarta a mais antiga (o cliente recupera pelo Last-Event-ID).
+    """
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+
+    def deliver(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class InProcessBroker:
+    """
+    Pub/sub em memória: entrega só para conexões abertas neste processo. Serve para um único processo
+    (desenvolvimento, testes); com o worker do outbox ou vários workers ASGI, use SocketBroker ou outro
+    backend com a mesma interface (subscribe/unsubscribe/publish) sobre um canal compartilhado.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError: # Event loop já encerrado
+                self.unsubscribe(subscription)
+        return len(subscriptions)
+
+    def connections(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class SocketBroker(InProcessBroker):
+    """
+    Pub/sub entre os processos do host por sockets Unix de datagrama. Cada processo com conexões abertas
+    escuta num socket próprio em NOTIFICATION_PUSH_SOCKET_DIR e publish envia o evento a todos eles: o que
+    o worker do outbox (e os lembretes, que passam por ele) cria chega na hora às conexões de qualquer
+    worker ASGI, sem consultar o banco. Um ouvinte que não esvazia a fila em SEND_TIMEOUT perde o evento
+    e o cliente o recupera pelo Last-Event-ID ao reconectar. Para vários hosts, use um broker de rede.
+    """
+    HEADER = struct.Struct('!qq') # user_id, id da notificação
+    MAX_DATAGRAM = 64 * 1024
+    # A fila de um socket de datagrama é curta (net.unix.max_dgram_qlen, 10 no Linux): rajadas esperam a
+    # thread do ouvinte esvaziá-la. Só um processo travado faz o envio desistir
+    SEND_TIMEOUT = 1
+
+    def __init__(self, queue_size=100, directory=None):
+        super().__init__(queue_size)
+        self.directory = directory
+        self._socket_lock = threading.Lock()
+        self._pid = None
+        self._listener = None
+        self._path = None
+        self._sender = None
+
+    def channel(self):
+        """
+        Um diretório por banco: instâncias que não compartilham dados (outro checkout, a suíte de testes)
+        não recebem as notificações umas das outras.
+        """
+        directory = self.directory or getattr(settings, 'NOTIFICATION_PUSH_SOCKET_DIR', None) or os.path.join(tempfile.gettempdir(), 'thark-push')
+        database = str(connections['default'].settings_dict['NAME'])
+        return os.path.join(directory, hashlib.sha1(database.encode()).hexdigest()[:12])
+
+    def _sockets(self):
+        # Depois de um fork (workers do gunicorn/uvicorn) o processo filho abre os próprios sockets
+        if self._pid != os.getpid():
+            with self._socket_lock:
+                if self._pid != os.getpid():
+                    self._listener = self._path = None
+                    self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                    self._sender.settimeout(self.SEND_TIMEOUT)
+                    self._pid = os.getpid()
+        return self._sender
+
+    def _listen(self):
+        self._sockets()
+        with self._socket_lock:
+            if self._listener is not None:
+                return
+            channel = self.channel()
+            os.makedirs(channel, exist_ok=True)
+            path = os.path.join(channel, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            listener.bind(path)
+            self._listener, self._path = listener, path
+        atexit.register(self._remove, path)
+        threading.Thread(target=self._receive, args=(listener,), name='notification-push', daemon=True).start()
+
+    def _receive(self, listener):
+        while True:
+            datagram = listener.recv(self.MAX_DATAGRAM)
+            if not datagram: # Enviado por close()
+                listener.close()
+                return
+            user_id, notification_id = self.HEADER.unpack_from(datagram)
+            super().publish(user_id, (notification_id, datagram[self.HEADER.size:]))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """
+        Para de escutar e remove o socket deste processo.
+        """
+        with self._socket_lock:
+            listener, path, self._listener, self._path = self._listener, self._path, None, None
+        if listener is not None:
+            self._sockets().sendto(b'', path) # Acorda a thread do recv, que fecha o socket
+            self._remove(path)
+
+    def subscribe(self, user_id):
+        self._listen()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, message):
+        """
+        Envia para todos os processos ouvintes, inclusive este (a entrega local também passa pelo socket,
+        sem duplicar). Devolve quantos processos receberam.
+        """
+        notification_id, frame = message
+        datagram = self.HEADER.pack(user_id, notification_id) + frame
+        sender = self._sockets()
+        channel = self.channel()
+        try:
+            paths = [os.path.join(channel, name) for name in os.listdir(channel) if name.endswith('.sock')]
+        except FileNotFoundError: # Nenhum processo escutando ainda
+            return 0
+        delivered = 0
+        for path in paths:
+            try:
+                sender.sendto(datagram, path)
+                delivered += 1
+            except (ConnectionRefusedError, FileNotFoundError): # Processo encerrado sem remover o socket
+                self._remove(path)
+            except OSError: # Ouvinte travado ou evento grande demais: recuperado pelo Last-Event-ID
+                pass
+        return delivered
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    backend = import_string(getattr(settings, 'NOTIFICATION_PUSH_BACKEND', 'Formulario.push.InProcessBroker'))
+    return backend(queue_size=getattr(settings, 'NOTIFICATION_STREAM_QUEUE_SIZE', 100))
+
+
+def event_frame(notification):
+    """
+    Evento SSE de uma notificação: (id, bytes), serializado uma vez e reaproveitado em todas as conexões.
+    """
+    data = dumps(NotificationSerializer(notification).data)
+    return notification.id, b'id: %d\nevent: notification\ndata: %s\n\n' % (notification.id, data)
+
+
+def publish_notifications(notifications):
+    """
+    Publica notificações já gravadas. Chamado após o commit (sinal de criação) ou direto por quem
+    grava em lote com bulk_create.
+    """
+    broker = get_broker()
+    for notification in notifications:
+        broker.publish(notification.user_id, event_frame(notification))
+
+
+def publish_on_commit(notifications):
+    notifications = list(notifications)
+    if notifications:
+        transaction.on_commit(lambda: publish_notifications(notifications))
+
+
+def replay(user_id, last_event_id):
+    notifications = Notification.objects.filter(user_id=user_id, id__gt=last_event_id).order_by('id')[:REPLAY_LIMIT]
+    return [event_frame(notification) for notification in notifications]
+
+
+def stream_token(request):
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    # EventSource não envia cabeçalhos: o access token pode vir na query string
+    return request.GET.get('token')
+
+
+async def authenticate_stream(request):
+    raw = stream_token(request)
+    if not raw:
+        return None
+    try:
+        token = AccessToken(raw)
+    except TokenError:
+        return None
+    user_id = CustomUser._meta.pk.to_python(token.get(api_settings.USER_ID_CLAIM)) # O claim guarda o ID como texto
+    if VERSION_CLAIM in token and await sync_to_async(role_version)(user_id) != token[VERSION_CLAIM]:
+        return None
+    return user_id
+
+
+async def events(user_id, last_event_id):
+    """
+    Eventos da conexão: o que o broker entregar, sem consultar o banco enquanto ela está ociosa.
+    Com Last-Event-ID, reenvia antes o que foi criado enquanto o cliente estava fora.
+    """
+    broker = get_broker()
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 25)
+    # Inscreve antes do replay: o que for publicado no meio vem pela fila e o id descarta a repetição
+    subscription = broker.subscribe(user_id)
+    last_id = last_event_id or 0
+    try:
+        yield b'retry: 5000\n\n'
+        if last_event_id is not None:
+            for notification_id, frame in await sync_to_async(replay)(user_id, last_event_id):
+                last_id = notification_id
+                yield frame
+        while True:
+            try:
+                notification_id, frame = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b': ping\n\n' # Mantém proxies e balanceadores com a conexão aberta
+                continue
+            if notification_id > last_id:
+                last_id = notification_id
+                yield frame
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@require_GET
+async def notification_stream(request):
+    """
+    Server-Sent Events com as notificações novas do usuário (GET /api/notifications/stream/).
+    Conexões ociosas não ocupam threads nem consultam o banco: só uma fila no event loop do worker ASGI.
+    Na reconexão, o Last-Event-ID reenvia o que foi criado enquanto o cliente estava fora.
+    """
+    user_id = await authenticate_stream(request)
+    if user_id is None:
+        return JsonResponse({"detail": "Token de acesso ausente, inválido ou expirado."}, status=401)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({"detail": "Last-Event-ID inválido."}, status=400)
+
+    response = StreamingHttpResponse(events(user_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Desliga o buffer do nginx
+    return response
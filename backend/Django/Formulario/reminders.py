@@ -0,0 +1,82 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Appointment, NotificationOutbox
+from .scheduling import BOOKED_STATUSES
+
+
+def reminder_windows():
+    """
+    Janelas de APPOINTMENT_REMINDER_WINDOWS (minutos antes do início), da maior para a menor.
+    """
+    return sorted(set(getattr(settings, 'APPOINTMENT_REMINDER_WINDOWS', (24 * 60, 60))), reverse=True)
+
+
+def due_window(start_time, now, windows):
+    """
+    Menor janela já alcançada. Com o worker parado, um agendamento que pulou a de 24h recebe só o lembrete de 1h.
+    """
+    minutes_left = (start_time - now).total_seconds() / 60
+    return min(window for window in windows if minutes_left <= window)
+
+
+def pending_reminders(now, windows):
+    """
+    Agendamentos que entraram em uma janela cujo lembrete ainda não foi enviado: uma varredura por intervalo
+    em start_time (índice appt_start_id_idx), filtrada por reminder_window.
+    """
+    pending = Q(reminder_window__isnull=True)
+    for window in windows:
+        pending |= Q(start_time__lte=now + timedelta(minutes=window), reminder_window__gt=window)
+    return Appointment.objects.filter(
+        start_time__gt=now, start_time__lte=now + timedelta(minutes=windows[0]),
+        status__in=BOOKED_STATUSES, client__isnull=False,
+    ).filter(pending)
+
+
+def reminder_message(service_name, start_time):
+    return f"Lembrete: seu agendamento de {service_name} está marcado para {start_time.strftime('%d/%m/%Y %H:%M')}."
+
+
+def send_due(now=None, batch_size=5000):
+    """
+    Enfileira no outbox os lembretes devidos, em lotes de batch_size. Cada lote, em uma transação, reivindica
+    os agendamentos (select_for_update com skip_locked), grava os eventos com bulk_create e marca
+    reminder_window com um UPDATE por janela: execuções sobrepostas ou repetidas não duplicam lembretes.
+    Retorna o número de lembretes enfileirados.
+    """
+    now = now or timezone.now()
+    windows = reminder_windows()
+    if not windows:
+        return 0
+    sent = 0
+    after = Q()
+    while True:
+        with transaction.atomic():
+            rows = list(
+                pending_reminders(now, windows).filter(after).select_for_update(skip_locked=True, of=('self',))
+                .order_by('start_time', 'id').values_list('id', 'client_id', 'start_time', 'service__name')[:batch_size]
+            )
+            if not rows:
+                return sent
+            by_window = defaultdict(list)
+            events = []
+            for appointment_id, client_id, start_time, service_name in rows:
+                by_window[due_window(start_time, now, windows)].append(appointment_id)
+                events.append(NotificationOutbox(
+                    user_id=client_id, type='APPOINTMENT_REMINDER', message=reminder_message(service_name, start_time), available_at=now,
+                ))
+            NotificationOutbox.objects.bulk_create(events, batch_size=1000)
+            for window, appointment_ids in by_window.items():
+                Appointment.objects.filter(id__in=appointment_ids).update(reminder_window=window)
+        sent += len(rows)
+        if len(rows) < batch_size:
+            return sent
+        # Próximo lote continua de onde este parou, sem percorrer de novo as linhas já marcadas
+        last_id, last_start = rows[-1][0], rows[-1][2]
+        after = Q(start_time__gt=last_start) | Q(start_time=last_start, id__gt=last_id)
@@ -0,0 +1,259 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+from .models import Appointment, Availability, Holiday
+
+# Status de agendamento que ocupam a agenda do profissional
+ACTIVE_APPOINTMENT_STATUSES = ['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT']
+# Status lidos do banco no cálculo de horários; PENDING_PAYMENT entra como reserva temporária (holds.py)
+BOOKED_STATUSES = ['SCHEDULED', 'CONFIRMED']
+
+
+def django_day_of_week(day):
+    """
+    Converte date.weekday() (0=Segunda) para a representação de Availability (0=Domingo).
+    """
+    return (day.weekday() + 1) % 7
+
+
+def day_bounds(day):
+    """
+    Início e fim (UTC) de um dia, no mesmo referencial usado pelas disponibilidades.
+    """
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def date_range(start_date, end_date):
+    current_date = start_date
+    while current_date <= end_date:
+        yield current_date
+        current_date += timedelta(days=1)
+
+
+def load_holidays(establishment_ids, start_date, end_date):
+    """
+    Carrega os feriados de vários estabelecimentos em uma única consulta.
+    Retorna {establishment_id: set(datas)} já expandindo os feriados recorrentes no intervalo.
+    """
+    rows = Holiday.objects.filter(
+        Q(date__range=(start_date, end_date)) | Q(is_recurring=True),
+        establishment_id__in=establishment_ids,
+    ).values_list('establishment_id', 'date', 'is_recurring')
+
+    fixed = defaultdict(set)
+    recurring = defaultdict(set)
+    for establishment_id, holiday_date, is_recurring in rows:
+        if is_recurring:
+            recurring[establishment_id].add((holiday_date.month, holiday_date.day))
+        else:
+            fixed[establishment_id].add(holiday_date)
+
+    holidays = defaultdict(set)
+    for establishment_id in establishment_ids:
+        days = set(fixed.get(establishment_id, ()))
+        if establishment_id in recurring:
+            month_days = recurring[establishment_id]
+            days.update(day for day in date_range(start_date, end_date) if (day.month, day.day) in month_days)
+        holidays[establishment_id] = days
+    return holidays
+
+
+def load_windows(professional_ids):
+    """
+    Carrega as disponibilidades semanais de vários profissionais em uma única consulta.
+    Retorna {professional_id: {day_of_week: [(start_time, end_time), ...]}} com janelas ordenadas e mescladas.
+    """
+    rows = Availability.objects.filter(
+        professional_id__in=professional_ids,
+    ).order_by('professional_id', 'day_of_week', 'start_time').values_list(
+        'professional_id', 'day_of_week', 'start_time', 'end_time'
+    )
+
+    windows = defaultdict(lambda: defaultdict(list))
+    for professional_id, day_of_week, start_time, end_time in rows:
+        day_windows = windows[professional_id][day_of_week]
+        # Janelas sobrepostas ou contíguas viram uma só
+        if day_windows and start_time <= day_windows[-1][1]:
+            day_windows[-1] = (day_windows[-1][0], max(day_windows[-1][1], end_time))
+        else:
+            day_windows.append((start_time, end_time))
+    return windows
+
+
+def load_busy(professional_ids, range_start, range_end, statuses=BOOKED_STATUSES, exclude_ids=()):
+    """
+    Carrega, em uma única consulta, os agendamentos (por padrão confirmados/agendados) que se sobrepõem ao intervalo.
+    Retorna {professional_id: [(start, end), ...]} ordenado por início, com os intervalos sobrepostos ou
+    contíguos mesclados (agendamentos antigos ou importados podem se sobrepor).
+    """
+    rows = Appointment.objects.filter(
+        professional_id__in=professional_ids,
+        start_time__lt=range_end,
+        end_time__gt=range_start,
+        status__in=statuses,
+    )
+    if exclude_ids:
+        rows = rows.exclude(pk__in=exclude_ids)
+    rows = rows.order_by('professional_id', 'start_time').values_list('professional_id', 'start_time', 'end_time')
+
+    busy = defaultdict(list)
+    for professional_id, start_time, end_time in rows:
+        professional_busy = busy[professional_id]
+        if professional_busy and start_time <= professional_busy[-1][1]:
+            professional_busy[-1] = (professional_busy[-1][0], max(professional_busy[-1][1], end_time))
+        else:
+            professional_busy.append((start_time, end_time))
+    return busy
+
+
+def subtract_busy(windows, busy, cursor=0):
+    """
+    Remove os intervalos ocupados das janelas (ambas as listas ordenadas por início).
+    Varre 'busy' uma única vez a partir de 'cursor' e retorna (intervalos livres, novo cursor),
+    permitindo continuar a varredura no dia seguinte sem voltar atrás.
+    """
+    free = []
+    for window_start, window_end in windows:
+        # Descarta agendamentos que terminam antes desta janela (nunca mais serão relevantes)
+        while cursor < len(busy) and busy[cursor][1] <= window_start:
+            cursor += 1
+
+        last_end = window_start
+        index = cursor
+        while index < len(busy) and busy[index][0] < window_end:
+            busy_start, busy_end = busy[index]
+            if busy_start > last_end:
+                free.append((last_end, busy_start))
+            last_end = max(last_end, busy_end)
+            index += 1
+
+        if window_end > last_end:
+            free.append((last_end, window_end))
+    return free, cursor
+
+
+def free_intervals(professionals, start_date, end_date):
+    """
+    Calcula os intervalos livres de vários profissionais no intervalo de datas
+    com um número fixo de consultas (feriados, disponibilidades e agendamentos).
+
+    Retorna {professional_id: {date: [(start, end), ...]}}. Dias de feriado são omitidos,
+    dias sem disponibilidade aparecem com lista vazia.
+    """
+    professionals = list(professionals)
+    professional_ids = [professional.id for professional in professionals]
+    establishment_ids = {professional.establishment_id for professional in professionals}
+    range_start = day_bounds(start_date)[0]
+    range_end = day_bounds(end_date)[1]
+
+    holidays = load_holidays(establishment_ids, start_date, end_date)
+    windows = load_windows(professional_ids)
+    busy = load_busy(professional_ids, range_start, range_end)
+
+    result = {}
+    for professional in professionals:
+        professional_windows = windows.get(professional.id, {})
+        professional_busy = busy.get(professional.id, [])
+        professional_holidays = holidays[professional.establishment_id]
+        cursor = 0
+        days = {}
+        for current_date in date_range(start_date, end_date):
+            if current_date in professional_holidays:
+                continue
+            day_windows = [
+                (
+                    datetime.combine(current_date, window_start, tzinfo=dt_timezone.utc),
+                    datetime.combine(current_date, window_end, tzinfo=dt_timezone.utc),
+                )
+                for window_start, window_end in professional_windows.get(django_day_of_week(current_date), [])
+            ]
+            days[current_date], cursor = subtract_busy(day_windows, professional_busy, cursor)
+        result[professional.id] = days
+    return result
+
+
+def serialize_intervals(days):
+    """
+    Formata {date: [(start, end)]} no formato de resposta de available-slots.
+    """
+    return {
+        current_date.isoformat(): [{'start': start.isoformat(), 'end': end.isoformat()} for start, end in intervals]
+        for current_date, intervals in days.items()
+    }
+
+
+def bookable_starts(intervals, duration_minutes):
+    """
+    Encaixa a duração do serviço nos intervalos livres, retornando os horários de início agendáveis.
+    Os inícios são alinhados ao começo de cada intervalo, em passos de 'duration_minutes'.
+    """
+    duration = timedelta(minutes=duration_minutes)
+    starts = []
+    for start, end in intervals:
+        slot_start = start
+        while slot_start + duration <= end:
+            starts.append(slot_start)
+            slot_start += duration
+    return starts
+
+
+def serialize_starts(days, duration_minutes):
+    """
+    Formata {date: [(start, end)]} como {date: [inícios agendáveis em ISO]}.
+    """
+    return {
+        current_date.isoformat(): [start.isoformat() for start in bookable_starts(intervals, duration_minutes)]
+        for current_date, intervals in days.items()
+    }
+
+
+def find_next_available(professionals, duration_minutes, limit, start_date, not_before=None,
+                        earliest=None, latest=None, horizon_days=90, max_chunk_days=14, load=free_intervals):
+    """
+    Busca os 'limit' primeiros horários agendáveis entre vários profissionais.
+
+    As datas são varridas em blocos crescentes (1, 2, 4... dias, até 'max_chunk_days'); em cada bloco
+    as agendas dos profissionais são combinadas com uma fila de prioridade (heapq.merge) e a busca
+    termina assim que 'limit' horários são encontrados. 'earliest'/'latest' restringem o horário do dia
+    (início e término do atendimento) e 'not_before' descarta horários já passados.
+    'load' permite trocar o carregamento dos intervalos (ex.: versão com cache).
+
+    Retorna [(start, end, professional), ...] em ordem cronológica.
+    """
+    professionals = list(professionals)
+    duration = timedelta(minutes=duration_minutes)
+    results = []
+    if not professionals or limit <= 0:
+        return results
+
+    def stream(professional, days):
+        for current_date in sorted(days):
+            for start in bookable_starts(days[current_date], duration_minutes):
+                end = start + duration
+                if not_before is not None and start < not_before:
+                    continue
+                if earliest is not None and start.time() < earliest:
+                    continue
+                if latest is not None and (end.date() != start.date() or end.time() > latest):
+                    continue
+                yield start, professional.id, end
+
+    by_id = {professional.id: professional for professional in professionals}
+    last_date = start_date + timedelta(days=horizon_days - 1)
+    chunk_start = start_date
+    chunk_days = 1
+    while chunk_start <= last_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), last_date)
+        intervals = load(professionals, chunk_start, chunk_end)
+        streams = [stream(professional, intervals[professional.id]) for professional in professionals]
+        for start, professional_id, end in heapq.merge(*streams):
+            results.append((start, end, by_id[professional_id]))
+            if len(results) == limit:
+                return results
+        chunk_start = chunk_end + timedelta(days=1)
+        chunk_days = min(chunk_days * 2, max_chunk_days)
+    return results
@@ -1,16 +1,19 @@
 from rest_framework import serializers
+from django.utils import timezone
 from .models import CustomUser, Establishment, Service, Professional, Appointment, Availability, Holiday, Payment
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import Notification
+from .booking import book_atomically
+from .metrics import TimedSerializerMixin
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class CustomUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ('id', 'username', 'email', 'phone_number', 'is_client', 'is_admin', 'is_owner', 'profile_picture', 'first_name', 'last_name')
         read_only_fields = ('is_admin', 'is_owner') # Apenas admins/owners podem alterar esses campos
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     password2 = serializers.CharField(write_only=True, required=True)
 
@@ -37,7 +40,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class EstablishmentSerializer(serializers.ModelSerializer):
+class EstablishmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     #owner = CustomUserSerializer(read_only=True) # Pode ser útil para exibição
     owner_id = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.filter(is_owner=True), source='owner', write_only=True)
 
@@ -46,12 +49,12 @@ class EstablishmentSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('slug',)
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Service
         fields = '__all__'
 
-class ProfessionalSerializer(serializers.ModelSerializer):
+class ProfessionalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_account = CustomUserSerializer(read_only=True) # Detalhes do usuário se houver
     user_account_id = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all(), source='user_account', write_only=True, allow_null=True, required=False)
 
@@ -59,19 +62,19 @@ class ProfessionalSerializer(serializers.ModelSerializer):
         model = Professional
         fields = '__all__'
 
-class AvailabilitySerializer(serializers.ModelSerializer):
+class AvailabilitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     professional_name = serializers.CharField(source='professional.name', read_only=True)
 
     class Meta:
         model = Availability
         fields = '__all__'
 
-class HolidaySerializer(serializers.ModelSerializer):
+class HolidaySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Holiday
         fields = '__all__'
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     client_email = serializers.CharField(source='client.email', read_only=True)
     professional_name = serializers.CharField(source='professional.name', read_only=True)
     service_name = serializers.CharField(source='service.name', read_only=True)
@@ -89,24 +92,156 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def update(self, instance, validated_data):
-        # Lógica para recalcular end_time se o serviço ou start_time mudar
-        if 'service' in validated_data or 'start_time' in validated_data:
+        # Lógica para recalcular end_time se o serviço, o profissional ou start_time mudar
+        if 'service' in validated_data or 'start_time' in validated_data or 'professional' in validated_data:
             service = validated_data.get('service', instance.service)
+            professional = validated_data.get('professional', instance.professional)
             start_time = validated_data.get('start_time', instance.start_time)
-            instance.end_time = start_time + timezone.timedelta(minutes=service.duration_minutes)
-            instance.total_amount = service.price # Atualiza o valor se o serviço mudar
+
+            def save(end_time):
+                instance.end_time = end_time
+                instance.total_amount = service.price # Atualiza o valor se o serviço mudar
+                return super(AppointmentSerializer, self).update(instance, validated_data)
+
+            # Mesma validação da criação (sob o lock do profissional), ignorando o próprio agendamento
+            return book_atomically(professional, service, start_time, save, exclude_id=instance.pk)
 
         return super().update(instance, validated_data)
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+MAX_BULK_APPOINTMENTS = 100
+
+class BulkAppointmentItemSerializer(serializers.Serializer):
+    # IDs simples: profissionais e serviços são resolvidos em lote na view, não um por item
+    professional = serializers.IntegerField()
+    service = serializers.IntegerField()
+    start_time = serializers.DateTimeField()
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+class RecurrenceSerializer(BulkAppointmentItemSerializer):
+    frequency = serializers.ChoiceField(choices=[('daily', 'Diária'), ('weekly', 'Semanal')], default='weekly')
+    interval = serializers.IntegerField(min_value=1, max_value=52, default=1)
+    count = serializers.IntegerField(min_value=1, max_value=MAX_BULK_APPOINTMENTS, required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('count') and not attrs.get('until'):
+            raise serializers.ValidationError("Informe count ou until.")
+        return attrs
+
+    @staticmethod
+    def occurrences(rule):
+        # Mantém o horário de parede (ex.: toda sexta às 10:00) somando dias no fuso do start_time
+        step = timezone.timedelta(days=rule['interval'] * (7 if rule['frequency'] == 'weekly' else 1))
+        # Sem count, gera um a mais que o limite: um until além dele vira erro em vez de ser truncado
+        limit = rule.get('count') or MAX_BULK_APPOINTMENTS + 1
+        start_time = rule['start_time']
+        occurrences = []
+        while len(occurrences) < limit and (not rule.get('until') or start_time.date() <= rule['until']):
+            occurrences.append({
+                'professional': rule['professional'],
+                'service': rule['service'],
+                'start_time': start_time,
+                'notes': rule.get('notes'),
+            })
+            start_time += step
+        return occurrences
+
+class BulkAppointmentSerializer(serializers.Serializer):
+    appointments = BulkAppointmentItemSerializer(many=True, required=False)
+    recurrence = RecurrenceSerializer(required=False)
+
+    def validate(self, attrs):
+        if bool(attrs.get('appointments')) == bool(attrs.get('recurrence')):
+            raise serializers.ValidationError("Envie apenas uma lista de appointments ou uma recurrence.")
+        entries = attrs.get('appointments') or RecurrenceSerializer.occurrences(attrs['recurrence'])
+        if len(entries) > MAX_BULK_APPOINTMENTS:
+            raise serializers.ValidationError(f"Máximo de {MAX_BULK_APPOINTMENTS} agendamentos por requisição.")
+        attrs['entries'] = entries
+        return attrs
+
+
+MAX_SCHEDULE_WINDOWS = 7 * 48 # Equivale a janelas de meia hora em todos os dias
+
+class ScheduleWindowSerializer(serializers.Serializer):
+    day_of_week = serializers.ChoiceField(choices=Availability._meta.get_field('day_of_week').choices)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
+
+    def validate(self, attrs):
+        if attrs['end_time'] <= attrs['start_time']:
+            raise serializers.ValidationError({"end_time": "Deve ser posterior a start_time."})
+        return attrs
+
+class WeeklyScheduleSerializer(serializers.Serializer):
+    # Semana completa do profissional: janelas ausentes são removidas; lista vazia limpa a agenda
+    availabilities = ScheduleWindowSerializer(many=True, allow_empty=True)
+
+    def validate_availabilities(self, value):
+        if len(value) > MAX_SCHEDULE_WINDOWS:
+            raise serializers.ValidationError(f"Máximo de {MAX_SCHEDULE_WINDOWS} janelas por semana.")
+        return value
+
+
+# Linhas da importação de onboarding (ver onboarding.py): só validação em memória, sem consultas.
+# Estabelecimentos e profissionais são referenciados pelo nome dentro do próprio arquivo.
+class OnboardingEstablishmentRowSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=255, required=False)
+    address = serializers.CharField(max_length=255, required=False)
+    phone_number = serializers.CharField(max_length=20, required=False)
+    email = serializers.EmailField(required=False)
+    description = serializers.CharField(required=False)
+    active = serializers.BooleanField(default=True)
+
+class OnboardingServiceRowSerializer(serializers.Serializer):
+    establishment = serializers.CharField(max_length=255)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    duration_minutes = serializers.IntegerField(min_value=1)
+    active = serializers.BooleanField(default=True)
+
+class OnboardingProfessionalRowSerializer(serializers.Serializer):
+    establishment = serializers.CharField(max_length=255)
+    name = serializers.CharField(max_length=255)
+    specialty = serializers.CharField(max_length=100, required=False)
+    description = serializers.CharField(required=False)
+    user_email = serializers.EmailField(required=False) # Vincula a um usuário existente
+    active = serializers.BooleanField(default=True)
+
+class OnboardingAvailabilityRowSerializer(serializers.Serializer):
+    establishment = serializers.CharField(max_length=255)
+    professional = serializers.CharField(max_length=255)
+    day_of_week = serializers.ChoiceField(choices=Availability._meta.get_field('day_of_week').choices)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
+
+    def validate(self, attrs):
+        if attrs['end_time'] <= attrs['start_time']:
+            raise serializers.ValidationError({"end_time": "Deve ser posterior a start_time."})
+        return attrs
+
+class OnboardingHolidayRowSerializer(serializers.Serializer):
+    establishment = serializers.CharField(max_length=255)
+    date = serializers.DateField()
+    description = serializers.CharField(max_length=255, required=False)
+    is_recurring = serializers.BooleanField(default=False)
+
+
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
         read_only_fields = ('created_at',)
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
-        read_only_fields = ('created_at',)
\ No newline at end of file
+        read_only_fields = ('created_at',)
+
+MAX_MARK_READ = 1000
+
+class NotificationIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_MARK_READ)
@@ -0,0 +1,234 @@
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import holds, membership, occupancy, push, slot_cache, unread
+from .authentication import ROLE_CLAIMS, bump_role_version
+from .models import Appointment, Availability, CustomUser, Establishment, Holiday, Notification, Professional
+from .scheduling import ACTIVE_APPOINTMENT_STATUSES
+
+
+APPOINTMENT_SLOT_FIELDS = ('professional_id', 'establishment_id', 'start_time', 'end_time')
+AVAILABILITY_SLOT_FIELDS = ('professional_id', 'day_of_week')
+HOLIDAY_SLOT_FIELDS = ('establishment_id', 'date', 'is_recurring')
+
+
+def loaded_values(instance, fields):
+    """
+    Valores já carregados na instância. Campos adiados (only/defer) ficam None: lê-los aqui faria uma
+    consulta (refresh_from_db), que dispara post_init de novo.
+    """
+    return tuple(instance.__dict__.get(field) for field in fields)
+
+
+# Guarda os valores originais no carregamento para invalidar também os dias antigos em remarcações
+@receiver(post_init, sender=Appointment)
+def remember_appointment(sender, instance, **kwargs):
+    instance._slot_cache_original = loaded_values(instance, APPOINTMENT_SLOT_FIELDS)
+    instance._occupancy_original = occupancy_state(instance)
+    instance._membership_original = loaded_values(instance, ('establishment_id', 'client_id'))
+
+
+@receiver(post_init, sender=Availability)
+def remember_availability(sender, instance, **kwargs):
+    instance._slot_cache_original = loaded_values(instance, AVAILABILITY_SLOT_FIELDS)
+
+
+@receiver(post_init, sender=Holiday)
+def remember_holiday(sender, instance, **kwargs):
+    instance._slot_cache_original = loaded_values(instance, HOLIDAY_SLOT_FIELDS)
+
+
+@receiver(pre_save, sender=Appointment)
+def reset_reminder_on_reschedule(sender, instance, **kwargs):
+    # Remarcação: os lembretes da nova data ainda não foram enviados (ver reminders.py)
+    original_start = instance._slot_cache_original[2]
+    if instance.pk and original_start is not None and instance.__dict__.get('reminder_window') is not None \
+            and instance.start_time != original_start:
+        instance.reminder_window = None
+
+
+@receiver([post_save, post_delete], sender=Appointment)
+def invalidate_appointment_days(sender, instance, **kwargs):
+    pairs_days = []
+    current = loaded_values(instance, APPOINTMENT_SLOT_FIELDS)
+    for professional_id, establishment_id, start_time, end_time in {instance._slot_cache_original, current}:
+        if professional_id and start_time and end_time:
+            pairs_days.append((professional_id, establishment_id, slot_cache.appointment_days(start_time, end_time)))
+    slot_cache.invalidate_days(pairs_days)
+    instance._slot_cache_original = current
+
+
+@receiver([post_save, post_delete], sender=Availability)
+def invalidate_availability_weekdays(sender, instance, **kwargs):
+    current = loaded_values(instance, AVAILABILITY_SLOT_FIELDS)
+    for professional_id, day_of_week in {instance._slot_cache_original, current}:
+        if professional_id is not None and day_of_week is not None:
+            slot_cache.invalidate_weekday(professional_id, day_of_week)
+    instance._slot_cache_original = current
+
+
+@receiver([post_save, post_delete], sender=Holiday)
+def invalidate_holiday_days(sender, instance, **kwargs):
+    current = loaded_values(instance, HOLIDAY_SLOT_FIELDS)
+    for establishment_id, holiday_date, is_recurring in {instance._slot_cache_original, current}:
+        if establishment_id is None or holiday_date is None:
+            continue
+        if is_recurring:
+            # Feriado recorrente afeta a data em todos os anos: invalida o estabelecimento inteiro
+            slot_cache.invalidate_establishment(establishment_id)
+            continue
+        professional_ids = Professional.objects.filter(establishment_id=establishment_id).values_list('id', flat=True)
+        slot_cache.invalidate_days([(professional_id, establishment_id, [holiday_date]) for professional_id in professional_ids])
+    instance._slot_cache_original = current
+
+
+def occupancy_state(instance):
+    status, professional_id, start_time, end_time = loaded_values(instance, ('status', 'professional_id', 'start_time', 'end_time'))
+    if status not in ACTIVE_APPOINTMENT_STATUSES or not professional_id or not start_time or not end_time:
+        return None
+    return (professional_id, start_time, end_time)
+
+
+# Bitmaps de ocupação: criação/remarcação marcam bits com OR; liberações recalculam os dias afetados
+@receiver(post_save, sender=Appointment)
+def update_occupancy(sender, instance, created, **kwargs):
+    original = None if created else instance._occupancy_original
+    current = occupancy_state(instance)
+    if original != current:
+        if original is not None:
+            professional_id, start_time, end_time = original
+            occupancy.rebuild_days(professional_id, occupancy.day_masks(start_time, end_time))
+        if current is not None:
+            occupancy.add_interval(*current)
+    instance._occupancy_original = current
+
+
+@receiver(post_delete, sender=Appointment)
+def release_occupancy(sender, instance, **kwargs):
+    if instance._occupancy_original is not None:
+        professional_id, start_time, end_time = instance._occupancy_original
+        occupancy.rebuild_days(professional_id, occupancy.day_masks(start_time, end_time))
+
+
+# Pagamento confirmado, recusado ou cancelamento: a reserva de checkout deixa de valer
+@receiver([post_save, post_delete], sender=Appointment)
+def release_hold(sender, instance, signal, **kwargs):
+    if instance.status != 'PENDING_PAYMENT' or signal is post_delete:
+        holds.release(instance)
+
+
+# Papéis embutidos nos JWTs: mudanças de papel, ativação ou vínculo com estabelecimento
+# incrementam a versão do usuário e os tokens antigos deixam de ser aceitos.
+# Só os campos já carregados entram no instantâneo: ler um campo adiado faria uma consulta por instância.
+USER_ROLE_FIELDS = ROLE_CLAIMS + ('is_active',)
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_user_roles(sender, instance, **kwargs):
+    instance._roles_original = loaded_values(instance, USER_ROLE_FIELDS)
+
+
+@receiver(post_save, sender=CustomUser)
+def bump_user_roles(sender, instance, created, **kwargs):
+    current = loaded_values(instance, USER_ROLE_FIELDS)
+    if not created and current != instance._roles_original:
+        bump_role_version([instance.pk])
+    instance._roles_original = current
+
+
+@receiver(post_init, sender=Professional)
+def remember_professional_link(sender, instance, **kwargs):
+    instance._link_original = loaded_values(instance, ('user_account_id', 'establishment_id'))
+
+
+# O vínculo do profissional também mantém a tabela de membros do estabelecimento
+@receiver(post_save, sender=Professional)
+def update_professional_link(sender, instance, created, **kwargs):
+    original_user_id, original_establishment_id = instance._link_original
+    current = (instance.user_account_id, instance.establishment_id)
+    if created or current != (original_user_id, original_establishment_id):
+        bump_role_version([original_user_id, instance.user_account_id])
+        if not created:
+            membership.remove(original_establishment_id, original_user_id, membership.PROFESSIONAL)
+        membership.add([(instance.establishment_id, instance.user_account_id, membership.PROFESSIONAL)])
+    instance._link_original = current
+
+
+@receiver(post_delete, sender=Professional)
+def remove_professional_link(sender, instance, **kwargs):
+    bump_role_version([instance.user_account_id])
+    membership.remove(instance.establishment_id, instance.user_account_id, membership.PROFESSIONAL)
+
+
+@receiver(post_init, sender=Establishment)
+def remember_establishment_owner(sender, instance, **kwargs):
+    instance._owner_original = instance.__dict__.get('owner_id')
+
+
+@receiver(post_save, sender=Establishment)
+def update_owner_membership(sender, instance, created, **kwargs):
+    if created or instance.owner_id != instance._owner_original:
+        if not created:
+            membership.remove(instance.pk, instance._owner_original, membership.OWNER)
+        membership.add([(instance.pk, instance.owner_id, membership.OWNER)])
+    instance._owner_original = instance.owner_id
+
+
+# Clientes entram como membros no primeiro agendamento (book_many grava os vínculos do lote)
+@receiver(post_save, sender=Appointment)
+def add_client_membership(sender, instance, created, **kwargs):
+    current = (instance.establishment_id, instance.client_id)
+    if created or current != instance._membership_original:
+        membership.add([(*current, membership.CLIENT)])
+    instance._membership_original = current
+
+
+# Contador de não lidas: criação, leitura (ou volta para não lida) e remoção ajustam o contador do usuário.
+# Escritas em lote (update/bulk_create) não disparam sinais e chamam unread.adjust diretamente.
+@receiver(post_init, sender=Notification)
+def remember_notification_state(sender, instance, **kwargs):
+    instance._unread_original = loaded_values(instance, ('user_id', 'is_read'))
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_counter(sender, instance, created, **kwargs):
+    current = (instance.user_id, instance.is_read)
+    original_user_id, original_is_read = (None, True) if created else instance._unread_original
+    if original_is_read is None: # is_read não foi carregado: recalcula em vez de supor o estado anterior
+        unread.recount(instance.user_id)
+    elif current != (original_user_id, original_is_read):
+        deltas = Counter()
+        if not original_is_read:
+            deltas[original_user_id] -= 1
+        if not instance.is_read:
+            deltas[instance.user_id] += 1
+        unread.adjust(deltas)
+    instance._unread_original = current
+
+
+@receiver(post_delete, sender=Notification)
+def release_unread_counter(sender, instance, **kwargs):
+    if instance.__dict__.get('is_read') is False:
+        unread.adjust({instance.user_id: -1}, create_missing=False)
+
+
+# Conexões SSE abertas recebem a notificação assim que a transação que a criou é confirmada
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if created:
+        push.publish_on_commit([instance])
+
+
+# Campos lidos pelos receivers de post_init de cada modelo. SparseFieldsMixin sempre os carrega no .only():
+# sem eles, o instantâneo fica incompleto e uma gravação posterior não invalida os caches dos valores antigos.
+SNAPSHOT_FIELDS = {
+    Appointment: APPOINTMENT_SLOT_FIELDS + ('status', 'client_id', 'reminder_window'),
+    Availability: AVAILABILITY_SLOT_FIELDS,
+    Holiday: HOLIDAY_SLOT_FIELDS,
+    CustomUser: USER_ROLE_FIELDS,
+    Professional: ('user_account_id', 'establishment_id'),
+    Establishment: ('owner_id',),
+    Notification: ('user_id', 'is_read'),
+}
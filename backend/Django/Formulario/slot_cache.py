@@ -0,0 +1,172 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from .scheduling import date_range, django_day_of_week, free_intervals
+
+# Marcador para dias de feriado (omitidos na resposta, mas ainda assim cacheáveis)
+HOLIDAY = 'HOLIDAY'
+
+# Os dias calculados ficam no cache 'slots', que pode descartá-los; versões e contadores ficam no padrão
+SLOTS_CACHE = 'slots'
+
+HITS_KEY = 'slots:stats:hits'
+MISSES_KEY = 'slots:stats:misses'
+
+
+def cache_timeout():
+    return getattr(settings, 'SLOT_CACHE_TIMEOUT', 60 * 60)
+
+
+def days_cache():
+    return caches[SLOTS_CACHE]
+
+
+def weekday_version_key(professional_id, day_of_week):
+    return f'slots:v:prof:{professional_id}:dow:{day_of_week}'
+
+
+def establishment_version_key(establishment_id):
+    return f'slots:v:est:{establishment_id}'
+
+
+def day_key(professional_id, establishment_id, day, versions):
+    """
+    Chave do dia de um profissional. Inclui a versão das disponibilidades daquele dia da semana
+    e a versão dos feriados recorrentes do estabelecimento, permitindo invalidar todas as datas
+    de um dia da semana apenas incrementando a versão.
+    """
+    weekday_version = versions.get(weekday_version_key(professional_id, django_day_of_week(day)), 0)
+    establishment_version = versions.get(establishment_version_key(establishment_id), 0)
+    return f'slots:{professional_id}:{day.isoformat()}:{weekday_version}:{establishment_version}'
+
+
+def get_versions(pairs):
+    """
+    Busca de uma vez as versões de vários pares (professional_id, establishment_id).
+    """
+    keys = set()
+    for professional_id, establishment_id in pairs:
+        keys.update(weekday_version_key(professional_id, day_of_week) for day_of_week in range(7))
+        keys.add(establishment_version_key(establishment_id))
+    return cache.get_many(keys)
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def record(hits, misses):
+    for key, amount in ((HITS_KEY, hits), (MISSES_KEY, misses)):
+        if not amount:
+            continue
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            if not cache.add(key, amount, None):
+                cache.incr(key, amount)
+
+
+def stats():
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def cached_free_intervals(professionals, start_date, end_date):
+    """
+    Mesma interface de scheduling.free_intervals, com cache por profissional e por dia.
+    Apenas os dias ausentes do cache são calculados, em um único carregamento em lote.
+    """
+    professionals = list(professionals)
+    versions = get_versions({(professional.id, professional.establishment_id) for professional in professionals})
+    days = list(date_range(start_date, end_date))
+
+    keys = {
+        (professional.id, day): day_key(professional.id, professional.establishment_id, day, versions)
+        for professional in professionals
+        for day in days
+    }
+    cached = days_cache().get_many(keys.values())
+
+    result = {professional.id: {} for professional in professionals}
+    missing_professionals = []
+    missing_days = []
+    for professional in professionals:
+        professional_missing = False
+        for day in days:
+            value = cached.get(keys[(professional.id, day)])
+            if value is None:
+                professional_missing = True
+                missing_days.append(day)
+            elif value != HOLIDAY:
+                result[professional.id][day] = value
+        if professional_missing:
+            missing_professionals.append(professional)
+
+    record(hits=len(keys) - len(missing_days), misses=len(missing_days))
+    if not missing_professionals:
+        return result
+
+    computed = free_intervals(missing_professionals, min(missing_days), max(missing_days))
+    to_cache = {}
+    for professional in missing_professionals:
+        computed_days = computed[professional.id]
+        for day in date_range(min(missing_days), max(missing_days)):
+            to_cache[keys[(professional.id, day)]] = computed_days.get(day, HOLIDAY)
+        # Reconstrói o resultado na ordem das datas, misturando cache e cálculo
+        merged = {}
+        for day in days:
+            if day in computed_days:
+                merged[day] = computed_days[day]
+            elif day in result[professional.id]:
+                merged[day] = result[professional.id][day]
+        result[professional.id] = merged
+    days_cache().set_many(to_cache, cache_timeout())
+    return result
+
+
+def appointment_days(start_time, end_time):
+    """
+    Datas (UTC) tocadas por um agendamento.
+    """
+    first = start_time.astimezone(dt_timezone.utc).date()
+    last = (end_time - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date()
+    return list(date_range(first, max(first, last)))
+
+
+def invalidate_days(pairs_days):
+    """
+    Remove do cache os dias informados: [(professional_id, establishment_id, [datas]), ...].
+    """
+    pairs_days = [(professional_id, establishment_id, days) for professional_id, establishment_id, days in pairs_days if days]
+    if not pairs_days:
+        return
+    versions = get_versions({(professional_id, establishment_id) for professional_id, establishment_id, _ in pairs_days})
+    days_cache().delete_many([
+        day_key(professional_id, establishment_id, day, versions)
+        for professional_id, establishment_id, days in pairs_days
+        for day in days
+    ])
+
+
+def invalidate_weekday(professional_id, day_of_week):
+    bump_version(weekday_version_key(professional_id, day_of_week))
+
+
+def invalidate_establishment(establishment_id):
+    bump_version(establishment_version_key(establishment_id))
@@ -0,0 +1,122 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from .signals import SNAPSHOT_FIELDS
+
+_readable_fields = {}
+
+
+def readable_fields(serializer_class):
+    """
+    {nome: campo} dos campos de leitura do serializer, na ordem da resposta (cacheado por classe).
+    """
+    if serializer_class not in _readable_fields:
+        _readable_fields[serializer_class] = {
+            name: field for name, field in serializer_class().fields.items() if not field.write_only
+        }
+    return _readable_fields[serializer_class]
+
+
+def parse_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def column_paths(field, model):
+    """
+    Colunas (para .only()) e relações (para select_related) que um campo do serializer lê.
+    Retorna None quando o campo não sai direto de colunas (método, source='*', propriedade...).
+    """
+    if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+        return None
+    attrs = field.source_attrs
+    try:
+        model_field = model._meta.get_field(attrs[0])
+    except FieldDoesNotExist:
+        return None
+
+    if isinstance(field, serializers.BaseSerializer):
+        if isinstance(field, serializers.ListSerializer) or len(attrs) != 1 or not model_field.is_relation:
+            return None
+        only, related = [attrs[0]], [attrs[0]]
+        for nested in field.fields.values():
+            if nested.write_only:
+                continue
+            paths = column_paths(nested, model_field.related_model)
+            if paths is None:
+                return None
+            only.extend(f'{attrs[0]}__{path}' for path in paths[0])
+            related.extend(f'{attrs[0]}__{path}' for path in paths[1])
+        return only, related
+
+    if len(attrs) == 1 or isinstance(field, PrimaryKeyRelatedField):
+        return ['__'.join(attrs)], []
+    # Campo de um relacionamento (ex.: source='client.email'): join com o relacionamento
+    if not model_field.is_relation:
+        return None
+    return [attrs[0], '__'.join(attrs)], ['__'.join(attrs[:-1])]
+
+
+class SparseFieldsMixin:
+    """
+    '?fields=a,b' / '?exclude=c' nas leituras: remove os demais campos da resposta e, no 'list',
+    carrega só as colunas e os joins que os campos restantes usam (.only() + select_related).
+    """
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def sparse_fields(self):
+        """
+        Nomes dos campos a manter, na ordem do serializer, ou None quando não há seleção.
+        """
+        if hasattr(self, '_sparse_fields'):
+            return self._sparse_fields
+        self._sparse_fields = None
+        request = self.request
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = parse_names(request.query_params.get(self.fields_query_param))
+        exclude = parse_names(request.query_params.get(self.exclude_query_param))
+        if not fields and not exclude:
+            return None
+
+        available = readable_fields(self.get_serializer_class())
+        unknown = sorted((set(fields) | set(exclude)) - set(available))
+        if unknown:
+            raise serializers.ValidationError({"detail": f"Campos desconhecidos: {', '.join(unknown)}."})
+        self._sparse_fields = [name for name in available if (not fields or name in fields) and name not in exclude]
+        return self._sparse_fields
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        keep = self.sparse_fields()
+        if keep is not None:
+            target = getattr(serializer, 'child', serializer)
+            for name in [name for name, field in target.fields.items() if not field.write_only and name not in keep]:
+                target.fields.pop(name)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        keep = self.sparse_fields()
+        if keep is None or self.action != 'list':
+            return queryset
+        return self.narrow_queryset(queryset, keep)
+
+    def narrow_queryset(self, queryset, keep):
+        fields = readable_fields(self.get_serializer_class())
+        only = {queryset.model._meta.pk.name, *SNAPSHOT_FIELDS.get(queryset.model, ())}
+        # A paginação por cursor lê os campos da ordenação em cada página
+        only.update(name.lstrip('-') for name in getattr(self.paginator, 'ordering', ()))
+        related = set()
+        for name in keep:
+            paths = column_paths(fields[name], queryset.model)
+            if paths is None:
+                return queryset
+            only.update(paths[0])
+            related.update(paths[1])
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*sorted(related))
+        return queryset.only(*sorted(only))
@@ -0,0 +1,67 @@
+from .models import Professional
+
+_UNRESOLVED = object()
+
+
+class TenantContext:
+    """
+    Papel e estabelecimento do usuário da requisição, resolvidos uma única vez (ver tenant_for).
+    O estabelecimento dos admins é carregado sob demanda, com uma consulta apenas pelos IDs.
+    """
+    def __init__(self, user):
+        self.is_authenticated = bool(user and user.is_authenticated)
+        self.user_id = user.pk if self.is_authenticated else None
+        self.is_superuser = self.is_authenticated and user.is_superuser
+        self.is_owner = self.is_authenticated and user.is_owner
+        self.is_admin = self.is_authenticated and user.is_admin
+        self.is_client = self.is_authenticated and user.is_client
+        self._profile = _UNRESOLVED
+        if getattr(user, 'is_token_user', False):
+            # Usuário montado a partir do JWT: o perfil já vem nos claims
+            professional_id = user.professional_id
+            self._profile = (professional_id, user.establishment_id) if professional_id is not None else None
+
+    def _load_profile(self):
+        if self._profile is _UNRESOLVED:
+            self._profile = None
+            if self.is_authenticated:
+                self._profile = Professional.objects.filter(user_account_id=self.user_id).values_list('id', 'establishment_id').first()
+        return self._profile
+
+    @property
+    def professional_id(self):
+        profile = self._load_profile()
+        return profile[0] if profile else None
+
+    @property
+    def establishment_id(self):
+        profile = self._load_profile()
+        return profile[1] if profile else None
+
+    @property
+    def is_establishment_admin(self):
+        return self.is_admin and self.establishment_id is not None
+
+    def is_user(self, obj):
+        return self.user_id is not None and obj.pk == self.user_id
+
+    def manages(self, obj):
+        """
+        Se o objeto (com establishment_id) pertence ao estabelecimento que o usuário administra.
+        """
+        establishment_id = getattr(obj, 'establishment_id', None)
+        return self.is_establishment_admin and establishment_id is not None and establishment_id == self.establishment_id
+
+
+def tenant_for(request):
+    """
+    Contexto do usuário autenticado, guardado na própria requisição: permissões e get_queryset
+    compartilham a mesma instância, então o perfil é buscado no máximo uma vez por requisição.
+    """
+    http_request = getattr(request, '_request', request)
+    tenant = getattr(http_request, 'tenant', None)
+    user = request.user
+    if tenant is None or tenant.user_id != (user.pk if user and user.is_authenticated else None):
+        tenant = TenantContext(user)
+        http_request.tenant = tenant
+    return tenant
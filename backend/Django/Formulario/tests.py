@@ -1,5 +1,35 @@
-from django.test import TestCase, Client
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from io import StringIO
+import gzip
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+import time as clock
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from rest_framework.test import APIClient
+
+from . import booking, fast_list, holds, membership, metrics, occupancy, outbox, payments, push, reminders, slot_cache, unread
+from .fake_mercadopago import FakeMercadoPago
+from .models import CustomUser, Establishment, EstablishmentMembership, Service, Professional, Availability, Holiday, Appointment, ProfessionalOccupancy, Payment, Notification, NotificationCounter, NotificationOutbox, PaymentWebhookEvent
+from .serializers import AppointmentSerializer
+
+logger = logging.getLogger(__name__)
+
 
 class ViewTests(TestCase):
     def setUp(self):
@@ -12,3 +42,1803 @@ class ViewTests(TestCase):
     def test_painel_admin_view(self):
         response = self.client.get(reverse('painel_admin'))
         self.assertEqual(response.status_code, 200)
+
+
+class SchedulingFixtureMixin:
+    """
+    Cria um estabelecimento com um profissional disponível de segunda a sábado.
+    """
+    def create_fixture(self):
+        cache.clear()
+        caches['slots'].clear()
+        self.owner = CustomUser.objects.create_user(email='dono@thark.com', username='dono', password='senha123', is_owner=True)
+        self.client_user = CustomUser.objects.create_user(email='cliente@thark.com', username='cliente', password='senha123', is_client=True)
+        self.establishment = Establishment.objects.create(owner=self.owner, name='Barbearia Thark')
+        self.service = Service.objects.create(establishment=self.establishment, name='Corte', price='50.00', duration_minutes=30)
+        self.professional = Professional.objects.create(establishment=self.establishment, name='João')
+        for day_of_week in range(1, 7):
+            Availability.objects.create(professional=self.professional, day_of_week=day_of_week, start_time=time(9), end_time=time(12))
+            Availability.objects.create(professional=self.professional, day_of_week=day_of_week, start_time=time(13), end_time=time(18))
+
+    def book(self, professional, start, minutes=30, status='SCHEDULED'):
+        return Appointment.objects.create(
+            client=self.client_user, professional=professional, service=self.service,
+            establishment=professional.establishment, start_time=start,
+            end_time=start + timedelta(minutes=minutes), status=status,
+        )
+
+    @staticmethod
+    def utc(day, hour, minute=0):
+        return datetime.combine(day, time(hour, minute), tzinfo=dt_timezone.utc)
+
+
+class AvailableSlotsTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.url = f'/api/professionals/{self.professional.id}/available-slots/'
+        self.monday = date(2030, 6, 3)
+
+    def test_free_intervals_subtract_appointments(self):
+        self.book(self.professional, self.utc(self.monday, 10))
+        self.book(self.professional, self.utc(self.monday, 11, 45), minutes=90) # Atravessa o intervalo de almoço
+        self.book(self.professional, self.utc(self.monday, 15), status='CANCELED')
+
+        response = self.api.get(self.url, {'start_date': '2030-06-03', 'end_date': '2030-06-03'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            '2030-06-03': [
+                {'start': '2030-06-03T09:00:00+00:00', 'end': '2030-06-03T10:00:00+00:00'},
+                {'start': '2030-06-03T10:30:00+00:00', 'end': '2030-06-03T11:45:00+00:00'},
+                {'start': '2030-06-03T13:15:00+00:00', 'end': '2030-06-03T18:00:00+00:00'},
+            ]
+        })
+
+    def test_holidays_are_omitted_and_days_off_are_empty(self):
+        Holiday.objects.create(establishment=self.establishment, date=self.monday)
+        Holiday.objects.create(establishment=self.establishment, date=date(2020, 6, 4), is_recurring=True)
+
+        response = self.api.get(self.url, {'start_date': '2030-06-02', 'end_date': '2030-06-05'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data), ['2030-06-02', '2030-06-05'])
+        self.assertEqual(response.data['2030-06-02'], []) # Domingo sem disponibilidade
+        self.assertEqual(len(response.data['2030-06-05']), 2)
+
+    def test_query_count_does_not_depend_on_range_length(self):
+        for offset in range(0, 60, 3):
+            self.book(self.professional, self.utc(self.monday + timedelta(days=offset), 14))
+        Holiday.objects.create(establishment=self.establishment, date=self.monday + timedelta(days=10))
+
+        # get_object + feriados + disponibilidades + agendamentos
+        with self.assertNumQueries(4):
+            self.api.get(self.url, {'start_date': '2030-06-03', 'end_date': '2030-06-03'})
+        with self.assertNumQueries(4):
+            response = self.api.get(self.url, {'start_date': '2030-06-03', 'end_date': '2030-08-01'})
+        self.assertEqual(len(response.data), 59)
+
+    def test_invalid_range(self):
+        response = self.api.get(self.url, {'start_date': '2030-06-05', 'end_date': '2030-06-03'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_long_ranges_are_not_capped(self):
+        # O limite de MAX_DATE_RANGE_DAYS vale só para o estabelecimento inteiro
+        response = self.api.get(self.url, {'start_date': '2030-06-01', 'end_date': '2030-09-30'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('2030-09-30', response.data)
+
+
+class EstablishmentAvailableSlotsTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.url = f'/api/establishments/{self.establishment.id}/available-slots/'
+        self.monday = date(2030, 6, 3)
+
+    def add_professional(self, name, active=True):
+        professional = Professional.objects.create(establishment=self.establishment, name=name, active=active)
+        Availability.objects.create(professional=professional, day_of_week=1, start_time=time(9), end_time=time(11))
+        return professional
+
+    def test_slots_are_snapped_to_service_duration(self):
+        maria = self.add_professional('Maria')
+        self.add_professional('Inativo', active=False)
+        self.book(maria, self.utc(self.monday, 9, 45))
+
+        response = self.api.get(self.url, {'service': self.service.id, 'start_date': '2030-06-03', 'end_date': '2030-06-03'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['duration_minutes'], 30)
+        self.assertEqual([p['name'] for p in response.data['professionals']], ['João', 'Maria'])
+        self.assertEqual(response.data['professionals'][1]['slots'], {
+            '2030-06-03': ['2030-06-03T09:00:00+00:00', '2030-06-03T10:15:00+00:00'],
+        })
+        self.assertEqual(len(response.data['professionals'][0]['slots']['2030-06-03']), 16)
+
+    def test_date_range_is_capped(self):
+        params = {'service': self.service.id, 'start_date': '2030-06-01'}
+        self.assertEqual(self.api.get(self.url, {**params, 'end_date': '2030-08-01'}).status_code, 200) # 62 dias
+        response = self.api.get(self.url, {**params, 'end_date': '2030-08-02'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('62 dias', response.data['error'])
+
+    def test_query_count_does_not_depend_on_professionals(self):
+        params = {'service': self.service.id, 'start_date': '2030-06-03', 'end_date': '2030-06-30'}
+        # estabelecimento + serviço + profissionais + feriados + disponibilidades + agendamentos
+        with self.assertNumQueries(6):
+            self.api.get(self.url, params)
+        for index in range(10):
+            self.book(self.add_professional(f'Profissional {index}'), self.utc(self.monday, 9))
+        with self.assertNumQueries(6):
+            response = self.api.get(self.url, params)
+        self.assertEqual(len(response.data['professionals']), 11)
+
+    def test_service_from_another_establishment(self):
+        other = Establishment.objects.create(owner=self.owner, name='Outra')
+        service = Service.objects.create(establishment=other, name='Barba', price='30.00', duration_minutes=20)
+        response = self.api.get(self.url, {'service': service.id, 'start_date': '2030-06-03', 'end_date': '2030-06-03'})
+        self.assertEqual(response.status_code, 404)
+
+
+
+class NextAvailableTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.maria = Professional.objects.create(establishment=self.establishment, name='Maria')
+        Availability.objects.create(professional=self.maria, day_of_week=1, start_time=time(8), end_time=time(10))
+        self.api = APIClient()
+        self.url = f'/api/establishments/{self.establishment.id}/next-available/'
+        self.monday = date(2030, 6, 3)
+        patcher = mock.patch('django.utils.timezone.now', return_value=self.utc(self.monday, 9, 10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_merges_professionals_in_chronological_order(self):
+        self.book(self.professional, self.utc(self.monday, 9, 30))
+
+        response = self.api.get(self.url, {'service': self.service.id, 'limit': 4})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(slot['professional_name'], slot['start'][11:16]) for slot in response.data['slots']],
+            [('Maria', '09:30'), ('João', '10:00'), ('João', '10:30'), ('João', '11:00')],
+        )
+
+    def test_stops_scanning_once_limit_is_reached(self):
+        # estabelecimento + serviço + (profissionais + feriados + disponibilidades + agendamentos) do primeiro dia
+        with self.assertNumQueries(6):
+            response = self.api.get(self.url, {'service': self.service.id, 'limit': 3})
+        self.assertEqual(len(response.data['slots']), 3)
+
+    def test_time_of_day_filter_and_far_answer(self):
+        for offset in range(0, 10):
+            Holiday.objects.create(establishment=self.establishment, date=self.monday + timedelta(days=offset))
+
+        response = self.api.get(self.url, {'service': self.service.id, 'limit': 2, 'after': '16:00', 'before': '17:30'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [slot['start'] for slot in response.data['slots']],
+            ['2030-06-13T16:00:00+00:00', '2030-06-13T16:30:00+00:00'],
+        )
+
+    def test_invalid_limit(self):
+        response = self.api.get(self.url, {'service': self.service.id, 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class SlotCacheTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.url = f'/api/professionals/{self.professional.id}/available-slots/'
+        self.params = {'start_date': '2030-06-03', 'end_date': '2030-06-09'}
+        self.monday = date(2030, 6, 3)
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.api.get(self.url, self.params)
+        with self.assertNumQueries(1): # Apenas get_object
+            second = self.api.get(self.url, self.params)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(slot_cache.stats(), {'hits': 7, 'misses': 7, 'hit_ratio': 0.5})
+
+    def test_appointment_invalidates_only_its_days(self):
+        self.api.get(self.url, self.params)
+        appointment = self.book(self.professional, self.utc(self.monday, 9))
+        slot_cache.reset_stats()
+
+        response = self.api.get(self.url, self.params)
+        self.assertEqual(response.data['2030-06-03'][0]['start'], '2030-06-03T09:30:00+00:00')
+        self.assertEqual(slot_cache.stats()['misses'], 1)
+
+        # Remarcação invalida o dia antigo e o novo
+        appointment.start_time = self.utc(self.monday + timedelta(days=1), 9)
+        appointment.end_time = appointment.start_time + timedelta(minutes=30)
+        appointment.save()
+        response = self.api.get(self.url, self.params)
+        self.assertEqual(response.data['2030-06-03'][0]['start'], '2030-06-03T09:00:00+00:00')
+        self.assertEqual(response.data['2030-06-04'][0]['start'], '2030-06-04T09:30:00+00:00')
+        self.assertEqual(slot_cache.stats()['misses'], 3)
+
+        appointment.delete()
+        response = self.api.get(self.url, self.params)
+        self.assertEqual(response.data['2030-06-04'][0]['start'], '2030-06-04T09:00:00+00:00')
+
+    def test_availability_and_holiday_changes_invalidate_cache(self):
+        self.api.get(self.url, self.params)
+        Availability.objects.create(professional=self.professional, day_of_week=0, start_time=time(10), end_time=time(12))
+        response = self.api.get(self.url, self.params)
+        self.assertEqual(len(response.data['2030-06-09']), 1)
+
+        holiday = Holiday.objects.create(establishment=self.establishment, date=self.monday)
+        response = self.api.get(self.url, self.params)
+        self.assertNotIn('2030-06-03', response.data)
+
+        holiday.delete()
+        Holiday.objects.create(establishment=self.establishment, date=date(2000, 6, 4), is_recurring=True)
+        response = self.api.get(self.url, self.params)
+        self.assertIn('2030-06-03', response.data)
+        self.assertNotIn('2030-06-04', response.data)
+
+    def test_deferred_loads_do_not_query_or_invalidate(self):
+        self.book(self.professional, self.utc(self.monday, 9))
+        Holiday.objects.create(establishment=self.establishment, date=self.monday)
+        with self.assertNumQueries(3): # Uma consulta por modelo: os sinais não leem campos adiados
+            appointments = list(Appointment.objects.only('id'))
+            availabilities = list(Availability.objects.only('id'))
+            holidays = list(Holiday.objects.only('id'))
+        self.assertEqual((len(appointments), len(availabilities), len(holidays)), (1, 12, 1))
+
+        self.api.get(self.url, self.params)
+        slot_cache.reset_stats()
+        availability = Availability.objects.only('id', 'end_time').get(pk=availabilities[0].pk)
+        availability.end_time = time(12, 30)
+        availability.save(update_fields=['end_time']) # Sem professional_id/day_of_week carregados: nada a comparar
+        self.api.get(self.url, self.params)
+        self.assertEqual(slot_cache.stats()['misses'], 0)
+
+    def test_full_range_establishment_request_stays_cached(self):
+        for index in range(11):
+            professional = Professional.objects.create(establishment=self.establishment, name=f'Profissional {index}')
+            Availability.objects.create(professional=professional, day_of_week=1, start_time=time(9), end_time=time(12))
+        url = f'/api/establishments/{self.establishment.id}/available-slots/'
+        params = {'service': self.service.id, 'start_date': '2030-06-01', 'end_date': '2030-08-01'}
+        start = self.utc(self.monday, 9)
+        holds.place(Appointment(id=999, professional=self.professional, start_time=start, end_time=start + timedelta(minutes=30), hold_expires_at=timezone.now() + timedelta(minutes=15)))
+        first = self.api.get(url, params)
+        slot_cache.reset_stats()
+        second = self.api.get(url, params)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(slot_cache.stats(), {'hits': 12 * 62, 'misses': 0, 'hit_ratio': 1.0})
+        # As 744 chaves de horários não descartam a reserva nem as versões
+        self.assertNotIn('2030-06-03T09:00:00+00:00', second.data['professionals'][0]['slots']['2030-06-03'])
+
+
+
+class OccupancyBitmapTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.monday = date(2030, 6, 3)
+
+    def bitmap(self, day):
+        row = ProfessionalOccupancy.objects.filter(professional=self.professional, date=day).first()
+        return occupancy.to_int(row.bitmap) if row else 0
+
+    def test_bitmap_follows_create_reschedule_and_cancel(self):
+        appointment = self.book(self.professional, self.utc(self.monday, 9), minutes=30)
+        self.assertEqual(self.bitmap(self.monday), occupancy.tick_mask(108, 114))
+        self.assertEqual(len(ProfessionalOccupancy.objects.get(professional=self.professional, date=self.monday).bitmap), 36)
+
+        serializer = AppointmentSerializer(appointment, data={'start_time': self.utc(self.monday + timedelta(days=1), 10)}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(self.bitmap(self.monday), 0)
+        self.assertEqual(self.bitmap(self.monday + timedelta(days=1)), occupancy.tick_mask(120, 126))
+
+        api = APIClient()
+        api.force_authenticate(self.client_user)
+        response = api.post(f'/api/appointments/{appointment.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.bitmap(self.monday + timedelta(days=1)), 0)
+
+    def test_validator_checks_bits_and_confirms_collisions(self):
+        self.book(self.professional, self.utc(self.monday, 10))
+        self.book(self.professional, self.utc(self.monday, 11, 2), minutes=20) # Fora dos ticks: 11:00-11:25 nos bits
+        self.professional.refresh_from_db()
+        check = lambda hour, minute: booking.check_booking(self.professional, self.service, self.utc(self.monday, hour, minute))
+
+        with self.assertNumQueries(3): # Feriados, disponibilidades e bitmaps: sem colisão, sem busca por intervalo
+            self.assertIsNone(check(10, 30))
+        with self.assertNumQueries(4):
+            self.assertEqual(check(10, 15), 'overlap')
+        with self.assertNumQueries(4): # Colide só no tick arredondado: os intervalos exatos liberam
+            self.assertIsNone(check(11, 22))
+
+    def test_rebuild_command_restores_and_verifies(self):
+        self.book(self.professional, self.utc(self.monday, 9))
+        self.book(self.professional, self.utc(self.monday, 14), status='CANCELED')
+        ProfessionalOccupancy.objects.update(bitmap=occupancy.to_bytes(1))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_occupancy', '--verify-only', stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_occupancy', stdout=StringIO())
+        self.assertEqual(self.bitmap(self.monday), occupancy.tick_mask(108, 114))
+        call_command('rebuild_occupancy', '--verify-only', stdout=StringIO())
+
+
+
+class BookingValidatorTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.monday = date(2030, 6, 3)
+
+    def post(self, start):
+        return self.api.post('/api/appointments/', {
+            'professional': self.professional.id, 'service': self.service.id,
+            'establishment': self.establishment.id, 'start_time': start.isoformat(),
+        }, format='json')
+
+    def test_check_loads_each_table_once(self):
+        self.professional.refresh_from_db()
+        with self.assertNumQueries(3): # Feriados, disponibilidades e agendamentos, como no lote
+            self.assertIsNone(booking.check_booking(self.professional, self.service, self.utc(self.monday, 9)))
+
+    def test_contiguous_windows_are_merged(self):
+        # 09-12, 12-13 e 13-18: o horário das 11:45 é oferecido e precisa ser aceito na criação
+        Availability.objects.filter(professional=self.professional, day_of_week=1).delete()
+        for start, end in ((9, 12), (12, 13), (13, 18)):
+            Availability.objects.create(professional=self.professional, day_of_week=1, start_time=time(start), end_time=time(end))
+        response = self.api.get(f'/api/professionals/{self.professional.id}/available-slots/', {'start_date': '2030-06-03', 'end_date': '2030-06-03'})
+        self.assertEqual(response.data['2030-06-03'], [{'start': '2030-06-03T09:00:00+00:00', 'end': '2030-06-03T18:00:00+00:00'}])
+        self.assertEqual(self.post(self.utc(self.monday, 11, 45)).status_code, 201)
+
+    def test_create_accepts_valid_slot(self):
+        response = self.post(self.utc(self.monday, 9))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['end_time'][:19], '2030-06-03T06:30:00') # Exibido em America/Sao_Paulo
+
+    def test_create_rejections_have_reason(self):
+        self.book(self.professional, self.utc(self.monday, 10))
+        Holiday.objects.create(establishment=self.establishment, date=date(2001, 6, 4), is_recurring=True)
+        cases = [
+            (self.utc(self.monday, 10, 15), 'overlap'),
+            (self.utc(self.monday, 11, 45), 'outside_availability'),
+            (self.utc(self.monday - timedelta(days=1), 10), 'outside_availability'),
+            (self.utc(self.monday + timedelta(days=1), 10), 'holiday'),
+        ]
+        for start, reason in cases:
+            with self.subTest(reason=reason, start=start):
+                response = self.post(start)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['reason'], reason)
+
+    def test_update_uses_same_validator(self):
+        appointment = self.book(self.professional, self.utc(self.monday, 9))
+        self.book(self.professional, self.utc(self.monday, 10))
+        url = f'/api/appointments/{appointment.id}/'
+
+        response = self.api.patch(url, {'start_time': self.utc(self.monday, 9, 45).isoformat()}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['reason'], 'overlap')
+
+        # Deslocar dentro do próprio horário não conflita consigo mesmo
+        response = self.api.patch(url, {'start_time': self.utc(self.monday, 9, 15).isoformat()}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class FileDatabaseMixin:
+    """
+    Roda a classe numa cópia em arquivo do banco de testes. O SQLite em memória compartilhada recusa na hora
+    (SQLITE_LOCKED) o que está travado por outra thread, sem esperar o timeout como um arquivo.
+    """
+    @classmethod
+    def setUpClass(cls):
+        connection.ensure_connection()
+        cls.memory_connection = connection.connection # Mantém vivo o banco em memória
+        cls.memory_name = connection.settings_dict['NAME']
+        descriptor, cls.database_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(descriptor)
+        target = sqlite3.connect(cls.database_path)
+        cls.memory_connection.backup(target)
+        target.close()
+        connection.connection = None
+        connection.settings_dict['NAME'] = cls.database_path # Mesmo dicionário usado pelas conexões das outras threads
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connection.close()
+        connection.settings_dict['NAME'] = cls.memory_name
+        connection.ensure_connection()
+        cls.memory_connection.close()
+        os.remove(cls.database_path)
+
+
+class ConcurrentBookingTests(FileDatabaseMixin, SchedulingFixtureMixin, TransactionTestCase):
+    """
+    Dispara centenas de tentativas simultâneas para os mesmos horários e garante que cada um seja agendado uma vez.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.maria = Professional.objects.create(establishment=self.establishment, name='Maria')
+        Availability.objects.create(professional=self.maria, day_of_week=1, start_time=time(9), end_time=time(12))
+        self.monday = date(2030, 6, 3)
+
+    def attempt(self, professional, start):
+        try:
+            api = APIClient()
+            api.force_authenticate(self.client_user)
+            response = api.post('/api/appointments/', {
+                'professional': professional.id, 'service': self.service.id,
+                'establishment': self.establishment.id, 'start_time': start.isoformat(),
+            }, format='json')
+            return response.status_code, response.data.get('reason')
+        finally:
+            connection.close()
+
+    def test_concurrent_attempts_book_each_slot_once(self):
+        # 2 profissionais x 6 horários de 30 min x 20 tentativas
+        slots = [(professional, self.utc(self.monday, 9) + timedelta(minutes=30 * slot)) for professional in (self.professional, self.maria) for slot in range(6)]
+        attempts = [slot for slot in slots for _ in range(20)]
+
+        started = clock.perf_counter()
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda args: self.attempt(*args), attempts))
+        elapsed = clock.perf_counter() - started
+
+        # Nenhuma tentativa perdida: cada uma ou agenda ou é recusada por sobreposição (nada de lock ou erro 500)
+        self.assertEqual(len(results), 240)
+        self.assertEqual(Counter(results), {(201, None): 12, (400, 'overlap'): 228})
+        # Exatamente um agendamento por horário disputado
+        booked = Appointment.objects.values_list('professional_id', 'start_time')
+        self.assertEqual(sorted(booked), sorted((professional.id, start) for professional, start in slots))
+
+        logger.info(f"{len(attempts)} tentativas concorrentes, {len(slots)} agendamentos, {len(attempts) / elapsed:.1f} tentativas/s")
+
+
+class SlotHoldTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.monday = date(2030, 6, 3)
+        self.slots_url = f'/api/professionals/{self.professional.id}/available-slots/'
+        self.params = {'start_date': '2030-06-03', 'end_date': '2030-06-03'}
+        self.appointment = self.book(self.professional, self.utc(self.monday, 9))
+
+    def checkout(self):
+        sdk = mock.Mock()
+        sdk.preference.return_value.create.return_value = {'response': {'id': 'pref-1', 'init_point': 'https://mp/checkout'}}
+        with mock.patch('Formulario.views.mp', sdk):
+            return self.api.post('/api/payments/create-preference/', {'appointment_id': self.appointment.id}, format='json')
+
+    def first_start(self):
+        return self.api.get(self.slots_url, self.params).data['2030-06-03'][0]['start'][11:16]
+
+    def test_checkout_holds_slot_until_expiry(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'PENDING_PAYMENT')
+        self.assertEqual(holds.active_holds([self.professional.id]), {self.professional.id: [(self.utc(self.monday, 9), self.utc(self.monday, 9, 30))]})
+        self.assertEqual(self.first_start(), '09:30')
+
+        # Após o TTL a reserva deixa de valer mesmo antes do sweeper rodar
+        later = timezone.now() + holds.hold_ttl() + timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(self.first_start(), '09:00')
+            self.assertEqual(holds.release_expired(), 1)
+
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.status, self.appointment.payment_status), ('CANCELED', 'CANCELLED'))
+        self.assertFalse(ProfessionalOccupancy.objects.filter(professional=self.professional).exists())
+
+    def test_payment_confirmation_releases_hold(self):
+        self.checkout()
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        appointment.status = 'CONFIRMED'
+        appointment.save()
+        self.assertEqual(holds.active_holds([self.professional.id]), {})
+        self.assertEqual(self.first_start(), '09:30')
+
+    def test_booking_releases_expired_holds_of_the_professional(self):
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='PENDING_PAYMENT', hold_expires_at=timezone.now() - timedelta(minutes=1))
+        response = self.api.post('/api/appointments/', {
+            'professional': self.professional.id, 'service': self.service.id,
+            'establishment': self.establishment.id, 'start_time': self.utc(self.monday, 9).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'CANCELED')
+
+
+
+class BulkAppointmentTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.url = '/api/appointments/bulk/'
+        self.monday = date(2030, 6, 3)
+
+    def item(self, start):
+        return {'professional': self.professional.id, 'service': self.service.id, 'start_time': start.isoformat()}
+
+    def test_list_reports_accepted_and_rejected(self):
+        self.book(self.professional, self.utc(self.monday, 10))
+        Holiday.objects.create(establishment=self.establishment, date=self.monday + timedelta(days=1))
+
+        response = self.api.post(self.url, {'appointments': [
+            self.item(self.utc(self.monday, 9)),
+            self.item(self.utc(self.monday, 10, 15)),
+            self.item(self.utc(self.monday, 9, 15)), # Conflita com o primeiro item do lote
+            self.item(self.utc(self.monday + timedelta(days=1), 9)),
+            {'professional': 999, 'service': self.service.id, 'start_time': self.utc(self.monday, 14).isoformat()},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['accepted']), 1)
+        self.assertEqual(response.data['accepted'][0]['professional_name'], 'João')
+        self.assertEqual(
+            [(item['index'], item['reason']) for item in response.data['rejected']],
+            [(1, 'overlap'), (2, 'overlap'), (3, 'holiday'), (4, 'not_found')],
+        )
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertEqual(
+            occupancy.to_int(ProfessionalOccupancy.objects.get(professional=self.professional, date=self.monday).bitmap),
+            occupancy.tick_mask(108, 114) | occupancy.tick_mask(120, 126),
+        )
+
+    def test_recurrence_every_other_friday(self):
+        friday = date(2030, 6, 7)
+        Holiday.objects.create(establishment=self.establishment, date=friday + timedelta(weeks=4))
+
+        response = self.api.post(self.url, {'recurrence': {
+            **self.item(self.utc(friday, 10)), 'frequency': 'weekly', 'interval': 2, 'until': '2030-09-07',
+        }}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['accepted']), 6)
+        self.assertEqual([item['reason'] for item in response.data['rejected']], ['holiday'])
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        counts = []
+        for week, size in ((0, 2), (2, 12)):
+            items = [self.item(self.utc(self.monday + timedelta(weeks=week, days=index % 6), 9 + index // 6)) for index in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.post(self.url, {'appointments': items}, format='json')
+            self.assertEqual(len(response.data['accepted']), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_overlapping_existing_bookings(self):
+        # Agendamentos antigos que se sobrepõem: o das 09:30 não pode esconder o que vai até as 11:00
+        self.book(self.professional, self.utc(self.monday, 9), minutes=120)
+        self.book(self.professional, self.utc(self.monday, 9, 30), minutes=15)
+        response = self.api.post(self.url, {'appointments': [self.item(self.utc(self.monday, 9)), self.item(self.utc(self.monday, 10))]}, format='json')
+        self.assertEqual(response.data['accepted'], [])
+        self.assertEqual([item['reason'] for item in response.data['rejected']], ['overlap', 'overlap'])
+
+    def test_until_beyond_the_limit_is_rejected(self):
+        response = self.api.post(self.url, {'recurrence': {
+            **self.item(self.utc(self.monday, 10)), 'frequency': 'daily', 'until': '2031-06-03',
+        }}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_requires_exactly_one_mode(self):
+        response = self.api.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+
+class ListQueryCountTests(SchedulingFixtureMixin, TestCase):
+    """
+    Fixa o número de consultas de uma página de cada listagem (COUNT da paginação + SELECT da página),
+    com mais linhas do que o tamanho da página e todas as relações exibidas pelos serializers.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.monday = date(2030, 6, 3)
+        for index in range(12):
+            user = CustomUser.objects.create_user(email=f'prof{index}@thark.com', username=f'prof{index}', password='senha123')
+            professional = Professional.objects.create(establishment=self.establishment, name=f'Profissional {index}', user_account=user)
+            Availability.objects.create(professional=professional, day_of_week=1, start_time=time(9), end_time=time(18))
+            Service.objects.create(establishment=self.establishment, name=f'Serviço {index}', price='10.00', duration_minutes=15)
+            Holiday.objects.create(establishment=self.establishment, date=self.monday + timedelta(days=index))
+            appointment = self.book(professional, self.utc(self.monday, 9))
+            Payment.objects.create(appointment=appointment, mercadopago_id=f'mp-{index}', status='approved', amount='10.00')
+            Notification.objects.create(user=self.owner, message=f'Mensagem {index}')
+            Establishment.objects.create(owner=self.owner, name=f'Filial {index}')
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+
+    def test_list_endpoints_have_fixed_query_count(self):
+        endpoints = [
+            '/api/users/', '/api/establishments/', '/api/services/', '/api/professionals/',
+            '/api/availabilities/', '/api/holidays/', '/api/payments/',
+            '/api/appointments/?page=1', '/api/notifications/?page=1',
+        ]
+        for url in endpoints:
+            with self.subTest(url=url), self.assertNumQueries(2):
+                response = self.api.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), 10)
+
+    def test_cursor_paginated_endpoints_skip_count(self):
+        for url in ['/api/appointments/', '/api/notifications/']:
+            with self.subTest(url=url), self.assertNumQueries(1):
+                response = self.api.get(url)
+                self.assertEqual(len(response.data['results']), 10)
+
+    def test_establishment_professionals_action(self):
+        with self.assertNumQueries(2): # Estabelecimento + profissionais com usuário
+            response = self.api.get(f'/api/establishments/{self.establishment.id}/professionals/')
+        self.assertEqual(len(response.data), 13)
+
+
+class QueryMetricsTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        metrics.registry.reset()
+        self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+
+    def test_records_histograms_per_route(self):
+        self.api.get('/api/appointments/')
+        self.api.get('/api/appointments/')
+
+        self.owner.is_staff = True
+        self.owner.save()
+        self.client.force_login(self.owner)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE thark_request_queries histogram', body)
+        self.assertIn('thark_request_queries_bucket{route="appointment-list",method="GET",le="2"} 2', body)
+        self.assertIn('thark_request_queries_count{route="appointment-list",method="GET"} 2', body)
+        self.assertIn('thark_request_serializer_seconds_count{route="appointment-list",method="GET"} 2', body)
+        self.assertIn('thark_request_duration_seconds_sum{route="appointment-list",method="GET"}', body)
+        self.assertNotIn('route="metrics"', body)
+
+    def test_serializer_time_only_counts_outermost_serializer(self):
+        stats = metrics.RequestStats()
+        token = metrics.current_stats.set(stats)
+        try:
+            AppointmentSerializer(Appointment.objects.all(), many=True).data
+        finally:
+            metrics.current_stats.reset(token)
+        self.assertGreater(stats.serializer_seconds, 0)
+        self.assertEqual(stats.serializer_depth, 0)
+
+    def test_metrics_endpoint_requires_staff_or_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        with override_settings(METRICS_TOKEN='segredo'):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+            response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer segredo')
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_budgeted_routes_stay_within_budget(self):
+        slots = {'service': self.service.id, 'start_date': '2030-06-03', 'end_date': '2030-06-30'}
+        requests = [
+            ('/api/establishments/', {}), ('/api/services/', {}), ('/api/professionals/', {}), ('/api/appointments/', {}),
+            ('/api/availabilities/', {}), ('/api/holidays/', {}), ('/api/payments/', {}), ('/api/notifications/', {}),
+            (f'/api/establishments/{self.establishment.id}/professionals/', {}),
+            (f'/api/professionals/{self.professional.id}/available-slots/', slots),
+            (f'/api/establishments/{self.establishment.id}/available-slots/', slots),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url):
+                self.assertEqual(self.api.get(url, params).status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'GET appointment-list': 0}, QUERY_BUDGET_STRICT=True)
+    def test_budget_exceeded_fails_in_strict_mode(self):
+        with self.assertRaises(metrics.QueryBudgetExceeded):
+            self.api.get('/api/appointments/')
+
+    @override_settings(QUERY_BUDGETS={'appointment-list': 0}, QUERY_BUDGET_STRICT=False)
+    def test_budget_exceeded_logs_warning(self):
+        with self.assertLogs('Formulario.metrics', level='WARNING') as logs:
+            response = self.api.get('/api/appointments/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('appointment-list', logs.output[0])
+
+
+class IndexBenchmarkTests(TestCase):
+    def test_benchmark_compares_plans_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_indexes', appointments=200, notifications=200, clients=10, professionals=5, repeat=1, explain=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn('appt_prof_time_status_idx', output)
+        self.assertIn('notif_user_created_id_idx', output)
+        self.assertIn('sobreposição (validador)', output)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_seed_never_overlaps_active_appointments(self):
+        from django.db.models import Count
+        from .management.commands.benchmark_indexes import Command
+        Command().seed({'appointments': 2000, 'notifications': 0, 'clients': 10, 'professionals': 2, 'seed': 42})
+        duplicated = Appointment.objects.filter(status__in=['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT']).values(
+            'professional_id', 'start_time',
+        ).annotate(total=Count('id')).filter(total__gt=1)
+        self.assertFalse(duplicated.exists())
+
+    def test_refuses_non_scratch_database(self):
+        with mock.patch.dict(connection.settings_dict, {'NAME': '/srv/thark/db.sqlite3'}), self.assertRaises(CommandError):
+            call_command('benchmark_indexes', appointments=10, notifications=10, clients=2, professionals=1, repeat=1, stdout=StringIO())
+        self.assertFalse(Appointment.objects.exists())
+
+
+class CursorPaginationTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        monday = date(2030, 6, 3)
+        # Vários agendamentos com o mesmo início (em profissionais diferentes) para exercitar o desempate por id
+        for index in range(5):
+            professional = Professional.objects.create(establishment=self.establishment, name=f'Profissional {index}')
+            Availability.objects.create(professional=professional, day_of_week=1, start_time=time(9), end_time=time(18))
+            for hour in range(9, 14):
+                self.book(professional, self.utc(monday, hour))
+        now = timezone.now()
+        notifications = Notification.objects.bulk_create(Notification(user=self.client_user, message=f'Mensagem {index}') for index in range(23))
+        Notification.objects.filter(pk__in=[notification.pk for notification in notifications[:12]]).update(created_at=now)
+        self.api = APIClient()
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            url = response.data['next']
+        return pages
+
+    def test_appointments_walk_in_start_time_and_id_order(self):
+        self.api.force_authenticate(self.owner)
+        pages = self.walk('/api/appointments/')
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        ids = [row['id'] for page in pages for row in page['results']]
+        expected = list(Appointment.objects.order_by('start_time', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.api.get(pages[2]['previous']).data
+        self.assertEqual([row['id'] for row in previous['results']], [row['id'] for row in pages[1]['results']])
+        self.assertIsNotNone(previous['next'])
+
+    def test_notifications_walk_newest_first_with_ties(self):
+        self.api.force_authenticate(self.client_user)
+        pages = self.walk('/api/notifications/')
+        ids = [row['id'] for page in pages for row in page['results']]
+        self.assertEqual(ids, list(Notification.objects.filter(user=self.client_user).order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_deep_page_uses_keyset_without_offset(self):
+        self.api.force_authenticate(self.owner)
+        url = self.walk('/api/appointments/')[1]['next']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+
+    def test_page_number_mode_still_available(self):
+        self.api.force_authenticate(self.owner)
+        response = self.api.get('/api/appointments/?page=3')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_invalid_cursor_returns_404(self):
+        self.api.force_authenticate(self.owner)
+        self.assertEqual(self.api.get('/api/appointments/?cursor=invalido').status_code, 404)
+
+
+class FastListTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        user = CustomUser.objects.create_user(email='prof@thark.com', username='prof', password='senha123', first_name='Zoë', profile_picture='profile_pics/zoe.png')
+        Professional.objects.create(establishment=self.establishment, name='Zoë \u2028 "Ferreira"', user_account=user, photo='professional_photos/zoe.png', specialty='Barbeira')
+        Service.objects.create(establishment=self.establishment, name='Barba', price='35.50', duration_minutes=20, description='Navalha e toalha quente')
+        for hour in (9, 10, 11, 13, 14):
+            self.book(self.professional, self.utc(date(2030, 6, 3), hour))
+        Appointment.objects.filter(start_time__hour=10).update(notes='Cliente pediu \u00e1gua')
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+
+    def assert_same_bytes(self, url, **headers):
+        fast = self.api.get(url, **headers)
+        with override_settings(FAST_LIST_RESPONSES=False):
+            regular = self.api.get(url, **headers)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, regular.content)
+        self.assertEqual(fast['Content-Type'], regular['Content-Type'])
+        return fast
+
+    def test_matches_serializer_output_byte_for_byte(self):
+        for url in ['/api/appointments/', '/api/appointments/?page=1', '/api/services/', '/api/professionals/', '/api/professionals/?page=1']:
+            with self.subTest(url=url):
+                self.assert_same_bytes(url)
+
+    def test_matches_without_orjson(self):
+        with mock.patch.object(fast_list, 'orjson', None):
+            for url in ['/api/appointments/', '/api/professionals/']:
+                with self.subTest(url=url):
+                    self.assert_same_bytes(url)
+
+    def test_cursor_links_match(self):
+        Appointment.objects.bulk_create([
+            Appointment(client=self.client_user, professional=self.professional, service=self.service, establishment=self.establishment,
+                        start_time=self.utc(date(2030, 6, 4), 9) + timedelta(minutes=30 * index),
+                        end_time=self.utc(date(2030, 6, 4), 9) + timedelta(minutes=30 * index + 30))
+            for index in range(10)
+        ])
+        first = self.assert_same_bytes('/api/appointments/')
+        self.assert_same_bytes(first.json()['next'])
+
+    def test_skips_model_instances(self):
+        with mock.patch.object(AppointmentSerializer, 'to_representation') as to_representation:
+            response = self.api.get('/api/appointments/')
+        to_representation.assert_not_called()
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_compresses_large_bodies(self):
+        with override_settings(FAST_LIST_COMPRESS_MIN_BYTES=10):
+            response = self.api.get('/api/appointments/', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            with override_settings(FAST_LIST_RESPONSES=False):
+                regular = self.api.get('/api/appointments/')
+            self.assertEqual(gzip.decompress(response.content), regular.content)
+
+            response = self.api.get('/api/appointments/')
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_browsable_api_uses_regular_path(self):
+        response = self.api.get('/api/services/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_benchmark_outputs_match(self):
+        out, err = StringIO(), StringIO()
+        call_command('benchmark_fast_list', appointments=30, professionals=3, services=3, requests=1, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertIn('/api/appointments/', out.getvalue())
+
+
+class SparseFieldsTests(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.appointment = self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+
+    def test_fields_trims_output_and_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/appointments/?fields=id,start_time,status')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'start_time', 'status'])
+        sql = queries[-1]['sql']
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('notes', sql)
+
+    def test_joined_field_keeps_only_its_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/appointments/?fields=id,professional_name')
+        self.assertEqual(response.data['results'][0], {'id': self.appointment.id, 'professional_name': 'João'})
+        sql = queries[-1]['sql']
+        self.assertEqual(sql.count('JOIN'), 1)
+        self.assertIn('Formulario_professional', sql)
+
+    def test_regular_path_matches_fast_path(self):
+        for url, queries in [('/api/appointments/?exclude=notes,mercadopago_payment_id', 1), ('/api/professionals/?fields=id,name,user_account', 2)]:
+            with self.subTest(url=url):
+                fast = self.api.get(url)
+                with override_settings(FAST_LIST_RESPONSES=False), self.assertNumQueries(queries):
+                    regular = self.api.get(url)
+                self.assertEqual(fast.content, regular.content)
+        self.assertNotIn('notes', self.api.get('/api/appointments/?exclude=notes').json()['results'][0])
+
+    def test_retrieve_and_other_viewsets(self):
+        response = self.api.get(f'/api/appointments/{self.appointment.id}/?fields=status')
+        self.assertEqual(response.data, {'status': 'SCHEDULED'})
+        response = self.api.get('/api/availabilities/?fields=day_of_week,professional_name')
+        self.assertEqual(response.data['results'][0], {'day_of_week': 1, 'professional_name': 'João'})
+
+    def test_fields_on_every_viewset(self):
+        # Os campos lidos pelos sinais de post_init entram sempre no .only(): sem isso a listagem recursava
+        Holiday.objects.create(establishment=self.establishment, date=date(2030, 6, 4))
+        Payment.objects.create(appointment=self.appointment, mercadopago_id='123', status='approved', amount='50.00')
+        Notification.objects.create(user=self.owner, message='Novo agendamento')
+        cases = [
+            ('users', ['id']), ('establishments', ['id', 'name']), ('services', ['id', 'name']),
+            ('professionals', ['id', 'name']), ('appointments', ['id', 'status']), ('availabilities', ['day_of_week']),
+            ('holidays', ['id']), ('payments', ['id', 'status']), ('notifications', ['id', 'message']),
+        ]
+        for fast in (True, False):
+            for resource, fields in cases:
+                with self.subTest(resource=resource, fast=fast), override_settings(FAST_LIST_RESPONSES=fast):
+                    response = self.api.get(f"/api/{resource}/?fields={','.join(fields)}")
+                    self.assertEqual(response.status_code, 200)
+                    results = response.data['results'] if isinstance(response.data, dict) else response.data
+                    self.assertTrue(results)
+                    self.assertEqual([list(result) for result in results], [fields] * len(results))
+        with override_settings(FAST_LIST_RESPONSES=False), CaptureQueriesContext(connection) as queries:
+            self.api.get('/api/availabilities/?fields=id')
+        self.assertIn('"professional_id"', queries[-1]['sql'])
+
+    def test_unknown_field_is_rejected(self):
+        response = self.api.get('/api/appointments/?fields=id,senha')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('senha', response.data['detail'])
+
+    def test_writes_ignore_sparse_fields(self):
+        self.api.force_authenticate(self.owner)
+        response = self.api.patch(f'/api/appointments/{self.appointment.id}/?fields=id', {'notes': 'Trazer documento'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['notes'], 'Trazer documento')
+
+
+class TenantPermissionTests(SchedulingFixtureMixin, TestCase):
+    """
+    Papel e estabelecimento são resolvidos uma vez por requisição: o perfil do admin custa uma consulta
+    (só pelos IDs), e as permissões por objeto comparam IDs sem consultas extras.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.admin = CustomUser.objects.create_user(email='admin@thark.com', username='admin', password='senha123', is_admin=True)
+        Professional.objects.create(establishment=self.establishment, name='Admin', user_account=self.admin)
+        other_owner = CustomUser.objects.create_user(email='outro@thark.com', username='outro', password='senha123', is_owner=True)
+        other = Establishment.objects.create(owner=other_owner, name='Outra Barbearia')
+        other_professional = Professional.objects.create(establishment=other, name='Pedro')
+        other_service = Service.objects.create(establishment=other, name='Corte', price='40.00', duration_minutes=30)
+        self.appointment = self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.other_appointment = Appointment.objects.create(
+            client=self.client_user, professional=other_professional, service=other_service, establishment=other,
+            start_time=self.utc(date(2030, 6, 3), 9), end_time=self.utc(date(2030, 6, 3), 9, 30),
+        )
+        self.api = APIClient()
+
+    def test_admin_list_and_detail_query_counts(self):
+        # Recarrega o usuário para que nenhum relacionamento venha em cache de requisições anteriores
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        with self.assertNumQueries(3): # Perfil (IDs) + COUNT + página
+            response = self.api.get('/api/appointments/?page=1')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.appointment.id])
+
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        with self.assertNumQueries(2): # Perfil (IDs) + agendamento
+            response = self.api.get(f'/api/appointments/{self.appointment.id}/')
+        self.assertEqual(response.status_code, 200)
+
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        with self.assertNumQueries(2):
+            response = self.api.get('/api/holidays/?page=1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_object_permission_compares_establishment_ids(self):
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        with self.assertNumQueries(2):
+            response = self.api.get(f'/api/services/{self.service.id}/')
+        self.assertEqual(response.status_code, 200)
+
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        response = self.api.patch(f'/api/services/{self.service.id}/', {'price': '55.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Objetos de outro estabelecimento nem entram no queryset do admin
+        other_service = Service.objects.exclude(establishment=self.establishment).get()
+        self.assertEqual(self.api.patch(f'/api/services/{other_service.id}/', {'price': '1.00'}, format='json').status_code, 404)
+        self.assertEqual(self.api.get(f'/api/appointments/{self.other_appointment.id}/').status_code, 404)
+
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.client_user.pk))
+        self.assertEqual(self.api.patch(f'/api/services/{self.service.id}/', {'price': '1.00'}, format='json').status_code, 403)
+
+    def test_client_detail_needs_no_profile_lookup(self):
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.client_user.pk))
+        with self.assertNumQueries(1):
+            response = self.api.get(f'/api/appointments/{self.appointment.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_cancels_only_own_establishment(self):
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        self.assertEqual(self.api.post(f'/api/appointments/{self.appointment.id}/cancel/').status_code, 200)
+        self.assertEqual(self.api.post(f'/api/appointments/{self.other_appointment.id}/cancel/').status_code, 404)
+
+
+class TokenClaimsTests(SchedulingFixtureMixin, TestCase):
+    """
+    O JWT leva papéis e estabelecimento: leituras não buscam o usuário, e mudanças de papel
+    invalidam os tokens antigos pela versão ('rv').
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.admin = CustomUser.objects.create_user(email='admin@thark.com', username='admin', password='senha123', is_admin=True)
+        self.admin_professional = Professional.objects.create(establishment=self.establishment, name='Admin', user_account=self.admin)
+        self.appointment = self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.api = APIClient()
+
+    def obtain(self, email):
+        response = self.api.post('/api/token/', {'email': email, 'password': 'senha123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_token_carries_role_and_establishment_claims(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = AccessToken(self.obtain('admin@thark.com')['access'])
+        self.assertTrue(token['is_admin'])
+        self.assertFalse(token['is_owner'])
+        self.assertEqual(token['establishment'], self.establishment.id)
+        self.assertEqual(token['professional'], self.admin_professional.id)
+
+        token = AccessToken(self.obtain('cliente@thark.com')['access'])
+        self.assertTrue(token['is_client'])
+        self.assertIsNone(token['establishment'])
+
+    def test_reads_skip_user_and_profile_queries(self):
+        access = self.obtain('admin@thark.com')['access']
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(2): # COUNT + página (sem usuário nem perfil)
+            response = self.api.get('/api/appointments/?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.appointment.id])
+
+        response = self.api.get('/api/auth/me/')
+        self.assertEqual(response.data['email'], 'admin@thark.com')
+
+    def test_client_reads_own_appointment_by_token(self):
+        access = self.obtain('cliente@thark.com')['access']
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(1): # Só o agendamento
+            response = self.api.get(f'/api/appointments/{self.appointment.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['client'], self.client_user.id)
+
+    def test_writes_load_the_database_user(self):
+        access = self.obtain('cliente@thark.com')['access']
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.api.post('/api/appointments/', {
+            'professional': self.professional.id, 'service': self.service.id,
+            'establishment': self.establishment.id, 'start_time': self.utc(date(2030, 6, 3), 13).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Appointment.objects.get(id=response.data['id']).client_id, self.client_user.id)
+
+    def test_role_change_invalidates_old_tokens(self):
+        tokens = self.obtain('admin@thark.com')
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        self.assertEqual(self.api.get('/api/appointments/?page=1').status_code, 200)
+
+        self.admin_professional.delete() # Admin desvinculado do estabelecimento
+        self.assertEqual(self.api.get('/api/appointments/?page=1').status_code, 401)
+
+        from rest_framework_simplejwt.tokens import AccessToken
+        refreshed = self.api.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').data['access']
+        self.assertIsNone(AccessToken(refreshed)['establishment'])
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed}')
+        response = self.api.get('/api/appointments/?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_cached_version_expires_for_other_processes(self):
+        from django.db.models import F
+        from .authentication import role_version, role_version_timeout
+        self.assertEqual(role_version_timeout(), 60)
+        with override_settings(ROLE_VERSION_CACHE_TIMEOUT=3600):
+            self.assertEqual(role_version_timeout(), 300) # Nunca além da validade do access token
+        version = role_version(self.admin.pk)
+        # Mudança feita por outro processo: o cache deste não é apagado
+        CustomUser.objects.filter(pk=self.admin.pk).update(role_version=F('role_version') + 1)
+        self.assertEqual(role_version(self.admin.pk), version)
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=clock.time() + 61):
+            self.assertEqual(role_version(self.admin.pk), version + 1)
+
+    def test_flag_change_bumps_version(self):
+        access = self.obtain('cliente@thark.com')['access']
+        user = CustomUser.objects.get(pk=self.client_user.pk)
+        user.first_name = 'Maria'
+        user.save()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.api.get('/api/appointments/?page=1').status_code, 200)
+
+        user.is_owner = True
+        user.save()
+        self.assertEqual(self.api.get('/api/appointments/?page=1').status_code, 401)
+
+
+class MembershipTests(SchedulingFixtureMixin, TestCase):
+    """
+    A tabela de vínculos acompanha donos, profissionais e clientes, e a listagem de usuários do admin
+    é uma consulta por ela (sem OR entre joins nem DISTINCT).
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.admin = CustomUser.objects.create_user(email='admin@thark.com', username='admin', password='senha123', is_admin=True)
+        self.admin_professional = Professional.objects.create(establishment=self.establishment, name='Admin', user_account=self.admin)
+        other_owner = CustomUser.objects.create_user(email='outro@thark.com', username='outro', password='senha123', is_owner=True)
+        self.other = Establishment.objects.create(owner=other_owner, name='Outra Barbearia')
+        self.stranger = CustomUser.objects.create_user(email='estranho@thark.com', username='estranho', password='senha123', is_client=True)
+        self.api = APIClient()
+
+    def members(self, establishment):
+        return set(EstablishmentMembership.objects.filter(establishment=establishment).values_list('user_id', 'role'))
+
+    def test_signals_keep_memberships(self):
+        self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.assertEqual(self.members(self.establishment), {
+            (self.owner.id, 'OWNER'), (self.admin.id, 'PROFESSIONAL'), (self.client_user.id, 'CLIENT'),
+        })
+
+        self.admin_professional.establishment = self.other
+        self.admin_professional.save()
+        self.assertNotIn((self.admin.id, 'PROFESSIONAL'), self.members(self.establishment))
+        self.assertIn((self.admin.id, 'PROFESSIONAL'), self.members(self.other))
+
+        self.admin_professional.delete()
+        self.assertNotIn((self.admin.id, 'PROFESSIONAL'), self.members(self.other))
+
+    def test_bulk_booking_adds_client(self):
+        self.api.force_authenticate(self.stranger)
+        response = self.api.post('/api/appointments/bulk/', {'appointments': [
+            {'professional': self.professional.id, 'service': self.service.id, 'start_time': self.utc(date(2030, 6, 3), 9).isoformat()},
+        ]}, format='json')
+        self.assertEqual(len(response.data['accepted']), 1)
+        self.assertIn((self.stranger.id, 'CLIENT'), self.members(self.establishment))
+
+    def test_admin_user_list_is_a_single_lookup(self):
+        self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        self.api.force_authenticate(CustomUser.objects.get(pk=self.admin.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/users/?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['id'] for row in response.data['results']}, {self.owner.id, self.admin.id, self.client_user.id})
+        self.assertEqual(len(queries), 3) # Perfil (IDs) + COUNT + página
+        self.assertNotIn('DISTINCT', queries[-1]['sql'])
+
+    def test_backfill_restores_and_verifies(self):
+        self.book(self.professional, self.utc(date(2030, 6, 3), 9))
+        expected = self.members(self.establishment)
+        EstablishmentMembership.objects.all().delete()
+        EstablishmentMembership.objects.create(establishment=self.establishment, user=self.stranger, role='CLIENT')
+
+        with self.assertRaises(CommandError):
+            call_command('backfill_memberships', verify_only=True, stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('backfill_memberships', stdout=out)
+        self.assertIn('consistentes', out.getvalue())
+        self.assertEqual(self.members(self.establishment), expected)
+
+
+class OnboardingImportTests(SchedulingFixtureMixin, TestCase):
+    """
+    Importação de onboarding: validação por linha em memória, slugs resolvidos em lote e bulk_create
+    em uma transação (número de consultas independente do tamanho do arquivo).
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.barber = CustomUser.objects.create_user(email='barbeiro@thark.com', username='barbeiro', password='senha123')
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+        self.payload = {'establishments': [{
+            'name': 'Barbearia Thark', 'address': 'Rua A, 1',
+            'services': [{'name': 'Barba', 'price': '30.00', 'duration_minutes': 20}],
+            'professionals': [{
+                'name': 'Carlos', 'user_email': 'barbeiro@thark.com',
+                'availabilities': [{'day_of_week': 1, 'start_time': '09:00', 'end_time': '12:00'}],
+            }],
+            'holidays': [{'date': '2030-12-25', 'is_recurring': True}],
+        }]}
+
+    def csv_file(self, professionals):
+        lines = ['type,establishment,name,price,duration_minutes,professional,day_of_week,start_time,end_time', 'establishment,,Franquia Centro,,,,,,']
+        lines.append('service,Franquia Centro,Corte,45.00,30,,,,')
+        for index in range(professionals):
+            lines.append(f'professional,Franquia Centro,Profissional {index},,,,,,')
+            lines.extend(f'availability,Franquia Centro,,,,Profissional {index},{day},09:00,18:00' for day in range(1, 7))
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        handle.write('\n'.join(lines))
+        handle.close()
+        self.addCleanup(os.unlink, handle.name)
+        return handle.name
+
+    def test_json_import_creates_everything(self):
+        response = self.api.post('/api/establishments/import/', self.payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        establishment = Establishment.objects.get(id=response.data['establishments'][0]['id'])
+        self.assertEqual(establishment.slug, 'barbearia-thark-1') # 'barbearia-thark' já existe
+        self.assertEqual(establishment.owner, self.owner)
+        professional = establishment.professionals.get()
+        self.assertEqual(professional.user_account, self.barber)
+        self.assertEqual(professional.availabilities.count(), 1)
+        self.assertEqual(establishment.services.get().duration_minutes, 20)
+        self.assertTrue(establishment.holidays.get().is_recurring)
+        self.assertEqual(
+            set(EstablishmentMembership.objects.filter(establishment=establishment).values_list('user_id', 'role')),
+            {(self.owner.id, 'OWNER'), (self.barber.id, 'PROFESSIONAL')},
+        )
+
+    def test_row_errors_import_nothing(self):
+        self.payload['establishments'][0]['services'].append({'name': 'Barba', 'price': '-1', 'duration_minutes': 20})
+        self.payload['establishments'][0]['professionals'][0]['availabilities'][0]['end_time'] = '08:00'
+        response = self.api.post('/api/establishments/import/', self.payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.data['errors']], [
+            'establishments[0].services[1]', 'establishments[0].professionals[0].availabilities[0]',
+        ])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(Establishment.objects.count(), 1)
+
+        self.payload['establishments'][0]['services'].pop()
+        self.payload['establishments'][0]['professionals'][0]['availabilities'][0]['end_time'] = '12:00'
+        self.payload['establishments'][0]['professionals'][0]['user_email'] = 'ninguem@thark.com'
+        self.payload['establishments'][0]['holidays'].append({'establishment': 'Outra', 'date': '2030-12-25'})
+        response = self.api.post('/api/establishments/import/', self.payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('user_email', response.data['errors'][0]['errors'])
+        self.assertEqual(Establishment.objects.count(), 1)
+
+    def test_dry_run_and_permissions(self):
+        response = self.api.post('/api/establishments/import/?dry_run=1', self.payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['professionals'], 1)
+        self.assertEqual(Establishment.objects.count(), 1)
+
+        self.api.force_authenticate(self.client_user)
+        self.assertEqual(self.api.post('/api/establishments/import/', self.payload, format='json').status_code, 403)
+
+    def test_csv_command_query_count_does_not_depend_on_size(self):
+        counts = []
+        for size in (2, 30): # Até o limite de um lote do bulk_create
+            path = self.csv_file(size)
+            Establishment.objects.filter(name='Franquia Centro').delete()
+            out = StringIO()
+            with CaptureQueriesContext(connection) as queries:
+                call_command('import_onboarding', path, owner='dono@thark.com', stdout=out)
+            counts.append(len(queries))
+            self.assertEqual(Availability.objects.filter(professional__establishment__name='Franquia Centro').count(), size * 6)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_command_reports_row_errors(self):
+        path = self.csv_file(1)
+        with open(path, 'a', encoding='utf-8') as handle:
+            handle.write('\nservice,Franquia Centro,Corte,abc,30,,,,')
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('import_onboarding', path, owner='dono@thark.com', stdout=StringIO(), stderr=err)
+        self.assertIn('Linha 11: price', err.getvalue())
+        self.assertFalse(Establishment.objects.filter(name='Franquia Centro').exists())
+
+    def test_save_resolves_slug_in_one_query(self):
+        Establishment.objects.create(owner=self.owner, name='Barbearia Thark', slug='barbearia-thark-1')
+        with CaptureQueriesContext(connection) as queries:
+            establishment = Establishment.objects.create(owner=self.owner, name='Barbearia Thark')
+        self.assertEqual(establishment.slug, 'barbearia-thark-2')
+        self.assertEqual(sum('"slug"' in query['sql'] and query['sql'].startswith('SELECT') for query in queries), 1)
+
+
+class WeeklyScheduleTests(SchedulingFixtureMixin, TestCase):
+    """
+    PUT /professionals/{id}/schedule/ troca a semana inteira: janelas sobrepostas são unidas,
+    as que não mudaram são mantidas e o cache dos dias da semana afetados é invalidado.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+        self.url = f'/api/professionals/{self.professional.id}/schedule/'
+        self.slots_url = f'/api/professionals/{self.professional.id}/available-slots/'
+        self.params = {'start_date': '2030-06-03', 'end_date': '2030-06-09'}
+
+    def windows(self):
+        return list(Availability.objects.filter(professional=self.professional).order_by('day_of_week', 'start_time').values_list('day_of_week', 'start_time', 'end_time'))
+
+    def test_replaces_week_with_merged_windows(self):
+        kept = Availability.objects.get(professional=self.professional, day_of_week=2, start_time=time(13))
+        self.api.get(self.slots_url, self.params) # Aquece o cache
+
+        with mock.patch.object(slot_cache, 'invalidate_weekday', wraps=slot_cache.invalidate_weekday) as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.api.put(self.url, {'availabilities': [
+                    {'day_of_week': 1, 'start_time': '09:00', 'end_time': '12:00'},
+                    {'day_of_week': 1, 'start_time': '11:00', 'end_time': '14:00'},
+                    {'day_of_week': 1, 'start_time': '14:00', 'end_time': '15:00'},
+                    {'day_of_week': 2, 'start_time': '13:00', 'end_time': '18:00'},
+                ]}, format='json')
+                self.assertEqual(invalidate.call_count, 0) # Só depois do commit
+        # Uma invalidação por dia da semana afetado, sem as repetidas dos sinais de cada janela removida
+        self.assertEqual(sorted(call.args[1] for call in invalidate.call_args_list), [1, 2, 3, 4, 5, 6])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['removed']), (1, 11))
+        self.assertEqual(self.windows(), [(1, time(9), time(15)), (2, time(13), time(18))])
+        self.assertTrue(Availability.objects.filter(pk=kept.pk).exists())
+
+        slots = self.api.get(self.slots_url, self.params).data
+        self.assertEqual(slots['2030-06-03'], [{'start': '2030-06-03T09:00:00+00:00', 'end': '2030-06-03T15:00:00+00:00'}])
+        self.assertEqual(slots['2030-06-05'], [])
+
+    def test_query_count_does_not_depend_on_week_size(self):
+        counts = []
+        for hours in ((9, 10), (11, 12, 13, 14, 15, 16, 17, 18)):
+            week = [{'day_of_week': day, 'start_time': f'{hour:02d}:00', 'end_time': f'{hour:02d}:30'} for day in range(7) for hour in hours]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.put(self.url, {'availabilities': week}, format='json')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_window_changes_nothing(self):
+        before = self.windows()
+        response = self.api.put(self.url, {'availabilities': [{'day_of_week': 1, 'start_time': '12:00', 'end_time': '09:00'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.windows(), before)
+
+        self.assertEqual(self.api.put(self.url, {'availabilities': []}, format='json').status_code, 200)
+        self.assertEqual(self.windows(), [])
+
+    def test_only_owner_or_establishment_admin(self):
+        self.api.force_authenticate(self.client_user)
+        self.assertEqual(self.api.put(self.url, {'availabilities': []}, format='json').status_code, 403)
+
+        admin = CustomUser.objects.create_user(email='admin@outra.com', username='admin-outra', password='senha123', is_admin=True)
+        other = Establishment.objects.create(owner=self.owner, name='Outra Barbearia')
+        Professional.objects.create(establishment=other, name='Admin', user_account=admin)
+        self.api.force_authenticate(CustomUser.objects.get(pk=admin.pk))
+        self.assertEqual(self.api.put(self.url, {'availabilities': []}, format='json').status_code, 404)
+        self.assertEqual(len(self.windows()), 12)
+
+
+class UnreadCounterTests(SchedulingFixtureMixin, TestCase):
+    """
+    Contador desnormalizado de não lidas e marcação em lote com um único UPDATE.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.notifications = [Notification.objects.create(user=self.client_user, message=f'Mensagem {index}') for index in range(5)]
+        Notification.objects.create(user=self.owner, message='Outro usuário')
+
+    def counter(self):
+        return NotificationCounter.objects.get(user=self.client_user).unread
+
+    def test_counter_follows_create_read_and_delete(self):
+        self.assertEqual(self.counter(), 5)
+        notification = Notification.objects.get(pk=self.notifications[0].pk)
+        notification.is_read = True
+        notification.save()
+        self.assertEqual(self.counter(), 4)
+        notification.is_read = False
+        notification.save()
+        self.assertEqual(self.counter(), 5)
+        self.notifications[1].delete()
+        self.assertEqual(self.counter(), 4)
+        Notification.objects.filter(pk=self.notifications[2].pk).only('id').get().save() # is_read adiado: recalcula
+        self.assertEqual(self.counter(), 4)
+
+    def test_unread_count_endpoint(self):
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/notifications/unread-count/')
+        self.assertEqual(response.data, {'unread': 5})
+
+        NotificationCounter.objects.all().delete() # Sem contador: calculado na primeira leitura
+        self.assertEqual(self.api.get('/api/notifications/unread-count/').data, {'unread': 5})
+        self.assertEqual(self.counter(), 5)
+
+    def test_mark_read_and_mark_all_read(self):
+        ids = [notification.id for notification in self.notifications[:2]]
+        other = Notification.objects.get(user=self.owner)
+        response = self.api.post('/api/notifications/mark-read/', {'ids': ids + [other.id]}, format='json')
+        self.assertEqual(response.data, {'updated': 2, 'unread': 3})
+        self.assertFalse(Notification.objects.get(pk=other.pk).is_read)
+
+        response = self.api.post('/api/notifications/mark-read/', {'ids': ids}, format='json')
+        self.assertEqual(response.data, {'updated': 0, 'unread': 3})
+
+        response = self.api.post(f'/api/notifications/{self.notifications[2].id}/mark-as-read/')
+        self.assertTrue(response.data['is_read'])
+        self.assertEqual(self.counter(), 2)
+
+        response = self.api.post('/api/notifications/mark-all-read/')
+        self.assertEqual(response.data, {'updated': 2, 'unread': 0})
+        self.assertFalse(Notification.objects.filter(user=self.client_user, is_read=False).exists())
+        self.assertEqual(self.api.post('/api/notifications/mark-read/', {'ids': []}, format='json').status_code, 400)
+
+    def test_mark_all_read_is_a_single_update(self):
+        Notification.objects.bulk_create(Notification(user=self.client_user, message=f'Lote {index}') for index in range(500))
+        unread.recount(self.client_user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.post('/api/notifications/mark-all-read/')
+        self.assertEqual(response.data, {'updated': 505, 'unread': 0})
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "Formulario_notification"') for query in queries), 1)
+        self.assertLessEqual(len(queries), 3) # UPDATE das notificações + UPDATE do contador + leitura do contador
+
+
+class NotificationStreamTests(SchedulingFixtureMixin, TestCase):
+    """
+    SSE em /api/notifications/stream/: o usuário recebe só as próprias notificações, assim que a
+    transação é confirmada, e a reconexão com Last-Event-ID reenvia as perdidas.
+    """
+    def setUp(self):
+        self.create_fixture()
+        from .authentication import RoleTokenObtainPairSerializer
+        self.token = str(RoleTokenObtainPairSerializer.get_token(self.client_user).access_token)
+        self.url = '/api/notifications/stream/'
+
+    def notify(self, user, message):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=user, message=message, type='PAYMENT_SUCCESS')
+
+    async def next_event(self, content):
+        return await asyncio.wait_for(content.__anext__(), timeout=5)
+
+    async def test_pushes_new_notifications_to_their_user(self):
+        response = await AsyncClient().get(self.url, {'token': self.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        self.assertEqual(await self.next_event(content), b'retry: 5000\n\n')
+
+        await sync_to_async(self.notify)(self.owner, 'Para o dono')
+        notification = await sync_to_async(self.notify)(self.client_user, 'Pagamento aprovado')
+        frame = (await self.next_event(content)).decode()
+        self.assertTrue(frame.startswith(f'id: {notification.id}\nevent: notification\n'))
+        self.assertIn('"message":"Pagamento aprovado"', frame)
+
+        await content.aclose()
+
+    async def test_closing_the_stream_unsubscribes(self):
+        stream = push.events(self.client_user.id, None)
+        await self.next_event(stream)
+        self.assertEqual(push.get_broker().connections(), 1)
+        await stream.aclose()
+        self.assertEqual(push.get_broker().connections(), 0)
+
+    async def test_notifications_from_other_processes_arrive_through_the_shared_broker(self):
+        await sync_to_async(self.notify)(self.client_user, 'Antiga')
+        stream = push.events(self.client_user.id, None)
+        await self.next_event(stream)
+        # Outra instância do broker, como no worker do outbox: grava em lote e publica pelo socket
+        worker = push.SocketBroker()
+        [notification] = await sync_to_async(Notification.objects.bulk_create)([Notification(user=self.client_user, message='Lembrete')])
+        self.assertEqual(await sync_to_async(worker.publish)(self.client_user.id, push.event_frame(notification)), 1)
+        frame = await self.next_event(stream)
+        self.assertTrue(frame.startswith(f'id: {notification.id}\n'.encode()))
+        self.assertIn(b'"message":"Lembrete"', frame) # A antiga não é reenviada
+        await stream.aclose()
+
+    def test_publish_removes_sockets_of_dead_processes(self):
+        broker = push.SocketBroker()
+        channel = broker.channel()
+        os.makedirs(channel, exist_ok=True)
+        stale = os.path.join(channel, '0-dead.sock')
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        dead.bind(stale)
+        dead.close() # O arquivo fica, mas ninguém escuta
+        broker.publish(self.client_user.id, (1, b''))
+        self.assertFalse(os.path.exists(stale))
+
+    async def test_reconnect_replays_missed_notifications(self):
+        first = await sync_to_async(self.notify)(self.client_user, 'Primeira')
+        second = await sync_to_async(self.notify)(self.client_user, 'Segunda')
+        response = await AsyncClient().get(self.url, {'token': self.token}, headers={'Last-Event-ID': str(first.id)})
+        content = response.streaming_content
+        await self.next_event(content)
+        self.assertTrue((await self.next_event(content)).startswith(f'id: {second.id}\n'.encode()))
+        await content.aclose()
+
+    async def test_rejects_missing_or_stale_tokens(self):
+        self.assertEqual((await AsyncClient().get(self.url)).status_code, 401)
+        user = await CustomUser.objects.aget(pk=self.client_user.pk)
+        user.is_owner = True
+        await sync_to_async(user.save)()
+        self.assertEqual((await AsyncClient().get(self.url, {'token': self.token})).status_code, 401)
+
+
+class NotificationOutboxTests(SchedulingFixtureMixin, TestCase):
+    """
+    As views só enfileiram o evento; o worker cria a notificação in-app em lote e entrega aos adaptadores,
+    com novas tentativas e backoff nas falhas.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.now = timezone.now() + timedelta(seconds=1) # Depois do available_at dos eventos criados no teste
+
+    def enqueue(self, count=1, user=None):
+        return [outbox.enqueue((user or self.client_user).id, 'GENERAL', f'Evento {index}') for index in range(count)]
+
+    def test_cancel_enqueues_and_worker_creates_notification(self):
+        appointment = self.book(self.professional, self.utc(date(2030, 6, 3), 10))
+        api = APIClient()
+        api.force_authenticate(self.client_user)
+        self.assertEqual(api.post(f'/api/appointments/{appointment.id}/cancel/').status_code, 200)
+        self.assertFalse(Notification.objects.exists())
+        event = NotificationOutbox.objects.get()
+        self.assertEqual((event.user_id, event.type, event.status), (self.client_user.id, 'APPOINTMENT_CANCELLATION', 'PENDING'))
+
+        adapter = outbox.FakeAdapter()
+        with self.captureOnCommitCallbacks(execute=True):
+            summary = outbox.dispatch(adapters=[adapter])
+        self.assertEqual(summary, {'claimed': 1, 'sent': 1, 'retrying': 0, 'failed': 0})
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.delivered), ('SENT', 1, ['fake']))
+        self.assertEqual(event.notification.message, Notification.objects.get(user=self.client_user).message)
+        self.assertEqual(adapter.sent, [event.id])
+        self.assertEqual(unread.unread_count(self.client_user.id), 1)
+        self.assertEqual(outbox.dispatch(adapters=[adapter])['claimed'], 0)
+
+    def test_failed_delivery_retries_with_backoff_without_duplicates(self):
+        event, = self.enqueue()
+        email, sms = outbox.FakeAdapter('email', failures=1), outbox.FakeAdapter('sms')
+
+        with self.assertLogs('Formulario.outbox', 'WARNING'):
+            self.assertEqual(outbox.dispatch(adapters=[email, sms], now=self.now)['retrying'], 1)
+        event.refresh_from_db()
+        self.assertEqual(event.available_at, self.now + timedelta(seconds=30))
+        self.assertEqual(event.delivered, ['sms'])
+        self.assertIn('email: Falha simulada.', event.last_error)
+        self.assertEqual(outbox.dispatch(adapters=[email, sms], now=self.now + timedelta(seconds=29))['claimed'], 0)
+
+        self.assertEqual(outbox.dispatch(adapters=[email, sms], now=self.now + timedelta(seconds=30))['sent'], 1)
+        self.assertEqual((email.sent, sms.sent), ([event.id], [event.id]))
+        self.assertEqual(Notification.objects.filter(user=self.client_user).count(), 1)
+
+    @override_settings(NOTIFICATION_OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        event, = self.enqueue()
+        adapter = outbox.FakeAdapter(failures=5)
+        with self.assertLogs('Formulario.outbox', 'WARNING'):
+            outbox.dispatch(adapters=[adapter], now=self.now)
+            self.assertEqual(outbox.dispatch(adapters=[adapter], now=self.now + timedelta(hours=1))['failed'], 1)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('FAILED', 2))
+        self.assertEqual(outbox.dispatch(adapters=[adapter], now=self.now + timedelta(days=1))['claimed'], 0)
+
+    def test_claimed_events_return_after_lease(self):
+        self.enqueue(2)
+        self.assertEqual(len(outbox.claim(10, now=self.now)), 2) # Worker morreu antes de concluir
+        self.assertEqual(outbox.dispatch(adapters=[], now=self.now)['claimed'], 0)
+        self.assertEqual(outbox.dispatch(adapters=[], now=self.now + timedelta(minutes=5))['sent'], 2)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_rolled_back_transaction_discards_event(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.enqueue()
+            raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_batch_queries_do_not_grow_with_events(self):
+        unread.recount(self.owner.id) # Contador já existente: só o UPDATE relativo
+
+        def queries(count):
+            self.enqueue(count, user=self.owner)
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(outbox.dispatch(batch_size=50, adapters=[outbox.FakeAdapter()])['sent'], count)
+            return len(context)
+
+        self.assertEqual(queries(2), queries(30))
+
+    def test_adapters_run_concurrently(self):
+        self.enqueue(16)
+        adapter = outbox.FakeAdapter(latency=0.05)
+        started = clock.perf_counter()
+        outbox.dispatch(adapters=[adapter])
+        self.assertLess(clock.perf_counter() - started, 16 * 0.05 / 2)
+        self.assertEqual(len(adapter.sent), 16)
+
+    def test_command_dispatches_pending_events(self):
+        self.enqueue(3)
+        out = StringIO()
+        call_command('dispatch_notifications', stdout=out)
+        self.assertIn('3 eventos processados: 3 enviados', out.getvalue())
+
+
+class AppointmentReminderTests(SchedulingFixtureMixin, TestCase):
+    """
+    Lembretes nas janelas de 24h e 1h: um por janela alcançada, sem duplicar em execuções repetidas.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.now = datetime(2030, 6, 3, 8, tzinfo=dt_timezone.utc)
+
+    def book_in(self, delta, status='SCHEDULED'):
+        start = self.now + delta
+        return Appointment.objects.create(
+            client=self.client_user, professional=self.professional, service=self.service,
+            establishment=self.establishment, start_time=start, end_time=start + timedelta(minutes=30), status=status,
+        )
+
+    def reminder_messages(self):
+        return list(NotificationOutbox.objects.filter(type='APPOINTMENT_REMINDER', user=self.client_user).values_list('message', flat=True))
+
+    def test_sends_each_window_once(self):
+        appointment = self.book_in(timedelta(hours=23))
+        self.book_in(timedelta(hours=50)) # Fora das janelas nas duas execuções
+        self.book_in(timedelta(hours=2), status='CANCELED')
+        self.book_in(timedelta(hours=-1))
+
+        self.assertEqual(reminders.send_due(now=self.now), 1)
+        self.assertEqual(reminders.send_due(now=self.now + timedelta(minutes=5)), 0)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.reminder_window, 24 * 60)
+
+        self.assertEqual(reminders.send_due(now=self.now + timedelta(hours=22, minutes=30)), 1)
+        self.assertEqual(reminders.send_due(now=self.now + timedelta(hours=22, minutes=45)), 0)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.reminder_window, 60)
+        self.assertEqual(self.reminder_messages(), [
+            "Lembrete: seu agendamento de Corte está marcado para 04/06/2030 07:00.",
+        ] * 2)
+
+    def test_late_appointment_gets_only_the_nearest_window(self):
+        appointment = self.book_in(timedelta(minutes=30))
+        self.assertEqual(reminders.send_due(now=self.now), 1)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.reminder_window, 60)
+        self.assertEqual(reminders.send_due(now=self.now), 0)
+
+    def test_reschedule_resets_reminders(self):
+        appointment = self.book_in(timedelta(hours=20))
+        reminders.send_due(now=self.now)
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        appointment.start_time += timedelta(days=1)
+        appointment.end_time += timedelta(days=1)
+        appointment.save()
+        self.assertIsNone(Appointment.objects.get(pk=appointment.pk).reminder_window)
+        self.assertEqual(reminders.send_due(now=self.now + timedelta(days=1)), 1)
+
+    def test_batches_cover_every_due_appointment(self):
+        appointments = [self.book_in(timedelta(hours=1, minutes=minutes)) for minutes in (10, 10, 20, 30, 40)]
+        self.assertEqual(reminders.send_due(now=self.now, batch_size=2), 5)
+        self.assertEqual(
+            set(Appointment.objects.filter(pk__in=[appointment.pk for appointment in appointments]).values_list('reminder_window', flat=True)),
+            {24 * 60},
+        )
+        self.assertEqual(NotificationOutbox.objects.count(), 5)
+
+    def test_command_reports_queued_reminders(self):
+        start = timezone.now() + timedelta(hours=3)
+        Appointment.objects.create(
+            client=self.client_user, professional=self.professional, service=self.service,
+            establishment=self.establishment, start_time=start, end_time=start + timedelta(minutes=30),
+        )
+        out = StringIO()
+        call_command('send_appointment_reminders', stdout=out)
+        self.assertIn('1 lembretes enfileirados.', out.getvalue())
+
+
+class PaymentWebhookTests(SchedulingFixtureMixin, TestCase):
+    """
+    O webhook só grava e responde; o processador consulta o servidor falso do Mercado Pago e aplica as transições.
+    """
+    def setUp(self):
+        self.create_fixture()
+        self.appointment = self.book(self.professional, self.utc(date(2030, 6, 3), 10), status='PENDING_PAYMENT')
+        self.mercadopago = self.enterContext(FakeMercadoPago())
+        self.enterContext(override_settings(MERCADO_PAGO_API_URL=self.mercadopago.url))
+        self.api = APIClient()
+        self.url = '/api/payments/webhook/'
+
+    def notify(self, payment_id=123, action='payment.updated', notification=None):
+        body = {'action': action, 'type': 'payment', 'data': {'id': str(payment_id)}}
+        if notification is not None:
+            body['id'] = notification # ID da notificação, repetido nas reentregas
+        return self.api.post(self.url, body, format='json')
+
+    def test_acks_and_deduplicates_without_calling_mercado_pago(self):
+        for _ in range(3):
+            self.assertEqual(self.notify().status_code, 200)
+        self.assertEqual(self.api.post(f'{self.url}?topic=payment&id=123').status_code, 200) # Formato IPN
+        self.assertEqual(self.mercadopago.lookups, 0)
+        self.assertEqual(
+            sorted(PaymentWebhookEvent.objects.values_list('payment_id', 'action', 'status')),
+            [('123', 'payment', 'PENDING'), ('123', 'payment.updated', 'PENDING')],
+        )
+        self.assertEqual(self.api.post(f'{self.url}?topic=payment').status_code, 400)
+        self.assertEqual(self.api.post(f'{self.url}?topic=merchant_order&id=9').status_code, 200)
+        self.assertEqual(PaymentWebhookEvent.objects.count(), 2)
+
+    def test_processor_applies_each_state_once(self):
+        self.mercadopago.add(123, 'approved', external_reference=self.appointment.id)
+        self.notify(action='payment.created', notification=1)
+        self.notify(notification=2)
+        # Lote de 1 leva junto a outra ação do mesmo pagamento: uma consulta só
+        self.assertEqual(payments.process(batch_size=1), {'claimed': 2, 'processed': 2, 'ignored': 0, 'retrying': 0, 'failed': 0})
+        self.assertEqual(self.mercadopago.lookups, 1)
+
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.status, self.appointment.payment_status, self.appointment.mercadopago_payment_id), ('CONFIRMED', 'PAID', '123'))
+        self.assertEqual(Payment.objects.get(appointment=self.appointment).status, 'approved')
+        self.assertEqual(list(NotificationOutbox.objects.values_list('type', flat=True)), ['PAYMENT_SUCCESS'])
+
+        self.notify(notification=2) # Reentrega da mesma notificação: já processada, nem consulta de novo
+        self.assertEqual(payments.process()['claimed'], 0)
+        self.assertEqual(PaymentWebhookEvent.objects.get(action='payment.updated').status, 'PROCESSED')
+        self.assertEqual(self.mercadopago.lookups, 1)
+
+        self.notify() # Sem ID (como no IPN) não dá para distinguir: consulta de novo, sem repetir o aviso
+        self.assertEqual(payments.process()['processed'], 1)
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+        self.mercadopago.add(123, 'refunded', external_reference=self.appointment.id)
+        self.notify(notification=3)
+        payments.process()
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.status, self.appointment.payment_status), ('CANCELED', 'REFUNDED'))
+        self.assertEqual(Payment.objects.get(appointment=self.appointment).status, 'refunded')
+
+    def test_failed_lookup_retries_with_backoff(self):
+        self.mercadopago.add(123, 'rejected', external_reference=self.appointment.id)
+        self.mercadopago.failures = 1
+        self.notify()
+        now = timezone.now()
+        self.assertEqual(payments.process(now=now)['retrying'], 1)
+        event = PaymentWebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.last_error), ('PENDING', 1, 'Mercado Pago respondeu HTTP 500'))
+        self.assertEqual(payments.process(now=now + timedelta(seconds=29))['claimed'], 0)
+        self.assertEqual(payments.process(now=now + timedelta(seconds=30))['processed'], 1)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.payment_status, 'REJECTED')
+        self.assertEqual(list(NotificationOutbox.objects.values_list('type', flat=True)), ['PAYMENT_FAILURE'])
+
+    def test_late_payment_revalidates_canceled_slot(self):
+        # Reserva expirada: o horário foi liberado e outro cliente o ocupou antes do pagamento chegar
+        self.appointment.status = 'CANCELED'
+        self.appointment.save()
+        self.book(self.professional, self.utc(date(2030, 6, 3), 10))
+        late = self.book(self.professional, self.utc(date(2030, 6, 3), 14), status='CANCELED')
+        self.mercadopago.add(123, 'approved', external_reference=self.appointment.id)
+        self.mercadopago.add(124, 'approved', external_reference=late.id)
+        self.notify(123)
+        self.notify(124)
+        with self.assertLogs('Formulario.payments', 'WARNING'):
+            self.assertEqual(payments.process()['processed'], 2)
+
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.status, self.appointment.payment_status), ('CANCELED', 'REFUND_DUE'))
+        self.assertEqual(Payment.objects.get(appointment=self.appointment).status, 'approved')
+        late.refresh_from_db()
+        self.assertEqual((late.status, late.payment_status), ('CONFIRMED', 'PAID'))
+        self.assertEqual(sorted(NotificationOutbox.objects.values_list('type', flat=True)), ['GENERAL', 'PAYMENT_SUCCESS'])
+
+    def test_failing_payment_does_not_fail_the_batch(self):
+        paid = self.book(self.professional, self.utc(date(2030, 6, 3), 14), status='CONFIRMED')
+        Payment.objects.create(appointment=paid, mercadopago_id='777', status='approved', amount='50.00')
+        other = self.book(self.professional, self.utc(date(2030, 6, 3), 15), status='PENDING_PAYMENT')
+        self.mercadopago.add(123, 'approved', external_reference=self.appointment.id)
+        self.mercadopago.add(777, 'approved', external_reference=other.id) # mercadopago_id já usado: o upsert falha
+        self.notify(123)
+        self.notify(777)
+        with self.assertLogs('Formulario.payments', 'ERROR'):
+            summary = payments.process()
+        self.assertEqual((summary['processed'], summary['retrying']), (1, 1))
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'CONFIRMED')
+        other.refresh_from_db()
+        self.assertEqual(other.status, 'PENDING_PAYMENT') # Savepoint desfeito: nem o save() do agendamento ficou
+        self.assertEqual(PaymentWebhookEvent.objects.get(payment_id='777').status, 'PENDING')
+
+    def test_unknown_appointment_is_ignored(self):
+        self.mercadopago.add(456, 'approved', external_reference=999999)
+        self.notify(456)
+        with self.assertLogs('Formulario.payments', 'WARNING'):
+            self.assertEqual(payments.process()['ignored'], 1)
+        self.assertEqual(PaymentWebhookEvent.objects.get().status, 'IGNORED')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_command_processes_pending_events(self):
+        self.mercadopago.add(123, 'pending', external_reference=self.appointment.id)
+        self.notify()
+        out = StringIO()
+        call_command('process_payment_webhooks', stdout=out)
+        self.assertIn('1 eventos processados: 1 aplicados', out.getvalue())
@@ -0,0 +1,45 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Notification, NotificationCounter
+
+
+def unread_count(user_id):
+    """
+    Não lidas do usuário, lidas do contador (uma consulta por chave primária).
+    Usuários sem contador ainda têm o valor calculado e gravado na primeira leitura.
+    """
+    count = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    if count is None:
+        count = recount(user_id)
+    return count
+
+
+def recount(user_id):
+    count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    NotificationCounter.objects.update_or_create(user_id=user_id, defaults={'unread': count})
+    return count
+
+
+def adjust(deltas, create_missing=True):
+    """
+    Aplica {user_id: delta} aos contadores com UPDATE relativo (sem ler o valor antes).
+    Deve ser chamado depois de gravar as notificações: um contador ausente é criado por contagem
+    (create_missing=False na remoção, que pode vir da exclusão em cascata do próprio usuário).
+    """
+    for user_id, delta in deltas.items():
+        if user_id is None or not delta:
+            continue
+        updated = NotificationCounter.objects.filter(user_id=user_id).update(unread=Greatest(F('unread') + delta, 0))
+        if not updated and create_missing:
+            recount(user_id)
+
+
+def mark_read(user_id, queryset):
+    """
+    Marca como lidas as notificações do queryset (já restrito ao usuário) com um único UPDATE.
+    Só as linhas que ainda estavam não lidas entram no contador, então chamadas concorrentes não descontam duas vezes.
+    """
+    updated = queryset.filter(is_read=False).update(is_read=True)
+    adjust({user_id: -updated})
+    return updated
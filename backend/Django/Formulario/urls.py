@@ -3,8 +3,10 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     AuthViewSet, CustomUserViewSet, EstablishmentViewSet, ServiceViewSet,
     ProfessionalViewSet, AppointmentViewSet, AvailabilityViewSet, HolidayViewSet,
-    PaymentViewSet, mercadopago_webhook, NotificationViewSet
+    PaymentViewSet, mercadopago_webhook, NotificationViewSet, slot_cache_stats
 )
+from .metrics import metrics_view
+from .push import notification_stream
 
 router = DefaultRouter()
 router.register(r'auth', AuthViewSet, basename='auth')
@@ -20,6 +22,9 @@ router.register(r'notifications', NotificationViewSet)
 
 
 urlpatterns = [
+    path('notifications/stream/', notification_stream, name='notification-stream'), # Antes do router (senão vira detalhe)
+    path('payments/webhook/', mercadopago_webhook, name='mercadopago_webhook'), # Idem: senão cai em payments/{pk}/
     path('', include(router.urls)),
-    path('payments/webhook/', mercadopago_webhook, name='mercadopago_webhook'),
+    path('slots/cache-stats/', slot_cache_stats, name='slot_cache_stats'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -2,8 +2,8 @@ from rest_framework import viewsets, status, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework_simplejwt.tokens import RefreshToken
 
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta, date, time
@@ -12,9 +12,19 @@ from .models import CustomUser, Establishment, Service, Professional, Appointmen
 from .serializers import (
     CustomUserSerializer, RegisterSerializer, EstablishmentSerializer,
     ServiceSerializer, ProfessionalSerializer, AppointmentSerializer,
-    AvailabilitySerializer, HolidaySerializer, PaymentSerializer, NotificationSerializer
+    AvailabilitySerializer, HolidaySerializer, PaymentSerializer, NotificationSerializer,
+    BulkAppointmentSerializer, WeeklyScheduleSerializer, NotificationIdsSerializer
 )
 from .permissions import IsOwnerOrAdminReadOnly, IsOwner, IsEstablishmentAdmin, IsClient, IsOwnerOrAdmin
+from .booking import book_atomically, book_many, lock_professional, rejection
+from .availability import replace_weekly_schedule
+from .pagination import AppointmentPagination, NotificationPagination
+from .fast_list import FastListMixin
+from .sparse_fields import SparseFieldsMixin
+from .tenant import tenant_for
+from .authentication import RoleTokenObtainPairSerializer
+from .scheduling import serialize_intervals, serialize_starts, find_next_available
+from . import holds, membership, onboarding, outbox, payments, slot_cache, unread
 
 import mercadopago # SDK do Mercado Pago
 from django.conf import settings
@@ -26,6 +36,35 @@ logger = logging.getLogger(__name__)
 # Configuração do Mercado Pago
 mp = mercadopago.SDK(settings.MERCADO_PAGO_ACCESS_TOKEN)
 
+
+# Maior intervalo aceito nos horários do estabelecimento (público e multiplicado pelo número de profissionais)
+MAX_DATE_RANGE_DAYS = 62
+
+
+def parse_date_range(query_params, max_days=None):
+    """
+    Lê start_date e end_date (YYYY-MM-DD) dos parâmetros da requisição, com no máximo max_days dias (se informado).
+    Retorna (start_date, end_date, mensagem de erro ou None).
+    """
+    start_date_str = query_params.get('start_date')
+    end_date_str = query_params.get('end_date')
+
+    if not start_date_str or not end_date_str:
+        return None, None, "start_date e end_date são obrigatórios."
+
+    try:
+        start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return None, None, "Formato de data inválido. Use YYYY-MM-DD."
+
+    if start_date > end_date:
+        return None, None, "start_date deve ser anterior ou igual a end_date."
+    if max_days is not None and (end_date - start_date).days >= max_days:
+        return None, None, f"O intervalo deve ter no máximo {max_days} dias."
+    return start_date, end_date, None
+
+
 class AuthViewSet(viewsets.ViewSet):
     permission_classes = [AllowAny]
 
@@ -34,7 +73,7 @@ class AuthViewSet(viewsets.ViewSet):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = RoleTokenObtainPairSerializer.get_token(user)
             return Response({
                 "user": CustomUserSerializer(user).data,
                 "access": str(refresh.access_token),
@@ -44,27 +83,25 @@ class AuthViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'], url_path='me', permission_classes=[IsAuthenticated])
     def me(self, request):
-        serializer = CustomUserSerializer(request.user)
+        user = request.user
+        if not isinstance(user, CustomUser): # Leitura autenticada só pelos claims do token
+            user = CustomUser.objects.get(pk=user.pk)
+        serializer = CustomUserSerializer(user)
         return Response(serializer.data)
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+class CustomUserViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsOwnerOrAdmin] # Permissão customizada
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
             return CustomUser.objects.all()
-        # Admins só podem ver usuários do seu estabelecimento ou o próprio
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-            establishment_users = CustomUser.objects.filter(
-                Q(establishments__owner=user) |
-                Q(professional_profile__establishment=user.professional_profile.establishment) |
-                Q(appointments_as_client__establishment=user.professional_profile.establishment)
-            ).distinct()
-            return CustomUser.objects.filter(Q(id=user.id) | Q(id__in=establishment_users))
-        return CustomUser.objects.filter(id=user.id) # Cliente só vê o próprio
+        # Admins só podem ver usuários do seu estabelecimento (dono, profissionais e clientes) ou o próprio
+        elif tenant.is_establishment_admin:
+            return CustomUser.objects.filter(Q(id=tenant.user_id) | Q(id__in=membership.member_ids(tenant.establishment_id)))
+        return CustomUser.objects.filter(id=tenant.user_id) # Cliente só vê o próprio
 
     def get_permissions(self):
         if self.action in ['retrieve', 'update', 'partial_update']:
@@ -74,7 +111,7 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
 
-class EstablishmentViewSet(viewsets.ModelViewSet):
+class EstablishmentViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = Establishment.objects.all()
     serializer_class = EstablishmentSerializer
     permission_classes = [AllowAny] # Pode ser mais restrito para criação/atualização
@@ -88,6 +125,27 @@ class EstablishmentViewSet(viewsets.ModelViewSet):
         # Garante que o owner seja o usuário logado
         serializer.save(owner=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsOwner])
+    def import_setup(self, request):
+        """
+        Importa estabelecimentos com serviços, profissionais, disponibilidades e feriados de uma vez:
+        JSON no corpo ou arquivo .csv/.json no campo 'file'. '?dry_run=1' apenas valida.
+        """
+        upload = request.FILES.get('file')
+        try:
+            if upload is not None:
+                rows = onboarding.parse(upload.read(), 'csv' if upload.name.lower().endswith('.csv') else 'json')
+            else:
+                rows = onboarding.parse_json(request.data)
+        except onboarding.OnboardingFormatError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true')
+        summary, errors = onboarding.import_setup(request.user, rows, dry_run=dry_run)
+        if errors:
+            return Response({"detail": "Nenhum registro foi importado.", "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'], url_path='services')
     def get_establishment_services(self, request, pk=None):
         establishment = self.get_object()
@@ -98,150 +156,170 @@ class EstablishmentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'], url_path='professionals')
     def get_establishment_professionals(self, request, pk=None):
         establishment = self.get_object()
-        professionals = establishment.professionals.filter(active=True)
+        professionals = establishment.professionals.filter(active=True).select_related('user_account')
         serializer = ProfessionalSerializer(professionals, many=True)
         return Response(serializer.data)
 
-class ServiceViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], url_path='available-slots')
+    def available_slots(self, request, pk=None):
+        establishment = self.get_object()
+
+        service_id = request.query_params.get('service')
+        if not service_id:
+            return Response({"error": "service é obrigatório."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            service = establishment.services.get(id=service_id, active=True)
+        except (Service.DoesNotExist, ValueError):
+            return Response({"error": "Serviço não encontrado neste estabelecimento."}, status=status.HTTP_404_NOT_FOUND)
+
+        start_date, end_date, error = parse_date_range(request.query_params, max_days=MAX_DATE_RANGE_DAYS)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Todos os profissionais ativos em lote: as consultas não crescem com o número de cadeiras
+        professionals = list(establishment.professionals.filter(active=True).only('id', 'name', 'establishment_id').order_by('name'))
+        intervals = holds.available_intervals(professionals, start_date, end_date)
+
+        return Response({
+            "establishment": establishment.id,
+            "service": service.id,
+            "duration_minutes": service.duration_minutes,
+            "professionals": [
+                {
+                    "id": professional.id,
+                    "name": professional.name,
+                    "slots": serialize_starts(intervals[professional.id], service.duration_minutes),
+                }
+                for professional in professionals
+            ],
+        })
+
+    @action(detail=True, methods=['get'], url_path='next-available')
+    def next_available(self, request, pk=None):
+        establishment = self.get_object()
+
+        service_id = request.query_params.get('service')
+        if not service_id:
+            return Response({"error": "service é obrigatório."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            service = establishment.services.get(id=service_id, active=True)
+        except (Service.DoesNotExist, ValueError):
+            return Response({"error": "Serviço não encontrado neste estabelecimento."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Filtros opcionais: quantidade de horários e faixa do dia (HH:MM)
+        try:
+            limit = int(request.query_params.get('limit', 5))
+            earliest = request.query_params.get('after')
+            latest = request.query_params.get('before')
+            earliest = timezone.datetime.strptime(earliest, '%H:%M').time() if earliest else None
+            latest = timezone.datetime.strptime(latest, '%H:%M').time() if latest else None
+        except ValueError:
+            return Response({"error": "Parâmetros inválidos. Use limit inteiro e after/before no formato HH:MM."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= 50:
+            return Response({"error": "limit deve estar entre 1 e 50."}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        professionals = establishment.professionals.filter(active=True).only('id', 'name', 'establishment_id').order_by('id')
+        found = find_next_available(
+            professionals, service.duration_minutes, limit, now.date(),
+            not_before=now, earliest=earliest, latest=latest, load=holds.available_intervals,
+        )
+
+        return Response({
+            "establishment": establishment.id,
+            "service": service.id,
+            "duration_minutes": service.duration_minutes,
+            "slots": [
+                {
+                    "professional_id": professional.id,
+                    "professional_name": professional.name,
+                    "start": start.isoformat(),
+                    "end": end.isoformat(),
+                }
+                for start, end, professional in found
+            ],
+        })
+
+class ServiceViewSet(SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [IsOwnerOrAdminReadOnly] # Proprietário/Admin podem editar, outros só ler
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
             return Service.objects.all()
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-            return Service.objects.filter(establishment=user.professional_profile.establishment)
+        elif tenant.is_establishment_admin:
+            return Service.objects.filter(establishment_id=tenant.establishment_id)
         return Service.objects.all() # Para clientes, mostrar todos os serviços públicos
 
-class ProfessionalViewSet(viewsets.ModelViewSet):
-    queryset = Professional.objects.all()
+class ProfessionalViewSet(SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
+    # Apenas as colunas usadas pelo ProfessionalSerializer (inclusive o usuário aninhado)
+    queryset = Professional.objects.select_related('user_account').only(
+        *(field.name for field in Professional._meta.concrete_fields),
+        *(f'user_account__{field}' for field in CustomUserSerializer.Meta.fields),
+    )
     serializer_class = ProfessionalSerializer
     permission_classes = [IsOwnerOrAdminReadOnly]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
-            return Professional.objects.all()
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-            return Professional.objects.filter(establishment=user.professional_profile.establishment)
-        return Professional.objects.all() # Para clientes, mostrar todos os profissionais públicos
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
+            return self.queryset.all()
+        elif tenant.is_establishment_admin:
+            return self.queryset.filter(establishment_id=tenant.establishment_id)
+        return self.queryset.all() # Para clientes, mostrar todos os profissionais públicos
 
     @action(detail=True, methods=['get'], url_path='available-slots')
     def available_slots(self, request, pk=None):
         professional = self.get_object()
-        establishment = professional.establishment
 
-        # Parâmetros de data
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
+        start_date, end_date, error = parse_date_range(request.query_params)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not start_date_str or not end_date_str:
-            return Response({"error": "start_date e end_date são obrigatórios."}, status=status.HTTP_400_BAD_REQUEST)
+        # Dias em cache são reaproveitados; os demais saem de consultas fixas para o intervalo inteiro
+        days = holds.available_intervals([professional], start_date, end_date)[professional.id]
+        return Response(serialize_intervals(days))
 
-        try:
-            start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        except ValueError:
-            return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
-
-        slots = {}
-        current_date = start_date
-        while current_date <= end_date:
-            day_of_week = current_date.weekday() # 0=Segunda, 6=Domingo
-            # Ajuste para a representação do Django (Domingo=0, Segunda=1, etc.)
-            django_day_of_week = (day_of_week + 1) % 7
-
-            # Verificar feriados
-            is_holiday = Holiday.objects.filter(establishment=establishment, date=current_date).exists()
-            if is_holiday:
-                current_date += timedelta(days=1)
-                continue
-
-            # Buscar disponibilidades do profissional para o dia da semana
-            availabilities = Availability.objects.filter(
-                professional=professional,
-                day_of_week=django_day_of_week
-            ).order_by('start_time')
-
-            day_slots = []
-            for availability in availabilities:
-                current_slot_start = timezone.datetime.combine(current_date, availability.start_time, tzinfo=timezone.utc)
-                availability_end = timezone.datetime.combine(current_date, availability.end_time, tzinfo=timezone.utc)
-
-                # Obter agendamentos existentes que se sobrepõem
-                booked_appointments = Appointment.objects.filter(
-                    professional=professional,
-                    start_time__lt=availability_end,
-                    end_time__gt=current_slot_start,
-                    status__in=['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT'] # Considerar agendamentos pendentes de pagamento como ocupados
-                ).order_by('start_time')
-
-                last_booked_end = current_slot_start
-
-                for booked_appointment in booked_appointments:
-                    # Adicionar slot antes do agendamento
-                    if booked_appointment.start_time > last_booked_end:
-                        day_slots.append({
-                            'start': last_booked_end.isoformat(),
-                            'end': booked_appointment.start_time.isoformat(),
-                        })
-                    last_booked_end = max(last_booked_end, booked_appointment.end_time)
-
-                # Adicionar slot após o último agendamento (se houver espaço)
-                if availability_end > last_booked_end:
-                    day_slots.append({
-                        'start': last_booked_end.isoformat(),
-                        'end': availability_end.isoformat(),
-                    })
-            
-            # Filtra slots que não são válidos (ex: start >= end)
-            day_slots = [slot for slot in day_slots if timezone.datetime.fromisoformat(slot['start']) < timezone.datetime.fromisoformat(slot['end'])]
-
-            # Juntar slots adjacentes
-            merged_slots = []
-            if day_slots:
-                day_slots.sort(key=lambda x: timezone.datetime.fromisoformat(x['start']))
-                current_merged_slot = timezone.datetime.fromisoformat(day_slots[0]['start']), timezone.datetime.fromisoformat(day_slots[0]['end'])
-                for i in range(1, len(day_slots)):
-                    next_start = timezone.datetime.fromisoformat(day_slots[i]['start'])
-                    next_end = timezone.datetime.fromisoformat(day_slots[i]['end'])
-
-                    # Se o próximo slot se sobrepõe ou é contíguo (ex: começa imediatamente após o anterior termina)
-                    if next_start <= current_merged_slot[1]:
-                        current_merged_slot = current_merged_slot[0], max(current_merged_slot[1], next_end)
-                    else:
-                        merged_slots.append({
-                            'start': current_merged_slot[0].isoformat(),
-                            'end': current_merged_slot[1].isoformat(),
-                        })
-                        current_merged_slot = next_start, next_end
-                merged_slots.append({
-                    'start': current_merged_slot[0].isoformat(),
-                    'end': current_merged_slot[1].isoformat(),
-                })
-
-            slots[current_date.isoformat()] = merged_slots
-            current_date += timedelta(days=1)
-
-        return Response(slots)
-
-class AppointmentViewSet(viewsets.ModelViewSet):
-    queryset = Appointment.objects.all()
+    @action(detail=True, methods=['put'], url_path='schedule', permission_classes=[IsOwnerOrAdmin])
+    def replace_schedule(self, request, pk=None):
+        """
+        Substitui a semana inteira do profissional (janelas sobrepostas são unidas antes de gravar).
+        """
+        professional = self.get_object()
+        serializer = WeeklyScheduleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        windows = [(window['day_of_week'], window['start_time'], window['end_time']) for window in serializer.validated_data['availabilities']]
+        created, removed = replace_weekly_schedule(professional.id, windows)
+
+        availabilities = Availability.objects.filter(professional_id=professional.id).select_related('professional').order_by('day_of_week', 'start_time')
+        return Response({
+            "availabilities": AvailabilitySerializer(availabilities, many=True).data,
+            "created": created,
+            "removed": removed,
+        })
+
+class AppointmentViewSet(SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
+    # Joins para client_email, professional_name, service_name e establishment_name em uma única consulta
+    queryset = Appointment.objects.select_related('client', 'professional', 'service', 'establishment').only(
+        *(field.name for field in Appointment._meta.concrete_fields),
+        'client__email', 'professional__name', 'service__name', 'establishment__name',
+    )
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated] # Base para todos
+    pagination_class = AppointmentPagination # Cursor em (start_time, id); '?page=N' mantém o modo antigo
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
-            return Appointment.objects.all()
-        elif user.is_admin: # Admins veem agendamentos do seu estabelecimento
-            if hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-                return Appointment.objects.filter(establishment=user.professional_profile.establishment)
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
+            return self.queryset.all()
+        elif tenant.is_admin: # Admins veem agendamentos do seu estabelecimento
+            if tenant.establishment_id is not None:
+                return self.queryset.filter(establishment_id=tenant.establishment_id)
             return Appointment.objects.none() # Admin sem estabelecimento não vê nada
-        elif user.is_client: # Clientes veem apenas seus próprios agendamentos
-            return Appointment.objects.filter(client=user)
+        elif tenant.is_client: # Clientes veem apenas seus próprios agendamentos
+            return self.queryset.filter(client_id=tenant.user_id)
         return Appointment.objects.none()
 
     def perform_create(self, serializer):
@@ -253,20 +331,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         service = serializer.validated_data['service']
         start_time = serializer.validated_data['start_time']
 
-        if professional.establishment != service.establishment:
-            raise serializers.ValidationError({"detail": "O serviço não pertence ao estabelecimento do profissional."})
-
-        # Verifica sobreposição de agendamentos
-        end_time = start_time + timedelta(minutes=service.duration_minutes)
-        if Appointment.objects.filter(
-            professional=professional,
-            start_time__lt=end_time,
-            end_time__gt=start_time,
-            status__in=['SCHEDULED', 'CONFIRMED', 'PENDING_PAYMENT']
-        ).exists():
-            raise serializers.ValidationError({"detail": "O horário selecionado não está disponível."})
-
-        serializer.save(client=self.request.user, establishment=professional.establishment)
+        # Disponibilidade, feriados e sobreposição em uma única consulta, sob o lock do profissional
+        book_atomically(
+            professional, service, start_time,
+            lambda end_time: serializer.save(client=self.request.user, establishment_id=professional.establishment_id),
+        )
 
 
     def get_permissions(self):
@@ -278,15 +347,36 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             self.permission_classes = [IsOwnerOrAdmin] # Apenas Owner/Admin podem deletar
         return super().get_permissions()
 
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[IsClient])
+    def bulk_book(self, request):
+        serializer = BulkAppointmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        entries = serializer.validated_data['entries']
+
+        # Profissionais e serviços resolvidos em lote (uma consulta cada)
+        professionals = Professional.objects.select_related('establishment').in_bulk({entry['professional'] for entry in entries})
+        services = Service.objects.in_bulk({entry['service'] for entry in entries})
+
+        created, reasons = book_many(request.user, entries, professionals, services)
+
+        rejected = [
+            {"index": index, "start_time": entry['start_time'].isoformat(), **rejection(reason)}
+            for index, (entry, reason) in enumerate(zip(entries, reasons)) if reason
+        ]
+        return Response({
+            "accepted": AppointmentSerializer(created, many=True).data,
+            "rejected": rejected,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
     @action(detail=True, methods=['post'], url_path='cancel', permission_classes=[IsAuthenticated])
     def cancel_appointment(self, request, pk=None):
         appointment = self.get_object()
-        user = request.user
+        tenant = tenant_for(request)
 
         # Permissões: Owner/Admin do estabelecimento ou o próprio cliente
-        if user.is_owner or user.is_admin and user.professional_profile.establishment == appointment.establishment:
+        if tenant.is_owner or tenant.manages(appointment):
             pass # Permitido
-        elif user.is_client and appointment.client == user:
+        elif tenant.is_client and appointment.client_id == tenant.user_id:
             pass # Permitido
         else:
             return Response({"detail": "Você não tem permissão para cancelar este agendamento."}, status=status.HTTP_403_FORBIDDEN)
@@ -295,54 +385,57 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Agendamento já está em um status final e não pode ser cancelado."}, status=status.HTTP_400_BAD_REQUEST)
 
         appointment.status = 'CANCELED'
-        appointment.save()
-        # TODO: Implementar lógica de estorno se já pago
-        Notification.objects.create(
-            user=appointment.client,
-            message=f"Seu agendamento para {appointment.service.name} em {appointment.start_time.strftime('%d/%m/%Y %H:%M')} foi cancelado.",
-            type='APPOINTMENT_CANCELLATION'
-        )
+        with transaction.atomic(): # Cancelamento e aviso confirmados juntos; o envio fica com o worker do outbox
+            appointment.save()
+            # TODO: Implementar lógica de estorno se já pago
+            outbox.enqueue(
+                appointment.client_id,
+                'APPOINTMENT_CANCELLATION',
+                f"Seu agendamento para {appointment.service.name} em {appointment.start_time.strftime('%d/%m/%Y %H:%M')} foi cancelado.",
+            )
         return Response(AppointmentSerializer(appointment).data, status=status.HTTP_200_OK)
 
-class AvailabilityViewSet(viewsets.ModelViewSet):
-    queryset = Availability.objects.all()
+class AvailabilityViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
+    queryset = Availability.objects.select_related('professional').only(
+        *(field.name for field in Availability._meta.concrete_fields), 'professional__name',
+    )
     serializer_class = AvailabilitySerializer
     permission_classes = [IsOwnerOrAdmin] # Apenas proprietários ou admins podem gerenciar
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
-            return Availability.objects.all()
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
+            return self.queryset.all()
+        elif tenant.is_establishment_admin:
             # Admins veem disponibilidades de profissionais do seu estabelecimento
-            return Availability.objects.filter(professional__establishment=user.professional_profile.establishment)
+            return self.queryset.filter(professional__establishment_id=tenant.establishment_id)
         return Availability.objects.none()
 
-class HolidayViewSet(viewsets.ModelViewSet):
+class HolidayViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = Holiday.objects.all()
     serializer_class = HolidaySerializer
     permission_classes = [IsOwnerOrAdmin] # Apenas proprietários ou admins podem gerenciar
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
             return Holiday.objects.all()
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-            return Holiday.objects.filter(establishment=user.professional_profile.establishment)
+        elif tenant.is_establishment_admin:
+            return Holiday.objects.filter(establishment_id=tenant.establishment_id)
         return Holiday.objects.none()
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsOwnerOrAdmin] # Apenas proprietários ou admins podem ver detalhes de pagamento
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser or user.is_owner:
+        tenant = tenant_for(self.request)
+        if tenant.is_superuser or tenant.is_owner:
             return Payment.objects.all()
-        elif user.is_admin and hasattr(user, 'professional_profile') and user.professional_profile.establishment:
-            return Payment.objects.filter(appointment__establishment=user.professional_profile.establishment)
+        elif tenant.is_establishment_admin:
+            return Payment.objects.filter(appointment__establishment_id=tenant.establishment_id)
         return Payment.objects.none()
 
     @action(detail=False, methods=['post'], url_path='create-preference', permission_classes=[IsAuthenticated])
@@ -385,11 +478,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
         try:
             preference_response = mp.preference().create(preference_data)
             preference = preference_response["response"]
-            
-            appointment.mercadopago_preference_id = preference['id']
-            appointment.payment_status = 'PENDING'
-            appointment.status = 'PENDING_PAYMENT' # Atualiza status do agendamento
-            appointment.save()
+
+            with transaction.atomic():
+                lock_professional(appointment.professional_id)
+                appointment.mercadopago_preference_id = preference['id']
+                appointment.payment_status = 'PENDING'
+                appointment.status = 'PENDING_PAYMENT' # Atualiza status do agendamento
+                # Reserva temporária: expira sozinha se o pagamento não chegar (ver release_expired_holds)
+                appointment.hold_expires_at = timezone.now() + holds.hold_ttl()
+                appointment.save()
+                holds.place(appointment)
 
             return Response({
                 "preference_id": preference['id'],
@@ -399,97 +497,50 @@ class PaymentViewSet(viewsets.ModelViewSet):
             logger.error(f"Erro ao criar preferência no Mercado Pago: {e}")
             return Response({"detail": "Erro ao criar preferência de pagamento."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([IsOwnerOrAdmin])
+def slot_cache_stats(request):
+    # Contadores de acerto/erro do cache de horários livres
+    return Response(slot_cache.stats())
+
 @api_view(['POST'])
 @permission_classes([AllowAny]) # Webhook não precisa de autenticação JWT, mas precisará de validação de assinatura MP
 def mercadopago_webhook(request):
+    """
+    Só grava a notificação (deduplicada por pagamento + ação) e responde 200 na hora. A consulta ao
+    Mercado Pago e as mudanças de estado ficam com manage.py process_payment_webhooks (ver payments.py).
+    """
     try:
         data = request.data
-        topic = request.query_params.get('topic')
-
-        if topic == 'payment':
-            payment_id = data.get('id')
-            if not payment_id:
-                return Response({"detail": "ID de pagamento não fornecido."}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Consulta o status do pagamento no Mercado Pago
-            payment_info = mp.payment().get(payment_id)
-            if payment_info and payment_info['response']['status_code'] == 200:
-                mp_payment = payment_info['response']
-                status_mp = mp_payment['status']
-                external_reference = mp_payment.get('external_reference')  # Nosso appointment ID
-
-                try:
-                    appointment = Appointment.objects.get(id=external_reference)
-                except Appointment.DoesNotExist:
-                    logger.warning(f"Webhook: Agendamento com external_reference {external_reference} não encontrado.")
-                    return Response(status=status.HTTP_200_OK)  # Retorna OK para MP
-
-                # Mapeamento de status do Mercado Pago para o seu sistema
-                if status_mp == 'approved':
-                    appointment.payment_status = 'PAID'
-                    appointment.status = 'CONFIRMED'
-                    Notification.objects.create(
-                        user=appointment.client,
-                        message=f"Seu pagamento para o agendamento de {appointment.service.name} foi aprovado! Seu agendamento está confirmado.",
-                        type='PAYMENT_SUCCESS'
-                    )
-                elif status_mp == 'pending':
-                    appointment.payment_status = 'PENDING'
-                    appointment.status = 'PENDING_PAYMENT'
-                elif status_mp == 'refunded':
-                    appointment.payment_status = 'REFUNDED'
-                    appointment.status = 'CANCELED'
-                elif status_mp == 'cancelled':
-                    appointment.payment_status = 'CANCELLED'
-                    appointment.status = 'CANCELED'
-                elif status_mp == 'rejected':
-                    appointment.payment_status = 'REJECTED'
-                    appointment.status = 'PENDING_PAYMENT'
-                    Notification.objects.create(
-                        user=appointment.client,
-                        message=f"Seu pagamento para o agendamento de {appointment.service.name} foi rejeitado. Por favor, tente novamente.",
-                        type='PAYMENT_FAILURE'
-                    )
-
-                appointment.mercadopago_payment_id = payment_id
-                appointment.save()
-
-                # Crie ou atualize o log de pagamento
-                Payment.objects.update_or_create(
-                    mercadopago_id=payment_id,
-                    defaults={
-                        'appointment': appointment,
-                        'status': status_mp,
-                        'amount': mp_payment.get('transaction_amount', 0.0),
-                        'payment_method': mp_payment.get('payment_type_id'),
-                        'response_data': mp_payment,
-                    }
-                )
-
-                return Response(status=status.HTTP_200_OK)
-            else:
-                logger.error(f"Erro ao consultar pagamento no Mercado Pago: {payment_info}")
-                return Response({"detail": "Erro ao consultar pagamento no Mercado Pago."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Outros tópicos podem ser tratados aqui
-        logger.info(f"Webhook recebido: Tópico={topic}, Dados={data}")
+        notification = payments.parse_notification(request.query_params, data)
+        if notification is None:
+            # Outros tópicos podem ser tratados aqui
+            logger.info(f"Webhook recebido: Tópico={request.query_params.get('topic')}, Dados={data}")
+            return Response(status=status.HTTP_200_OK)
+
+        payment_id, action = notification
+        if not payment_id:
+            return Response({"detail": "ID de pagamento não fornecido."}, status=status.HTTP_400_BAD_REQUEST)
+        body = data.dict() if hasattr(data, 'dict') else data
+        payments.record(payment_id, action, {'query': request.query_params.dict(), 'body': body})
         return Response(status=status.HTTP_200_OK)
 
     except Exception as e:
+        # Sem o evento gravado, um erro faz o Mercado Pago reenviar a notificação
         logger.exception(f"Erro inesperado no webhook do Mercado Pago: {e}")
         return Response({"detail": "Erro interno no processamento do webhook."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet): # Apenas leitura e marcação como lida
+class NotificationViewSet(SparseFieldsMixin, viewsets.ReadOnlyModelViewSet): # Apenas leitura e marcação como lida
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user_id=self.request.user.pk).order_by('-created_at')
 
     @action(detail=True, methods=['post'], url_path='mark-as-read')
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        if notification.user != request.user:
+        if notification.user_id != request.user.pk:
             return Response({"detail": "Você não tem permissão para acessar esta notificação."}, status=status.HTTP_403_FORBIDDEN)
         
         notification.is_read = True
@@ -497,24 +548,43 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet): # Apenas leitura e mar
         return Response(NotificationSerializer(notification).data, status=status.HTTP_200_OK)
     logger = logging.getLogger(__name__)
 
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):  # Apenas leitura e marcação como lida
+class NotificationViewSet(SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):  # Apenas leitura e marcação como lida
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination # Cursor em (created_at, id); '?page=N' mantém o modo antigo
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user_id=self.request.user.pk).order_by('-created_at')
 
     @action(detail=True, methods=['post'], url_path='mark-as-read')
     def mark_as_read(self, request, pk=None):
         try:
             notification = self.get_object()
-            if notification.user != request.user:
+            if notification.user_id != request.user.pk:
                 return Response({"detail": "Você não tem permissão para acessar esta notificação."}, status=status.HTTP_403_FORBIDDEN)
 
+            # UPDATE só de is_read (sem save() da linha inteira); o contador desconta apenas se ainda não estava lida
+            unread.mark_read(request.user.pk, Notification.objects.filter(pk=notification.pk))
             notification.is_read = True
-            notification.save()
             return Response(NotificationSerializer(notification).data, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Erro ao marcar notificação como lida: {e}")
-            return Response({"detail": "Erro ao processar a solicitação."}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({"detail": "Erro ao processar a solicitação."}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        # Lido do contador desnormalizado, sem contar as notificações
+        return Response({"unread": unread.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        serializer = NotificationIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = unread.mark_read(request.user.pk, self.get_queryset().filter(id__in=serializer.validated_data['ids']))
+        return Response({"updated": updated, "unread": unread.unread_count(request.user.pk)}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='mark-all-read')
+    def mark_all_read(self, request):
+        updated = unread.mark_read(request.user.pk, self.get_queryset())
+        return Response({"updated": updated, "unread": unread.unread_count(request.user.pk)}, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 import os
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 # -------------------------------
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # CORS antes de tudo
+    'Formulario.metrics.QueryMetricsMiddleware',  # Consultas e latência por rota (ver METRICAS)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,10 +77,65 @@ WSGI_APPLICATION = 'Thark.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Outro arquivo para bancos descartáveis, ex.: DATABASE_NAME=scratch.sqlite3 para o benchmark_indexes
+        'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        'OPTIONS': {
+            # Todo transaction.atomic() pega o lock de escrita no BEGIN (leituras em autocommit não são afetadas).
+            # Serializa agendamentos concorrentes e evita o "database is locked" imediato de transações que leem
+            # e depois escrevem (outbox, webhooks), ao custo de blocos atômicos só de leitura também esperarem
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# -------------------------------
+# CACHE
+# -------------------------------
+# LocMemCache descarta um terço das chaves ao passar de MAX_ENTRIES (padrão 300). Os horários livres (uma chave por
+# profissional/dia: 744 numa consulta de 62 dias com 12 profissionais) ficam num cache próprio, para não derrubar
+# as reservas de checkout, as versões e os contadores, que não podem ser recalculados
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'thark-default',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+    'slots': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'thark-slots',
+        'OPTIONS': {'MAX_ENTRIES': config('SLOT_CACHE_MAX_ENTRIES', default=50_000, cast=int)},
+    },
+}
+
+SLOT_CACHE_TIMEOUT = 60 * 60  # Horários livres por profissional/dia (segundos)
+SLOT_HOLD_TTL = 15 * 60  # Reserva do horário durante o checkout do Mercado Pago (segundos)
+FAST_LIST_RESPONSES = True  # Listagens de agendamentos, serviços e profissionais via .values() + orjson (ver Formulario/fast_list.py)
+FAST_LIST_COMPRESS_MIN_BYTES = 1024  # Corpos maiores que isso são comprimidos (brotli/gzip) conforme o Accept-Encoding
+
+# -------------------------------
+# METRICAS
+# -------------------------------
+# Exportadas em /api/metrics/ no formato do Prometheus. Com METRICS_TOKEN vazio, apenas usuários staff.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Máximo de consultas SQL por rota ('MÉTODO nome-da-rota' ou só o nome, para todos os métodos). Acima disso: aviso no log,
+# ou erro com QUERY_BUDGET_STRICT (ligado pelos testes de orçamento em QueryMetricsTests).
+QUERY_BUDGETS = {
+    'GET establishment-list': 4,
+    'GET service-list': 4,
+    'GET professional-list': 4,
+    'GET appointment-list': 4,
+    'GET availability-list': 4,
+    'GET holiday-list': 4,
+    'GET payment-list': 4,
+    'GET notification-list': 4,
+    'GET establishment-professionals': 4,
+    'GET professional-available-slots': 6,
+    'GET establishment-available-slots': 8,
+}
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
 # -------------------------------
 # AUTENTICAÇÃO
 # -------------------------------
@@ -112,7 +168,7 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # -------------------------------
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Formulario.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -146,8 +202,44 @@ SIMPLE_JWT = {
     "JTI_CLAIM": "jti",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
+
+    # Papéis e estabelecimento embutidos no token (ver Formulario/authentication.py)
+    "TOKEN_OBTAIN_SERIALIZER": "Formulario.authentication.RoleTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "Formulario.authentication.RoleTokenRefreshSerializer",
 }
 
+# Leituras (GET) autenticadas só pelos claims do JWT, sem buscar o usuário no banco.
+# Mudanças de papel invalidam os tokens antigos pela versão ('rv'); o access token dura 5 minutos.
+JWT_STATELESS_READS = config('JWT_STATELESS_READS', default=True, cast=bool)
+# Versão dos papéis em cache (segundos, no máximo ACCESS_TOKEN_LIFETIME). Com LocMemCache cada processo tem a sua cópia:
+# é o atraso máximo para outro worker recusar um token antigo. Um cache compartilhado (Redis) invalida na hora.
+ROLE_VERSION_CACHE_TIMEOUT = config('ROLE_VERSION_CACHE_TIMEOUT', default=60, cast=int)
+
+# -------------------------------
+# PUSH DE NOTIFICAÇÕES (SSE em /api/notifications/stream/, servido pelo ASGI)
+# -------------------------------
+# SocketBroker leva o que o worker do outbox e os lembretes publicam a todos os workers ASGI do host (sockets Unix).
+# No Windows, InProcessBroker: só o próprio processo; o resto chega pelo Last-Event-ID na reconexão
+NOTIFICATION_PUSH_BACKEND = config(
+    'NOTIFICATION_PUSH_BACKEND',
+    default='Formulario.push.SocketBroker' if os.name == 'posix' else 'Formulario.push.InProcessBroker',
+)
+NOTIFICATION_PUSH_SOCKET_DIR = config('NOTIFICATION_PUSH_SOCKET_DIR', default='') # Vazio: <tmp>/thark-push
+NOTIFICATION_STREAM_HEARTBEAT = 25 # Segundos entre comentários de keep-alive
+NOTIFICATION_STREAM_QUEUE_SIZE = 100 # Eventos pendentes por conexão antes de descartar os mais antigos
+
+# -------------------------------
+# OUTBOX DE NOTIFICAÇÕES (despachado por manage.py dispatch_notifications)
+# -------------------------------
+# Classes com 'name' e send(event); a notificação in-app é sempre criada pelo worker. Ex.: Formulario.outbox.FakeAdapter
+NOTIFICATION_DELIVERY_ADAPTERS = config('NOTIFICATION_DELIVERY_ADAPTERS', default='', cast=Csv())
+NOTIFICATION_DELIVERY_CONCURRENCY = 8 # Entregas simultâneas por lote
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+NOTIFICATION_OUTBOX_BACKOFF = 30 # Segundos antes da 2ª tentativa; dobra a cada falha
+NOTIFICATION_OUTBOX_MAX_BACKOFF = 60 * 60
+NOTIFICATION_OUTBOX_LEASE = 5 * 60 # Segundos até um evento reivindicado por um worker que morreu voltar à fila
+APPOINTMENT_REMINDER_WINDOWS = [24 * 60, 60] # Minutos antes do início (manage.py send_appointment_reminders)
+
 # -------------------------------
 # CORS (para o React acessar)
 # -------------------------------
@@ -186,6 +278,13 @@ MERCADO_PAGO_ACCESS_TOKEN = config('MERCADO_PAGO_ACCESS_TOKEN', default='SEU_ACC
 MERCADO_PAGO_CLIENT_ID = config('MERCADO_PAGO_CLIENT_ID', default='SEU_CLIENT_ID_MP')
 MERCADO_PAGO_CLIENT_SECRET = config('MERCADO_PAGO_CLIENT_SECRET', default='SEU_CLIENT_SECRET_MP')
 MERCADO_PAGO_WEBHOOK_URL = config('MERCADO_PAGO_WEBHOOK_URL', default='http://localhost:8000/api/payments/webhook/')
+# Consulta dos pagamentos notificados (manage.py process_payment_webhooks); a URL pode apontar para Formulario.fake_mercadopago
+MERCADO_PAGO_API_URL = config('MERCADO_PAGO_API_URL', default='https://api.mercadopago.com')
+MERCADO_PAGO_LOOKUP_CONCURRENCY = 8 # Consultas simultâneas por lote
+MERCADO_PAGO_LOOKUP_TIMEOUT = 10 # Segundos
+MERCADO_PAGO_WEBHOOK_MAX_ATTEMPTS = 8
+MERCADO_PAGO_WEBHOOK_BACKOFF = 30 # Segundos antes da 2ª tentativa; dobra a cada falha (máximo de 1 hora)
+MERCADO_PAGO_WEBHOOK_LEASE = 5 * 60 # Segundos até um evento reivindicado por um worker que morreu voltar à fila
 
 # -------------------------------
 # PADRÃO